@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Time city-name correction through the trigram index against difflib scans.
+
+The scan is what `match_geo_to_pub78.py` used to do: `get_close_matches`
+over every place in the state, then a `SequenceMatcher` ratio.  Both
+correct the same --queries names (real places with a typo or two, plus
+names that aren't places at all), and the benchmark prints how long each
+took and how often their answers agree.
+
+Places come from `data/census_places_lon_lat/<--state>.txt` if it's
+there, or else --synthetic made-up names (a state's worth, by default):
+
+    python benchmark_city_matcher.py --state IL
+    python benchmark_city_matcher.py --synthetic 1700 --queries 5000
+"""
+import argparse
+import difflib
+import random
+import string
+import time
+
+from city_matcher import CityMatcher, expand_direction
+from gazetteer import read_places
+
+SYLLABLES = ['ab', 'ar', 'ber', 'by', 'chi', 'ca', 'dale', 'den', 'el', 'field', 'ford',
+             'glen', 'ham', 'ing', 'ton', 'lake', 'lin', 'mont', 'mor', 'ville', 'wood',
+             'ro', 'sa', 'spring', 'ter', 'ur', 'vi', 'wa', 'ya', 'zion']
+PREFIXES = ['', '', '', '', 'north ', 'south ', 'east ', 'west ', 'new ', 'mount ', 'lake ']
+
+
+def synthetic_places(count, rng):
+    places = set()
+    while len(places) < count:
+        name = ''.join(rng.choice(SYLLABLES) for __ in range(rng.randint(2, 4)))
+        places.add((rng.choice(PREFIXES) + name).title())
+    return sorted(places)
+
+
+def misspell(name, rng):
+    chars = list(name.lower())
+    for __ in range(rng.randint(1, 2)):
+        i = rng.randrange(1, len(chars)) if len(chars) > 1 else 0
+        edit = rng.random()
+        if edit < 0.3:
+            del chars[i]
+        elif edit < 0.6:
+            chars[i] = rng.choice(string.ascii_lowercase)
+        elif edit < 0.8 and i + 1 < len(chars):
+            chars[i], chars[i + 1] = chars[i + 1], chars[i]
+        else:
+            chars.insert(i, rng.choice(string.ascii_lowercase))
+    return ''.join(chars).upper()
+
+
+def scan_correct(test_city, cities):
+    """The old difflib version, for {lowercased place: place}."""
+    test = expand_direction(test_city.lower())
+    match = difflib.get_close_matches(test, cities.keys(), n=1, cutoff=0)[0]
+    score = difflib.SequenceMatcher(None, test, match).ratio()
+    if not test.startswith(match[0]) and not match.startswith('new'):
+        return test_city
+    elif score < 0.79:
+        return test_city
+    return cities[match]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--state', default='IL')
+    parser.add_argument('--synthetic', type=int, default=1400,
+                        help='places to make up when there is no places file (default 1400)')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    places = [city for city, __, __ in read_places(args.state)]
+    if places:
+        print('{} places in {}'.format(len(places), args.state))
+    else:
+        places = synthetic_places(args.synthetic, rng)
+        print('{} made-up places'.format(len(places)))
+    queries = [misspell(rng.choice(places), rng) if rng.random() < 0.8
+               else misspell(''.join(rng.choice(SYLLABLES) for __ in range(3)), rng)
+               for __ in range(args.queries)]
+
+    start = time.perf_counter()
+    matcher = CityMatcher(places)
+    built = time.perf_counter()
+    indexed = [matcher.correct(q) for q in queries]
+    done = time.perf_counter()
+    print('index: built in {:.3f}s, {:.2f} ms per name'.format(
+        built - start, 1000 * (done - built) / len(queries)))
+
+    cities = {}
+    for place in places:
+        cities.setdefault(place.lower(), place)
+    start = time.perf_counter()
+    scanned = [scan_correct(q, cities) for q in queries]
+    elapsed = time.perf_counter() - start
+    print('scan:  {:.2f} ms per name'.format(1000 * elapsed / len(queries)))
+
+    agree = sum(a == b for a, b in zip(indexed, scanned))
+    fixed = sum(a != q for a, q in zip(indexed, queries))
+    print('{} of {} answers agree ({:.1f}%); the index corrected {}'.format(
+        agree, len(queries), 100 * agree / len(queries), fixed))
+
+
+if __name__ == '__main__':
+    main()
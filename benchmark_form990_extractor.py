@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Compare the compiled single-pass extractor to one find() per column.
+
+Runs both over a corpus of sample returns, checks that they produce the
+same rows, and reports documents per second for each.  By default the
+corpus is whatever is in the local XML cache (see `form990_cache.py`):
+
+    python benchmark_form990_extractor.py
+    python benchmark_form990_extractor.py --repeat 5 'samples/*.xml'
+"""
+import argparse
+import glob
+import gzip
+import os
+import time
+import xml.etree.ElementTree as ET
+
+from form990_cache import CACHE_DIR
+from form990_extractor import FieldExtractor, find_fields
+from get_aws_990_data import getters
+
+
+def load_corpus(patterns, limit=None):
+    paths = sorted(p for pattern in patterns for p in glob.glob(pattern, recursive=True))
+    corpus = []
+    for path in paths[:limit]:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as infile:
+            corpus.append(infile.read())
+    return corpus
+
+
+def time_it(label, extract, corpus, repeat):
+    best = float('inf')
+    for __ in range(repeat):
+        start = time.perf_counter()
+        rows = [extract(content) for content in corpus]
+        best = min(best, time.perf_counter() - start)
+    print('{:<28} {:8.3f}s  {:8.0f} docs/s'.format(label, best, len(corpus) / best))
+    return rows, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('patterns', nargs='*',
+                        default=[os.path.join(CACHE_DIR, '**', '*.xml.gz')],
+                        help='globs of .xml or .xml.gz sample returns')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='use at most this many documents')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='report the best of this many runs (default 3)')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.patterns, args.limit)
+    if not corpus:
+        parser.error('no documents match {}'.format(' '.join(args.patterns)))
+    print('{} documents, {:.1f} MB'.format(
+        len(corpus), sum(len(c) for c in corpus) / 1e6))
+
+    extractor = FieldExtractor(getters)
+    expected, slow = time_it(
+        'find() per column', lambda c: find_fields(ET.fromstring(c), getters),
+        corpus, args.repeat)
+    actual, fast = time_it('compiled single pass', extractor.extract, corpus, args.repeat)
+    print('speedup: {:.1f}x'.format(slow / fast))
+
+    mismatches = sum(1 for a, b in zip(expected, actual) if a != b)
+    if mismatches:
+        print('WARNING: {} of {} documents extracted differently'.format(
+            mismatches, len(corpus)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Time location lookups through the R*Tree against plain table scans.
+
+By default this builds a throwaway database the size of the national
+dataset (--synthetic, 1.5 million organizations clustered around a few
+hundred made-up cities) and runs --queries random bounding-box, radius
+and k-nearest lookups at each of them, printing the median and 95th
+percentile latency.  The scan versions run on the same points and must
+return the same EINs.  Use --db to time a real nonprofits.db instead:
+
+    python benchmark_location_index.py
+    python benchmark_location_index.py --db nonprofits.db --queries 200
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from location_index import LocationIndex, haversine_km, radius_box
+
+STATES = ['IL', 'WA', 'NY', 'GA', 'MI', 'MT', 'CA', 'TX', 'FL', 'OH']
+TAGS = ['arts', 'education', 'health', 'housing', 'religion']
+
+
+def build_synthetic(path, size, seed=0):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    with open('create_nonprofitdb_statements.sql') as infile:
+        for stmt in infile.read().split("\n\n"):
+            conn.execute(stmt)
+    cities = [(rng.uniform(-124, -67), rng.uniform(25, 49), rng.choice(STATES))
+              for __ in range(300)]
+    conn.executemany('INSERT INTO tag (name) VALUES (?)', [(t,) for t in TAGS])
+    tag_ids = dict(conn.execute('SELECT name, id FROM tag'))
+
+    def place(i):
+        lon, lat, state = rng.choice(cities)
+        return '{:09d}'.format(10000000 + i), rng.gauss(lon, 0.2), rng.gauss(lat, 0.2), state
+
+    for first in range(0, size, 50000):
+        batch = [place(i) for i in range(first, min(size, first + 50000))]
+        conn.executemany('INSERT INTO nfp (ein, name) VALUES (?, ?)',
+                         [(b[0], 'Org ' + b[0]) for b in batch])
+        conn.executemany(
+            'INSERT INTO latest_contact_info (ein, business_addr_state, lon, lat) '
+            'VALUES (?, ?, ?, ?)', [(b[0], b[3], b[1], b[2]) for b in batch])
+        conn.executemany('INSERT INTO geo (ein, lon, lat) VALUES (?, ?, ?)',
+                         [b[:3] for b in batch])
+        conn.executemany(
+            'INSERT INTO location VALUES (?, ?, ?, ?, ?, ?)',
+            [(int(b[0]), b[1], b[1], b[2], b[2], b[0]) for b in batch])
+        conn.executemany(
+            'INSERT INTO tag_lookup (tag_id, ein) VALUES (?, ?)',
+            [(tag_ids[rng.choice(TAGS)], b[0]) for b in batch if rng.random() < 0.3])
+    conn.commit()
+    with open('create_nonprofitdb_indexes.sql') as infile:
+        for stmt in infile.read().split("\n\n"):
+            conn.execute(stmt)
+    conn.commit()
+    conn.close()
+
+
+# Plain scans over latest_contact_info, for comparison.
+def scan_box(conn, min_lon, min_lat, max_lon, max_lat):
+    return conn.execute(
+        'SELECT ein, lon, lat FROM latest_contact_info '
+        'WHERE lon BETWEEN ? AND ? AND lat BETWEEN ? AND ?',
+        (min_lon, max_lon, min_lat, max_lat)).fetchall()
+
+
+def scan_radius(conn, lon, lat, radius_km):
+    return [ein for ein, place_lon, place_lat in scan_box(conn, *radius_box(lon, lat, radius_km))
+            if haversine_km(lon, lat, place_lon, place_lat) <= radius_km]
+
+
+def time_queries(label, run, points):
+    times, results = [], []
+    for point in points:
+        start = time.perf_counter()
+        results.append(run(*point))
+        times.append(time.perf_counter() - start)
+    times.sort()
+    print('{:<26} median {:8.2f} ms   p95 {:8.2f} ms'.format(
+        label, 1000 * statistics.median(times), 1000 * times[int(0.95 * (len(times) - 1))]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db', default=None,
+                        help='time this database instead of a synthetic one')
+    parser.add_argument('--synthetic', type=int, default=1500000,
+                        help='organizations in the synthetic database (default 1500000)')
+    parser.add_argument('--queries', type=int, default=100,
+                        help='query points per lookup (default 100)')
+    parser.add_argument('--km', type=float, default=10,
+                        help='radius, and half the box width, in km (default 10)')
+    parser.add_argument('-k', type=int, default=20,
+                        help='neighbors for the nearest lookups (default 20)')
+    args = parser.parse_args()
+
+    tmpdir = None
+    path = args.db
+    if path is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(tmpdir.name, 'synthetic.db')
+        start = time.perf_counter()
+        build_synthetic(path, args.synthetic)
+        print('built a synthetic database of {} in {:.1f}s'.format(
+            args.synthetic, time.perf_counter() - start))
+
+    index = LocationIndex(path)
+    conn = index.conn
+    print('{} organizations with locations'.format(
+        conn.execute('SELECT count(*) FROM location').fetchone()[0]))
+    rng = random.Random(1)
+    # Query around real places, so the lookups find something.
+    sample = conn.execute(
+        'SELECT lon, lat FROM geo WHERE lon IS NOT NULL ORDER BY random() LIMIT ?',
+        (args.queries,)).fetchall()
+    points = [(lon + rng.uniform(-0.05, 0.05), lat + rng.uniform(-0.05, 0.05))
+              for lon, lat in sample]
+    boxes = [radius_box(lon, lat, args.km) for lon, lat in points]
+    state, tag = STATES[0], TAGS[0]
+
+    scanned = time_queries('scan: bbox', lambda *box: scan_box(conn, *box), boxes)
+    indexed = time_queries('rtree: bbox', index.bbox, boxes)
+    boxes_match = all(sorted(r[0] for r in a) == sorted(p.ein for p in b)
+                      for a, b in zip(scanned, indexed))
+    scanned = time_queries('scan: radius', lambda lon, lat: scan_radius(conn, lon, lat, args.km),
+                           points)
+    indexed = time_queries('rtree: radius', lambda lon, lat: index.radius(lon, lat, args.km),
+                           points)
+    radii_match = all(sorted(a) == sorted(p.ein for p in b) for a, b in zip(scanned, indexed))
+    time_queries('rtree: radius + tag', lambda lon, lat: index.radius(
+        lon, lat, args.km, tags=[tag]), points)
+    time_queries('rtree: radius + state', lambda lon, lat: index.radius(
+        lon, lat, args.km, states=[state]), points)
+    time_queries('rtree: {}-nearest'.format(args.k),
+                 lambda lon, lat: index.nearest(lon, lat, args.k), points)
+    time_queries('rtree: {}-nearest + tag'.format(args.k),
+                 lambda lon, lat: index.nearest(lon, lat, args.k, tags=[tag]), points)
+    if not (boxes_match and radii_match):
+        print('WARNING: the R*Tree and the scans returned different EINs')
+
+    index.close()
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
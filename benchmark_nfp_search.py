@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Time keyword lookups through the nfp_search index against LIKE scans.
+
+Picks --queries distinct words from the organization names in the
+database and looks each one up both ways, printing the median and 95th percentile
+latency.  The LIKE scan matches substrings and the index matches stemmed
+words, so their counts are printed side by side rather than compared:
+
+    python benchmark_nfp_search.py --db nonprofits.db
+"""
+import argparse
+import random
+import statistics
+import time
+
+from create_and_populate_database import DBNAME
+from nfp_search import SearchIndex
+
+
+LIKE_QUERY = """
+    SELECT ein FROM nfp
+    WHERE name LIKE :pattern OR mission LIKE :pattern OR activity LIKE :pattern
+       OR description LIKE :pattern OR doing_business_as1 LIKE :pattern
+    LIMIT :limit
+"""
+
+
+def time_queries(label, run, words):
+    times, counts = [], []
+    for word in words:
+        start = time.perf_counter()
+        counts.append(len(run(word)))
+        times.append(time.perf_counter() - start)
+    times.sort()
+    print('{:<20} median {:8.2f} ms   p95 {:8.2f} ms   {:.0f} results on average'.format(
+        label, 1000 * statistics.median(times), 1000 * times[int(0.95 * (len(times) - 1))],
+        statistics.mean(counts)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db', default=DBNAME,
+                        help='database file (default {})'.format(DBNAME))
+    parser.add_argument('--queries', type=int, default=50,
+                        help='words to look up (default 50)')
+    parser.add_argument('--limit', type=int, default=20,
+                        help='results per lookup (default 20)')
+    args = parser.parse_args()
+
+    index = SearchIndex(args.db)
+    conn = index.conn
+    print('{} organizations'.format(conn.execute('SELECT count(*) FROM nfp').fetchone()[0]))
+    # Draw from the distinct words of a sample of names, so a handful of
+    # very common words ("foundation", "church") don't make up most lookups.
+    names = conn.execute(
+        "SELECT name FROM nfp WHERE name != '' ORDER BY random() LIMIT ?",
+        (20 * args.queries,)).fetchall()
+    vocabulary = sorted({word.lower() for name, in names for word in name.split()
+                         if word.isalpha()})
+    rng = random.Random(0)
+    words = rng.sample(vocabulary, min(args.queries, len(vocabulary)))
+
+    time_queries('LIKE scan', lambda word: conn.execute(
+        LIKE_QUERY, {'pattern': '%' + word + '%', 'limit': args.limit}).fetchall(), words)
+    time_queries('nfp_search', lambda word: index.search(word, args.limit), words)
+    time_queries('LIKE scan, all', lambda word: conn.execute(
+        LIKE_QUERY, {'pattern': '%' + word + '%', 'limit': -1}).fetchall(), words)
+    time_queries('nfp_search, all', lambda word: index.search(word, -1), words)
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
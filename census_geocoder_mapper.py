@@ -25,6 +25,32 @@ Output
 "363157630","c/of Armetta Keith 8606 S Blackstone Ave, chicago, IL, 60619","Match","Exact","8606 S BLACKSTONE AVE, CHICAGO, IL, 60619","-87.58789,41.738476","605550571","R","17","031","834300","4009"
     
 
+Throughput
+    `BatchGeocoder` keeps several batches in flight at once over one pooled
+    session, starting new ones no faster than a token-bucket rate limit
+    allows, and retries timeouts, throttling and 5xx responses with
+    backoff.  Rows in a batch that still fails (or that the service
+    leaves out of its answer) are written as No_Match, falling back to
+    the gazetteer if there is one, and counted as failed.  Batch
+    size adapts to the observed time per address, aiming for
+    `target_seconds` per request, and responses are written in the order
+    the batches were read.  Point --url at a local stand-in for testing.
+
+    Results are cached by normalized address (see `geocode_cache.py`), and
+    each distinct address is sent at most once per run, so rows sharing
+    an address with an earlier row -- in this run or a previous one --
+    cost nothing.  The hit rate and lookups avoided go to stderr.
+
+Fallback
+    PO boxes and rows without a street address never go to the service,
+    which can't place them.  With --gazetteer, they and the other rows the
+    Census can't place get the centroid of their city from the places
+    gazetteer (see `gazetteer.py`); without it they're No_Match.
+    --offline answers every row from the gazetteer without any requests.
+    Either way, orig_address is the row's own address, as it was sent.
+    Every row gets a `precision` column: exact, interpolated,
+    city_centroid, or none.
+
 API instructions
     https://geocoding.geo.census.gov/geocoder/Geocoding_Services_API.pdf
     https://www2.census.gov/geo/pdfs/maps-data/data/GeocodingURL.pdf
@@ -32,29 +58,60 @@ API instructions
 more details
     https://www.census.gov/geo/maps-data/data/geocoder.html
 """
+import argparse
+import collections
+import concurrent.futures
+import csv
 import sys
+import threading
 import time
 import requests
 
+from gazetteer import PLACES_DIR, Gazetteer
+from geocode_cache import CACHE_DB, GeocodeCache, normalize_address
+
+
+# Precision of each output row's lon_lat
+EXACT = 'exact'  # the Census matched the address exactly
+INTERPOLATED = 'interpolated'  # the Census matched it approximately
+CITY_CENTROID = 'city_centroid'  # no match; the gazetteer point for the city
+NO_LOCATION = 'none'
+PRECISIONS = {'Exact': EXACT, 'Non_Exact': INTERPOLATED}
+COLUMN_NAMES = (
+    'id', 'orig_address', 'match_or_not', 'exact_or_not', 'matched_address',
+    'lon_lat', 'tiger_line_id', 'side_of_street',
+    'state_fips', 'county_fips', 'census_tract', 'census_block', 'precision'
+)
 
 ONELINE_URL = 'https://geocoding.geo.census.gov/geocoder/geographies/address'
 URL = 'https://geocoding.geo.census.gov/geocoder/geographies/addressbatch'
 
 
-def get_ein_address(row):
+def is_po_box(addr):
+    addr = addr.lower()
+    return ('po box' in addr or
+        'p.o. box' in addr or
+        'p o box' in addr or
+        'p. o. box' in addr
+    )
+
+
+def can_geocode(addr):
+    """False for addresses the batch geocoder never matches: PO boxes, and
+    rows with no street address at all."""
+    return len(addr.strip()) > 0 and not is_po_box(addr)
+
+
+def ein_address(row):
     # EIN, House Number + Street name, City, State, Zip
-    indices = (0, 16, 17, 18, 19, 20) #20, 21)  ### TANYA TANYA FIX FIX FIX ###
+    indices = (0, 16, 17, 18, 20, 21)  # 19 is the Province
     alt_indices = (0, 10, 9, 11, 13, 14)
     components = row.split('\t')
     ein, addr1, addr2, city, state, zipcode = [
         components[i].strip() for i in indices
     ]
     addr = ' '.join((addr1, addr2))
-    if ('po box' in addr.lower() or
-        'p.o. box' in addr.lower() or
-        'p o box' in addr.lower() or
-        'p. o. box' in addr.lower()
-    ):
+    if is_po_box(addr):
         ein, addr1, addr2, city, state, zipcode = [
             components[i].strip() for i in alt_indices
         ]
@@ -62,18 +119,29 @@ def get_ein_address(row):
             addr = ' '.join((addr1, addr2))
         else:
             addr = addr1
-    return '"{}","{}","{}","{}","{}"'.format(ein, addr, city, state, zipcode)
+    return ein, addr, city, state, zipcode
+
+
+def format_address(ident, addr, city, state, zipcode):
+    return '"{}","{}","{}","{}","{}"'.format(ident, addr, city, state, zipcode)
+
+
+def get_ein_address(row):
+    return format_address(*ein_address(row))
 
 
 def make_query(csv_rows,
         returntype='geographies',
         benchmark='Public_AR_Current', # Public_AR_ACS2016',
         vintage='Current_Current',  #Current_ACS2016'
+        format_rows=True,
     ):
     """Prepare the query parameters for the Census Geocoder.
 
     csv_rows should be a list of string rows that we can '\n'.join()
     This is written to accommodate the piped standard input for a Hadoop streaming process.
+    Pass format_rows=False if the rows are already address lines
+    (from `get_ein_address` or `format_address`).
 
     The format of each row is copied here from
     https://www.census.gov/geo/maps-data/data/geocoder.html
@@ -110,7 +178,10 @@ for line in dataset:
     For all layer IDs:
         https://tigerweb.geo.census.gov/ArcGIS/rest/services/TIGERweb/tigerWMS_Current/MapServer
     """
-    parsed_rows = [get_ein_address(row) for row in csv_rows]
+    if format_rows:
+        parsed_rows = [get_ein_address(row) for row in csv_rows]
+    else:
+        parsed_rows = csv_rows
     return (
         {'addressFile': ('input.csv', '\n'.join(parsed_rows), 'text/csv', {'Expires': '0'})},
         dict(
@@ -163,32 +234,318 @@ def make_onerow_query(
 
 
 
-def map():
-    column_names = (
-        'id', 'orig_address', 'match_or_not', 'exact_or_not', 'matched_address',
-        'lon_lat', 'tiger_line_id', 'side_of_street',
-        'state_fips', 'county_fips', 'census_tract', 'census_block'
-    )
-    lines = []
-    print(','.join(column_names))
-    for line in sys.stdin:
+class TokenBucket:
+    """Allow `rate` acquisitions per second on average, in bursts of up to `burst`."""
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class BatchGeocoder:
+    def __init__(self,
+            url=URL,
+            in_flight=4,
+            rate=0.5,
+            batch_size=1000,
+            min_batch_size=100,
+            max_batch_size=10000,
+            target_seconds=180,
+            retries=4,
+            backoff=5,
+            timeout=900,
+        ):
+        """
+        url             -- the batch endpoint
+        in_flight       -- how many batches to have outstanding at once
+        rate            -- the most batches to start per second
+        batch_size      -- rows in the first batch; later ones adapt to the
+                           observed seconds per row, aiming at `target_seconds`
+                           per batch, between `min_batch_size` and
+                           `max_batch_size` (the service takes up to 10,000)
+        retries         -- retries per batch on timeouts and 5xx responses
+        backoff         -- seconds before the first retry; doubles each time
+        timeout         -- seconds to wait for a single response
+        """
+        self.url = url
+        self.in_flight = in_flight
+        self.bucket = TokenBucket(rate)
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_seconds = target_seconds
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.seconds_per_row = None  # moving average of observed latency
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=in_flight)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def next_batch_size(self):
+        with self.lock:
+            if self.seconds_per_row is None:
+                return self.batch_size
+            size = int(self.target_seconds / self.seconds_per_row)
+        return max(self.min_batch_size, min(self.max_batch_size, size))
+
+    def observe(self, rows, seconds):
+        with self.lock:
+            latest = seconds / max(rows, 1)
+            if self.seconds_per_row is None:
+                self.seconds_per_row = latest
+            else:
+                self.seconds_per_row = 0.7 * self.seconds_per_row + 0.3 * latest
+
+    def submit(self, csv_rows):
+        """Post one batch of address lines (see `format_address`) and
+        return the response text, or None if the service refused it or
+        kept failing."""
+        files, query = make_query(csv_rows, format_rows=False)
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            start = time.monotonic()
+            try:
+                response = self.session.post(
+                    self.url, files=files, params=query, timeout=self.timeout)
+                if response.ok:
+                    self.observe(len(csv_rows), time.monotonic() - start)
+                    return response.text
+                problem = 'HTTP {}'.format(response.status_code)
+                if response.status_code < 500 and response.status_code != 429:
+                    break  # the request itself is wrong; retrying won't help
+            except (requests.ConnectionError, requests.Timeout) as e:
+                problem = e.__class__.__name__
+                if isinstance(e, requests.Timeout):
+                    # Make the next batches smaller.
+                    self.observe(len(csv_rows), self.timeout)
+            if attempt < self.retries:
+                sys.stderr.write('Retrying a batch of {} ({})\n'.format(len(csv_rows), problem))
+                time.sleep(delay)
+                delay *= 2
+        sys.stderr.write('Giving up on a batch of {} rows ({})\n'.format(len(csv_rows), problem))
+        return None
+
+    def batches(self, lines):
+        """Group `lines` into batches, sized when each one is started."""
+        lines = iter(lines)
+        while True:
+            size = self.next_batch_size()
+            batch = [line for __, line in zip(range(size), lines)]
+            if not batch:
+                return
+            yield batch
+
+    def geocode(self, lines):
+        """Yield (batch, response text or None) for the address lines in
+        `lines`, in order."""
+        with concurrent.futures.ThreadPoolExecutor(self.in_flight) as executor:
+            pending = collections.deque()
+            for batch in self.batches(lines):
+                if len(pending) >= self.in_flight:
+                    done_batch, future = pending.popleft()
+                    yield done_batch, future.result()
+                pending.append((batch, executor.submit(self.submit, batch)))
+            while pending:
+                done_batch, future = pending.popleft()
+                yield done_batch, future.result()
+
+
+def read_rows(infile):
+    for line in infile:
         if len(line.strip()) == 0 or line.startswith('EIN'):
             continue  # skip the header
-        line = line.strip()
-        lines.append(line)
-        if len(lines) == 1000:  # up to 1000 at a time
-            files, query = make_query(lines)
-            lines = []
-            response = requests.post(URL, files=files, params=query)
-            print(response.text)
-    # finish
-    files, query = make_query(lines)
-    response = requests.post(URL, files=files, params=query)
-    for row in response.text.split('\n'):
-        if 'No_Match' not in row:
-            print(row)
+        yield line.strip()
+
+
+class RunStats:
+    def __init__(self):
+        self.rows = self.cached = self.duplicates = self.local = 0
+        self.submitted = self.batches = self.failed = 0
+        self.precision = collections.Counter()
+
+    def summary(self):
+        avoided = self.cached + self.duplicates + self.local
+        return (
+            'Geocoded {} rows: {} from the cache ({:.1f}% hit rate), {} duplicate '
+            'addresses within the run, {} answered offline, {} addresses sent '
+            'in {} batches ({} rows not geocoded by the service); {} lookups avoided\n'
+            'Precision: {}\n'
+        ).format(
+            self.rows, self.cached, 100 * self.cached / max(self.rows, 1),
+            self.duplicates, self.local, self.submitted, self.batches, self.failed, avoided,
+            ', '.join('{} {}'.format(self.precision[p], p) for p in
+                      (EXACT, INTERPOLATED, CITY_CENTROID, NO_LOCATION)))
+
+
+def geocode_rows(rows, write, geocoder=None, cache=None, gazetteer=None, offline=False):
+    """Geocode Form 990/990N rows and return the RunStats.
+
+    rows  -- iterable of (key, row) pairs, the row a raw tab-separated line
+    write -- called as write(key, output row) for each row, in roughly the
+             order given (rows answered locally come out ahead of ones
+             still waiting on the service)
+
+    With a `geocode_cache.GeocodeCache`, addresses already in it are
+    answered from there, and each distinct address is sent only once per
+    run no matter how many rows share it.  Addresses that can't be
+    geocoded (or all of them, if `offline`) are never sent.  With a
+    `gazetteer.Gazetteer`, unmatched rows fall back to their city's centroid.
+    """
+    geocoder = geocoder or BatchGeocoder()
+    if offline and gazetteer is None:
+        gazetteer = Gazetteer()
+    stats = RunStats()
+    waiting = {}  # normalized address --> (key, EIN, address) of the rows that have it
+    addresses = []  # the submission id of each address sent is its position here
+
+    def answer(key, ein, orig, address, result):
+        """Write `result` (the geocoder's columns after the id) for `ein`,
+        with the row's own address `orig`, padded out to every column and
+        flagged with its precision."""
+        result = list(result) + [''] * (len(COLUMN_NAMES) - 2 - len(result))
+        result[0] = orig
+        precision = PRECISIONS.get(result[2])
+        if precision is None:
+            __, city, state, __ = address.split('|')
+            lon_lat = gazetteer.locate(city, state) if gazetteer is not None else None
+            if lon_lat is not None:
+                result[4] = ','.join(lon_lat)
+                precision = CITY_CENTROID
+            else:
+                precision = NO_LOCATION
+        stats.precision[precision] += 1
+        write(key, [ein] + result + [precision])
+
+    def to_submit():
+        for key, line in rows:
+            stats.rows += 1
+            ein, addr, city, state, zipcode = ein_address(line)
+            address = normalize_address(addr, city, state, zipcode)
+            orig = ', '.join((addr.strip(), city, state, zipcode))
+            if address in waiting:
+                waiting[address].append((key, ein, orig))
+                stats.duplicates += 1
+                continue
+            cached = cache.get(address) if cache is not None else None
+            if cached is not None:
+                stats.cached += 1
+                answer(key, ein, orig, address, cached)
+                continue
+            if offline or not can_geocode(addr):
+                stats.local += 1
+                answer(key, ein, orig, address, [orig, 'No_Match'])
+                continue
+            waiting[address] = [(key, ein, orig)]
+            stats.submitted += 1
+            addresses.append(address)
+            yield format_address(len(addresses) - 1, addr, city, state, zipcode)
+
+    for batch, text in geocoder.geocode(to_submit()):
+        stats.batches += 1
+        results = []
+        for row in csv.reader((text or '').splitlines()):
+            if not row or not row[0].isdigit() or int(row[0]) >= len(addresses):
+                continue
+            address = addresses[int(row[0])]
+            if address not in waiting:
+                continue  # already answered
+            results.append((address, row[1:]))
+            for key, ein, orig in waiting.pop(address):
+                answer(key, ein, orig, address, row[1:])
+        if cache is not None:
+            cache.put_many(results)
+        # Rows the service didn't answer are No_Match for this run only;
+        # they aren't cached, so the next run asks again.
+        for line in batch:
+            address = addresses[int(line.split(',', 1)[0].strip('"'))]
+            for key, ein, orig in waiting.pop(address, ()):
+                stats.failed += 1
+                answer(key, ein, orig, address, [orig, 'No_Match'])
+    return stats
+
+
+def map(infile=sys.stdin, out=sys.stdout, **kwargs):
+    """Geocode the Form 990/990N rows in `infile`, writing CSV to `out`.
+
+    Keyword arguments are passed on to `geocode_rows`.
+    """
+    writer = csv.writer(out, quoting=csv.QUOTE_ALL, lineterminator='\n')
+    print(','.join(COLUMN_NAMES), file=out)
+    stats = geocode_rows(((None, line) for line in read_rows(infile)),
+                         lambda key, row: writer.writerow(row), **kwargs)
+    sys.stderr.write(stats.summary())
     sys.stderr.write('Finished\n')
 
 
+def add_geocoder_arguments(parser):
+    parser.add_argument('--url', default=URL,
+                        help='batch geocoding endpoint (default: the Census service)')
+    parser.add_argument('--in-flight', type=int, default=4,
+                        help='batches outstanding at once (default 4)')
+    parser.add_argument('--rate', type=float, default=0.5,
+                        help='most batches started per second (default 0.5)')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='rows in the first batch (default 1000)')
+    parser.add_argument('--max-batch-size', type=int, default=10000,
+                        help='largest batch to adapt up to (default 10000)')
+    parser.add_argument('--target-seconds', type=float, default=180,
+                        help='aim for batches that take this long (default 180)')
+    parser.add_argument('--retries', type=int, default=4,
+                        help='retries per batch (default 4)')
+    parser.add_argument('--cache', default=CACHE_DB,
+                        help='geocode cache database (default {})'.format(CACHE_DB))
+    parser.add_argument('--no-cache', action='store_true',
+                        help='geocode every address, without reading or filling the cache')
+    parser.add_argument('--gazetteer', nargs='?', const=PLACES_DIR, default=None,
+                        metavar='DIR',
+                        help='fall back to city centroids from the places gazetteer '
+                             '(default directory {}), and skip PO boxes'.format(PLACES_DIR))
+    parser.add_argument('--offline', action='store_true',
+                        help='send nothing to the service; locate every row by '
+                             'its city in the gazetteer')
+
+
+def geocoder_from_args(args):
+    return BatchGeocoder(
+        url=args.url,
+        in_flight=args.in_flight,
+        rate=args.rate,
+        batch_size=args.batch_size,
+        min_batch_size=min(100, args.batch_size),
+        max_batch_size=args.max_batch_size,
+        target_seconds=args.target_seconds,
+        retries=args.retries,
+    )
+
+
 if __name__ == '__main__':
-    map()
+    parser = argparse.ArgumentParser(
+        description='Geocode Form 990/990-N rows from stdin with the Census batch geocoder.')
+    add_geocoder_arguments(parser)
+    args = parser.parse_args()
+    cache = None if args.no_cache else GeocodeCache(args.cache)
+    gazetteer = None
+    if args.gazetteer or args.offline:
+        gazetteer = Gazetteer(args.gazetteer or PLACES_DIR)
+    map(geocoder=geocoder_from_args(args), cache=cache,
+        gazetteer=gazetteer, offline=args.offline)
+    if cache is not None:
+        cache.close()
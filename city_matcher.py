@@ -0,0 +1,148 @@
+"""Fix misspelled city names against the Census places gazetteer.
+
+`match_geo_to_pub78.py` used to compare every tax-form city with every
+place in its state through `difflib`, which is far too slow for the
+990-N stream.  A `CityMatcher` indexes one state's places by character
+trigram instead: a name's candidates are the places sharing the most
+trigrams with it, and only the best few of those are scored exactly
+with `difflib.SequenceMatcher`.
+
+    matcher = CityMatcher(['Chicago', 'Cicero', 'North Chicago'])
+    matcher.correct('chicgo')         # 'Chicago'
+    matcher.correct('N. Chicago')     # 'North Chicago'
+    matcher.correct('Springfield')    # 'Springfield' (kept: nothing close)
+
+A correction is only made when the place starts with the same letter
+(or with "new") and scores at least MIN_SCORE; otherwise the name is
+returned as given.  `CitySpeller` keeps a matcher per state, read from
+`data/census_places_lon_lat/` (see `get_census_places_lon_lats.py`) the
+first time a state comes up, and remembers every answer, so a stream of
+rows that repeats its cities costs one lookup per distinct city:
+
+    speller = CitySpeller()
+    speller.correct('Chicgo', 'IL')                       # one at a time
+    speller.correct_all([('IL', 'Chicgo'), ('WA', 'Seatle')])   # or a batch
+"""
+import collections
+import difflib
+import heapq
+
+from gazetteer import PLACES_DIR, read_places
+
+
+CANDIDATES = 10
+MIN_SCORE = 0.79
+
+_directions = {
+    ('n', 'n.'): 'north',
+    ('s', 's.'): 'south',
+    ('w', 'w.'): 'west',
+    ('e', 'e.'): 'east',
+}
+
+
+def expand_direction(name):
+    """'n. chicago' --> 'north chicago' (for lowercased names)"""
+    split_name = name.split(' ', 1)
+    if len(split_name) > 1:
+        first_word, remainder = split_name
+        for abbr, direction in _directions.items():
+            if first_word in abbr:
+                return ' '.join((direction, remainder))
+    return name
+
+
+def trigrams(name):
+    padded = '  ' + name + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CityMatcher:
+    def __init__(self, places, candidates=CANDIDATES, min_score=MIN_SCORE):
+        """`places` are the correctly spelled names; when two differ only in
+        case, the first one wins."""
+        self.spelling = {}  # lowercased name --> place name
+        for place in places:
+            self.spelling.setdefault(place.lower(), place)
+        self.names = list(self.spelling)
+        self.sizes = []
+        self.index = {}  # trigram --> [position in self.names, ...]
+        for i, name in enumerate(self.names):
+            grams = trigrams(name)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.index.setdefault(gram, []).append(i)
+        self.candidates = candidates
+        self.min_score = min_score
+
+    def match(self, name):
+        """Return (lowercased place, score) for the place closest to the
+        lowercased `name`, or None if no place shares a trigram with it."""
+        grams = trigrams(name)
+        shared = collections.Counter()
+        for gram in grams:
+            ids = self.index.get(gram)
+            if ids:
+                shared.update(ids)
+        if not shared:
+            return None
+        # Rank by the Dice coefficient of the trigram sets, then score the
+        # best few exactly; ties go to the better trigram match.
+        sizes, size = self.sizes, len(grams)
+        best = heapq.nlargest(self.candidates, shared.items(),
+                              key=lambda item: item[1] / (size + sizes[item[0]]))
+        matcher = difflib.SequenceMatcher(None, '', name)
+        scored = []
+        for i, __ in best:
+            matcher.set_seq1(self.names[i])
+            scored.append((matcher.ratio(), -len(scored), self.names[i]))
+        score, __, place = max(scored)
+        return place, score
+
+    def correct(self, city):
+        """The place's spelling of `city`, or `city` itself if none is close."""
+        name = expand_direction(city.lower())
+        if name in self.spelling:
+            return self.spelling[name]
+        found = self.match(name) if name else None
+        if found is None:
+            return city
+        place, score = found
+        if not name.startswith(place[0]) and not place.startswith('new'):
+            return city  # how can they typo the first character?
+        if score < self.min_score:
+            return city
+        return self.spelling[place]
+
+    def correct_many(self, cities):
+        """{city: correction} for each distinct city in `cities`."""
+        return {city: self.correct(city) for city in set(cities)}
+
+
+class CitySpeller:
+    def __init__(self, directory=PLACES_DIR, candidates=CANDIDATES, min_score=MIN_SCORE):
+        self.directory = directory
+        self.candidates = candidates
+        self.min_score = min_score
+        self.matchers = {}  # state --> CityMatcher, or None without a places file
+        self.corrected = {}  # (state, city) --> correction
+
+    def matcher(self, state):
+        state = state.strip().upper()
+        if state not in self.matchers:
+            places = [city for city, __, __ in read_places(state, self.directory)]
+            self.matchers[state] = (CityMatcher(places, self.candidates, self.min_score)
+                                    if places else None)
+        return self.matchers[state]
+
+    def correct(self, city, state):
+        """The census spelling of `city` in `state`, or `city` if there's none close."""
+        key = state, city
+        if key not in self.corrected:
+            matcher = self.matcher(state)
+            self.corrected[key] = city if matcher is None else matcher.correct(city)
+        return self.corrected[key]
+
+    def correct_all(self, pairs):
+        """Correct each (state, city) in `pairs`; return the corrected cities in order."""
+        return [self.correct(city, state) for state, city in pairs]
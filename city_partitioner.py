@@ -0,0 +1,110 @@
+"""Split a stream of rows into per-state, per-city TSV files in one pass.
+
+    partitioner = CityPartitioner(os.path.join('data', 'form990N'), header)
+    for row in rows:
+        partitioner.write(state, city, row)
+    partitioner.close()
+
+Rows go straight to `<directory>/<state>/<city>.txt` (or `no_city.txt`)
+as they arrive, so nothing is held in memory but the files themselves.
+Only `max_open` files are kept open at once; the least recently used is
+closed when another is needed, and reopened for appending if more rows
+for it show up.  Each file is truncated and given the header the first
+time it is written to in a run.
+
+The scripts that use this share a `--states`/`--cities` selection; see
+`add_selection_arguments`.
+"""
+import collections
+import csv
+import os
+
+
+MAX_OPEN = 256
+
+
+def city_filename(city):
+    return 'no_city.txt' if not city else city + '.txt'
+
+
+class CityPartitioner:
+    def __init__(self, directory, header, max_open=MAX_OPEN, delimiter='\t', **fmtparams):
+        """Extra keyword arguments are csv.writer formatting parameters."""
+        self.directory = directory
+        self.header = header
+        self.max_open = max_open
+        self.fmtparams = dict(fmtparams, delimiter=delimiter)
+        self.open_files = collections.OrderedDict()  # path --> (file, writer)
+        self.started = set()  # paths truncated and given a header this run
+        self.rows_written = 0
+
+    def path(self, state, city):
+        return os.path.join(self.directory, state, city_filename(city))
+
+    def _writer(self, path):
+        if path in self.open_files:
+            self.open_files.move_to_end(path)
+            return self.open_files[path][1]
+        if len(self.open_files) >= self.max_open:
+            __, (oldest, __) = self.open_files.popitem(last=False)
+            oldest.close()
+        if path in self.started:
+            outfile = open(path, 'a')
+            writer = csv.writer(outfile, **self.fmtparams)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            outfile = open(path, 'w')
+            writer = csv.writer(outfile, **self.fmtparams)
+            writer.writerow(self.header)
+            self.started.add(path)
+        self.open_files[path] = (outfile, writer)
+        return writer
+
+    def start(self, state, city):
+        """Make sure the file for `city` exists, even if it gets no rows."""
+        self._writer(self.path(state, city))
+
+    def write(self, state, city, row):
+        self._writer(self.path(state, city)).writerow(row)
+        self.rows_written += 1
+
+    def close(self):
+        while self.open_files:
+            __, (outfile, __) = self.open_files.popitem()
+            outfile.close()
+
+
+# ------------------------------------------------------ State/city selection
+def add_selection_arguments(parser, default_states=None):
+    """Add --states and --cities options to an argparse parser.
+
+    `default_states` of None means every state.
+    """
+    parser.add_argument(
+        '--states', nargs='+', metavar='ST', default=default_states,
+        help='two-letter state abbreviations to keep, or "all" (default: {})'.format(
+            ' '.join(default_states) if default_states else 'all'))
+    parser.add_argument(
+        '--cities', nargs='+', metavar='CITY', default=None,
+        help='only keep these cities (case-insensitive; default: all of them)')
+
+
+def selected_states(args):
+    """The upper-case states to keep, or None for all of them."""
+    states = args.states
+    if states is not None and [s.lower() for s in states] == ['all']:
+        states = None
+    return None if states is None else frozenset(s.upper() for s in states)
+
+
+def selection(args):
+    """Return a function (state, city) --> whether the row is wanted."""
+    states = selected_states(args)
+    cities = None if args.cities is None else frozenset(
+        c.replace('_', ' ').lower() for c in args.cities)
+
+    def wanted(state, city):
+        if states is not None and state not in states:
+            return False
+        return cities is None or city.replace('_', ' ').lower() in cities
+    return wanted
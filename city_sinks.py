@@ -0,0 +1,239 @@
+"""Where the acquisition scripts put their rows, chosen with --format.
+
+    tsv      data/<name>/<state>/<city>.txt  (the default, and what the later
+             scripts read)
+    parquet  data/parquet/<name>/file_state=<ST>/file_city=<city>/part-<n>.parquet
+    sqlite   the table <name> in data/acquired.db
+
+Every sink takes rows with `write(state, city, row)` and is closed with
+`close()`; `CityPartitioner` is the TSV sink.  Within a run, the first
+rows for a city replace whatever that city had before, and `start(state,
+city)` does that for a city with no rows at all.  The state and city
+are kept as `file_state` and `file_city` (the names of the TSV sink's
+directory and file), apart from any State or City in the rows themselves.
+
+Parquet and SQLite store the columns named in `types` as numbers (an
+empty or unreadable value becomes null) and everything else as text,
+written the way the TSV files have it (True as 'True', None as ''), so
+readers can pick out just the columns and places they need:
+
+    pyarrow.dataset.dataset('data/parquet/form990', partitioning='hive').to_table(
+        columns=['EIN', 'MissionDesc'], filter=pyarrow.dataset.field('file_state') == 'IL')
+
+    SELECT "EIN", "MissionDesc" FROM form990 WHERE file_state = 'IL'
+
+Parquet needs pyarrow, which is only imported for --format parquet.
+"""
+import collections
+import glob
+import os
+import sqlite3
+
+from city_partitioner import CityPartitioner
+
+
+FORMATS = ('tsv', 'parquet', 'sqlite')
+PARQUET_DIR = os.path.join('data', 'parquet')
+SQLITE_DB = os.path.join('data', 'acquired.db')
+
+SQLITE_TYPES = {int: 'INTEGER', float: 'REAL'}
+
+
+def convert(value, kind):
+    """`value` as a `kind` (int or float), or None if it's empty or not a number."""
+    if value is None or value == '':
+        return None
+    try:
+        return kind(value)
+    except ValueError:
+        return None
+
+
+def text(value):
+    """`value` as csv.writer would write it: '' for None, str() for the rest."""
+    if value is None:
+        return ''
+    return value if isinstance(value, str) else str(value)
+
+
+class ParquetSink:
+    def __init__(self, directory, header, types=None, max_buffered=200000):
+        """Rows are held until `max_buffered` of them are waiting, then the
+        biggest cities' rows are written out as new part files."""
+        try:
+            import pyarrow
+        except ImportError:
+            raise RuntimeError('--format parquet needs pyarrow (pip install pyarrow)')
+        self.directory = directory
+        self.header = list(header)
+        self.types = types or {}
+        arrow_types = {int: pyarrow.int64(), float: pyarrow.float64()}
+        self.schema = pyarrow.schema([
+            (name, arrow_types.get(self.types.get(name), pyarrow.string()))
+            for name in self.header])
+        self.max_buffered = max_buffered
+        self.buffers = {}  # (state, city) --> rows waiting to be written
+        self.buffered = 0
+        self.parts = {}  # (state, city) --> part files written this run
+        self.rows_written = 0
+
+    def path(self, state, city):
+        return os.path.join(self.directory, 'file_state=' + state, 'file_city=' + city)
+
+    def start(self, state, city):
+        key = state, city
+        if key not in self.parts:
+            path = self.path(state, city)
+            for old in glob.glob(os.path.join(path, 'part-*.parquet')):
+                os.remove(old)
+            os.makedirs(path, exist_ok=True)
+            self.parts[key] = 0
+            self.buffers[key] = []
+        return self.buffers[key]
+
+    def write(self, state, city, row):
+        self.start(state, city).append(row)
+        self.buffered += 1
+        if self.buffered >= self.max_buffered:
+            # Write out the biggest cities until half the room is free.
+            for key in sorted(self.buffers, key=lambda k: len(self.buffers[k]), reverse=True):
+                if self.buffered <= self.max_buffered // 2:
+                    break
+                self._flush(key)
+
+    def _flush(self, key):
+        import pyarrow
+        import pyarrow.parquet
+
+        rows = self.buffers[key]
+        if not rows:
+            return
+        columns = []
+        for i, name in enumerate(self.header):
+            values = [row[i] if i < len(row) else '' for row in rows]
+            kind = self.types.get(name)
+            if kind is not None:
+                values = [convert(value, kind) for value in values]
+            else:
+                values = [text(value) for value in values]
+            columns.append(values)
+        table = pyarrow.Table.from_arrays(
+            [pyarrow.array(values, type=field.type)
+             for values, field in zip(columns, self.schema)], schema=self.schema)
+        path = os.path.join(self.path(*key), 'part-{:05d}.parquet'.format(self.parts[key]))
+        pyarrow.parquet.write_table(table, path)
+        self.parts[key] += 1
+        self.buffered -= len(rows)
+        self.rows_written += len(rows)
+        self.buffers[key] = []
+
+    def close(self):
+        for key in self.buffers:
+            self._flush(key)
+
+
+class SQLiteSink:
+    def __init__(self, path, table, header, types=None, batch_size=5000):
+        self.table = table
+        self.types = types or {}
+        self.kinds = [self.types.get(name) for name in header]
+        self.batch_size = batch_size
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        columns = ['file_state', 'file_city'] + list(header)
+        existing = [r[1] for r in self.conn.execute('PRAGMA table_info("{}")'.format(table))]
+        if existing and existing != columns:
+            raise RuntimeError('{} already has a {} table with different columns; '
+                               'drop it first'.format(path, table))
+        self.conn.execute('CREATE TABLE IF NOT EXISTS "{}" (file_state TEXT, file_city TEXT, {})'.format(
+            table, ', '.join('"{}" {}'.format(name, SQLITE_TYPES.get(self.types.get(name), 'TEXT'))
+                             for name in header)))
+        self.conn.execute('CREATE INDEX IF NOT EXISTS "{0}_file" ON "{0}" (file_state, file_city)'.format(
+            table))
+        self.insert = 'INSERT INTO "{}" VALUES ({})'.format(table, ', '.join('?' * len(columns)))
+        self.started = set()
+        self.pending = []
+        self.rows_written = 0
+
+    def start(self, state, city):
+        if (state, city) not in self.started:
+            self.conn.execute('DELETE FROM "{}" WHERE file_state = ? AND file_city = ?'.format(self.table),
+                              (state, city))
+            self.started.add((state, city))
+
+    def write(self, state, city, row):
+        self.start(state, city)
+        values = [row[i] if i < len(row) else None for i in range(len(self.kinds))]
+        for i, kind in enumerate(self.kinds):
+            if kind is not None:
+                values[i] = convert(values[i], kind)
+            elif values[i] is not None:
+                values[i] = text(values[i])
+        self.pending.append([state, city] + values)
+        if len(self.pending) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        self.conn.executemany(self.insert, self.pending)
+        self.conn.commit()
+        self.rows_written += len(self.pending)
+        self.pending = []
+
+    def close(self):
+        self._flush()
+        self.conn.close()
+
+
+class SinkCityFiles:
+    """`crawl_journal.CityFiles`' start/write/close over any sink, keyed by
+    '<state>/<city file>', but without a journal to resume from.
+
+    get_aws_990_data.py starts cities from the fetcher's thread and writes
+    rows from the main one, and neither sink is thread-safe (SQLite won't
+    use a connection from another thread at all).  So `start` only queues
+    the city, and the queue is drained on the sink from `write` and
+    `close`: a city is always queued before its first row."""
+    def __init__(self, sink):
+        self.sink = sink
+        self.starting = collections.deque()  # cities to start on the sink
+
+    def _split(self, city):
+        state, filename = city.split(os.sep, 1)
+        return state, os.path.splitext(filename)[0]
+
+    def _start_queued(self):
+        while self.starting:
+            self.sink.start(*self._split(self.starting.popleft()))
+
+    def start(self, city):
+        self.starting.append(city)
+        return set()
+
+    def write(self, city, ein, row):
+        self._start_queued()
+        self.sink.write(*self._split(city), row)
+
+    def close(self):
+        self._start_queued()
+        self.sink.close()
+
+
+def add_sink_arguments(parser):
+    """Add --format and --sqlite-db options to an argparse parser."""
+    parser.add_argument(
+        '--format', choices=FORMATS, default='tsv',
+        help='tsv: per-city files under data/ (the default); '
+             'parquet: a dataset under {}/; sqlite: a table in --sqlite-db'.format(PARQUET_DIR))
+    parser.add_argument(
+        '--sqlite-db', default=SQLITE_DB,
+        help='database for --format sqlite (default {})'.format(SQLITE_DB))
+
+
+def sink_from_args(args, name, header, types=None):
+    """The sink chosen on the command line, for the dataset `name` (e.g. 'form990N')."""
+    if args.format == 'parquet':
+        return ParquetSink(os.path.join(PARQUET_DIR, name), header, types)
+    if args.format == 'sqlite':
+        return SQLiteSink(args.sqlite_db, name, header, types)
+    return CityPartitioner(os.path.join('data', name), header)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""Cluster the mission statements, as in cluster_missions.ipynb, as a batch job.
+
+    python cluster_missions.py --k 5 12 --processes 4
+
+1. Every mission is tokenized the way the notebook does it, in parallel
+   (see `mission_tokenizer.py`), and its terms weighted by TF-IDF.  The
+   matrix is saved in --out as `tfidf.npz`, with `eins.txt` and
+   `terms.txt` for its rows and columns, and reused as long as the city files (see `mission_corpus.py`)
+   and the vectorizer options stay the same.
+2. Mini-batch k-means runs for each k from the first --k to the second,
+   one k per process.
+3. Results go to --out as they finish:
+
+       sweep.tsv             k, inertia and seconds for each k
+       k<k>/labels.tsv       each EIN and its cluster
+       k<k>/top_terms.tsv    each cluster's size and its heaviest terms
+
+Needs numpy, scipy, scikit-learn and nltk (with its stopwords corpus).
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import scipy.sparse
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.feature_extraction.text import TfidfVectorizer
+from threadpoolctl import threadpool_limits
+
+import mission_corpus
+from mission_tokenizer import TokenizerStats, tokenize_corpus
+
+
+OUT_DIR = os.path.join('data', 'clusters')
+
+
+# ------------------------------------------------------------ TF-IDF matrix
+def matrix_paths(out):
+    return {name: os.path.join(out, name)
+            for name in ('tfidf.npz', 'eins.txt', 'terms.txt', 'tfidf.json')}
+
+
+def fingerprint(sources, options):
+    """Identifies the city files and vectorizer options a matrix came from."""
+    text = json.dumps([sources, options], sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _already_tokenized(tokens):
+    return tokens
+
+
+def build_matrix(missions, min_df, max_features, processes=None):
+    """Return (eins, terms, TF-IDF matrix) for {ein: mission}."""
+    eins = sorted(missions)
+    stats = TokenizerStats()
+    token_sets = list(tokenize_corpus((missions[ein] for ein in eins), processes, stats=stats))
+    print('Tokenized', stats.summary())
+    vectorizer = TfidfVectorizer(analyzer=_already_tokenized, min_df=min_df,
+                                 max_features=max_features, dtype=np.float32)
+    matrix = vectorizer.fit_transform(token_sets)
+    return eins, list(vectorizer.get_feature_names_out()), matrix
+
+
+def load_or_build_matrix(out, min_df=5, max_features=None, rebuild=False, processes=None):
+    """Return (eins, terms, matrix path), building the matrix if it's out of date."""
+    paths = matrix_paths(out)
+    corpus = mission_corpus.load()
+    options = {'min_df': min_df, 'max_features': max_features}
+    wanted = fingerprint(corpus.sources(), options)
+    if not rebuild and all(os.path.exists(p) for p in paths.values()):
+        with open(paths['tfidf.json']) as infile:
+            if json.load(infile).get('fingerprint') == wanted:
+                corpus.close()
+                with open(paths['eins.txt']) as infile:
+                    eins = infile.read().split('\n')
+                with open(paths['terms.txt']) as infile:
+                    terms = infile.read().split('\n')
+                print('Reusing the TF-IDF matrix in {}'.format(paths['tfidf.npz']))
+                return eins, terms, paths['tfidf.npz']
+
+    start = time.perf_counter()
+    missions = corpus.missions()
+    corpus.close()
+    eins, terms, matrix = build_matrix(missions, min_df, max_features, processes)
+    os.makedirs(out, exist_ok=True)
+    scipy.sparse.save_npz(paths['tfidf.npz'], matrix)
+    with open(paths['eins.txt'], 'w') as outfile:
+        outfile.write('\n'.join(eins))
+    with open(paths['terms.txt'], 'w') as outfile:
+        outfile.write('\n'.join(terms))
+    with open(paths['tfidf.json'], 'w') as outfile:
+        json.dump({'fingerprint': wanted, 'options': options,
+                   'shape': matrix.shape, 'nnz': matrix.nnz}, outfile)
+    print('Built a {} x {} TF-IDF matrix in {:.1f}s'.format(
+        matrix.shape[0], matrix.shape[1], time.perf_counter() - start))
+    return eins, terms, paths['tfidf.npz']
+
+
+# ------------------------------------------------------------------ k sweep
+_matrix = None
+
+
+def _init_worker(path, threads):
+    global _matrix
+    if _matrix is None:  # forked workers already have it
+        _matrix = scipy.sparse.load_npz(path)
+    threadpool_limits(threads)
+
+
+def _cluster(k, batch_size, seed):
+    start = time.perf_counter()
+    model = MiniBatchKMeans(n_clusters=k, batch_size=batch_size, n_init=3,
+                            random_state=seed).fit(_matrix)
+    return k, model.inertia_, model.labels_, model.cluster_centers_, time.perf_counter() - start
+
+
+def sweep(path, ks, processes=None, batch_size=4096, seed=0):
+    """Yield (k, inertia, labels, centers, seconds) for each k, as each finishes."""
+    global _matrix
+    processes = min(processes or os.cpu_count() or 1, len(ks))
+    threads = max(1, (os.cpu_count() or 1) // processes)
+    context = None
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+        _matrix = scipy.sparse.load_npz(path)
+    try:
+        with ProcessPoolExecutor(processes, mp_context=context, initializer=_init_worker,
+                                 initargs=(path, threads)) as executor:
+            futures = [executor.submit(_cluster, k, batch_size, seed) for k in ks]
+            for future in as_completed(futures):
+                yield future.result()
+    finally:
+        _matrix = None
+
+
+def top_terms(centers, terms, count):
+    """The `count` heaviest terms of each cluster center."""
+    return [[terms[i] for i in np.argsort(center)[::-1][:count]] for center in centers]
+
+
+def write_clusters(out, k, eins, labels, centers, terms, count):
+    directory = os.path.join(out, 'k{}'.format(k))
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'labels.tsv'), 'w') as outfile:
+        outfile.write('EIN\tcluster\n')
+        outfile.writelines('{}\t{}\n'.format(ein, label) for ein, label in zip(eins, labels))
+    sizes = np.bincount(labels, minlength=k)
+    with open(os.path.join(directory, 'top_terms.tsv'), 'w') as outfile:
+        outfile.write('cluster\tsize\tterms\n')
+        for label, words in enumerate(top_terms(centers, terms, count)):
+            outfile.write('{}\t{}\t{}\n'.format(label, sizes[label], ' '.join(words)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--k', type=int, nargs=2, default=[5, 12], metavar=('FIRST', 'LAST'),
+                        help='cluster counts to try, inclusive (default 5 12)')
+    parser.add_argument('--out', default=OUT_DIR,
+                        help='where to write everything (default {})'.format(OUT_DIR))
+    parser.add_argument('--processes', type=int, default=None,
+                        help='processes to tokenize with, and clusterings to run at once '
+                             '(default: one per CPU)')
+    parser.add_argument('--batch-size', type=int, default=4096,
+                        help='mini-batch size (default 4096)')
+    parser.add_argument('--min-df', type=int, default=5,
+                        help='ignore terms in fewer missions than this (default 5)')
+    parser.add_argument('--max-features', type=int, default=None,
+                        help='keep only this many of the most frequent terms')
+    parser.add_argument('--top-terms', type=int, default=20,
+                        help='terms to list for each cluster (default 20)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rebuild', action='store_true',
+                        help='rebuild the TF-IDF matrix even if it looks up to date')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    eins, terms, path = load_or_build_matrix(args.out, args.min_df, args.max_features,
+                                             args.rebuild, args.processes)
+    ks = list(range(args.k[0], args.k[1] + 1))
+    inertias = {}
+    for k, inertia, labels, centers, seconds in sweep(path, ks, args.processes,
+                                                      args.batch_size, args.seed):
+        write_clusters(args.out, k, eins, labels, centers, terms, args.top_terms)
+        inertias[k] = inertia, seconds
+        print('k={:<3} inertia {:12.1f}  ({:.1f}s)'.format(k, inertia, seconds))
+    with open(os.path.join(args.out, 'sweep.tsv'), 'w') as outfile:
+        outfile.write('k\tinertia\tseconds\n')
+        for k in sorted(inertias):
+            outfile.write('{}\t{}\t{:.2f}\n'.format(k, *inertias[k]))
+    print('Done in {:.1f}s; results in {}'.format(time.perf_counter() - start, args.out))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Checkpointed per-city output for long crawls, so they can resume.
+
+Rows for each city go to a partial file under `<directory>/.partial/`,
+and every row written is recorded in a journal, `<directory>/.journal`,
+as the EIN it came from plus the size of the partial file afterwards.
+When a city is complete its partial file is renamed over the real one,
+so `<directory>/<state>/<city>` only ever holds finished output (the
+dot-directories are invisible to the `glob('data/form990*/*/*')` that
+the later scripts use).
+
+Journal lines are tab-separated:
+
+    W   <state>/<city>   <ein>   <partial file size after the row>
+    D   <state>/<city>
+
+On resume, finished cities are skipped; each unfinished city's partial
+file is cut back to the last size the journal vouches for, and only the
+EINs with rows before that point count as done.  That keeps the output
+consistent even if the crawl died between writing a row and journaling it.
+"""
+import csv
+import os
+import shutil
+
+
+class CityFiles:
+    def __init__(self, directory, header, resume=False):
+        self.directory = directory
+        self.header = header
+        self.partial_dir = os.path.join(directory, '.partial')
+        self.journal_path = os.path.join(directory, '.journal')
+        self.finished = set()
+        self.journaled = {}  # city --> [(ein, size after its row), ...]
+        if resume:
+            self._load_journal()
+        else:
+            shutil.rmtree(self.partial_dir, ignore_errors=True)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.journal = open(self.journal_path, 'a')
+        self.order = []  # cities in the order they were started
+        self.position = 0  # the first city in `order` not yet finished
+        self.current = None
+        self.outfile = self.writer = None
+
+    def _load_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path) as infile:
+            for line in infile:
+                if not line.endswith('\n'):
+                    break  # cut off mid-line by a crash
+                fields = line.rstrip('\n').split('\t')
+                if fields[0] == 'D':
+                    self.finished.add(fields[1])
+                elif fields[0] == 'W':
+                    self.journaled.setdefault(fields[1], []).append(
+                        (fields[2], int(fields[3])))
+
+    def partial_path(self, city):
+        return os.path.join(self.partial_dir, city)
+
+    def start(self, city):
+        """Get `city` ('<state>/<city file>') ready for rows.
+
+        Returns the set of EINs whose rows are already written, or None if
+        the whole city is already finished.
+        """
+        if city in self.finished:
+            return None
+        path = self.partial_path(city)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        done = [(ein, offset) for ein, offset in self.journaled.get(city, ())
+                if offset <= size]
+        if done:
+            with open(path, 'r+') as outfile:
+                outfile.truncate(done[-1][1])
+        else:
+            with open(path, 'w') as outfile:
+                csv.writer(outfile, delimiter='\t').writerow(self.header)
+        self.order.append(city)
+        return set(ein for ein, __ in done)
+
+    def write(self, city, ein, row):
+        """Append `row` for `ein` to `city`, finishing any cities before it."""
+        if city != self.current:
+            self._close_current()
+            self._finish_until(city)
+            self.current = city
+            self.outfile = open(self.partial_path(city), 'a')
+            self.writer = csv.writer(self.outfile, delimiter='\t')
+        self.writer.writerow(row)
+        self.outfile.flush()
+        size = os.fstat(self.outfile.fileno()).st_size
+        self.journal.write('W\t{}\t{}\t{}\n'.format(city, ein, size))
+        self.journal.flush()
+
+    def _close_current(self):
+        if self.outfile is not None:
+            self.outfile.close()
+            self.outfile = self.writer = None
+
+    def _finish_until(self, city=None):
+        """Finish every started city before `city` (or all of them)."""
+        while self.position < len(self.order) and self.order[self.position] != city:
+            self.finish(self.order[self.position])
+            self.position += 1
+
+    def finish(self, city):
+        path = self.partial_path(city)
+        with open(path) as infile:
+            os.fsync(infile.fileno())
+        destination = os.path.join(self.directory, city)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(path, destination)
+        self.journal.write('D\t{}\n'.format(city))
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def close(self):
+        """Finish every remaining city; call once all rows are written."""
+        self._close_current()
+        self._finish_until()
+        self.journal.close()
+        shutil.rmtree(self.partial_dir, ignore_errors=True)
@@ -1,27 +1,251 @@
+#!/usr/bin/env python3
+"""Build or refresh `nonprofits.db` from the Form 990/990N, geo and tag data.
+
+The database keeps a manifest of the files it was loaded from (the
+`source_file` table: path, size, mtime and SHA-1), and every row records
+the file it came from.  Re-running the script only reloads what changed:
+rows from city files that were edited or removed are deleted, and the
+new and edited files are loaded, so a weekly refresh touches a few
+hundred files rather than all of them.  A file whose mtime changed but
+whose contents didn't is left alone.  Use --rebuild to start over.
+
+When an EIN shows up in more than one file, the row loaded last wins,
+as it always has.  The `source_ein` table records which files each EIN
+is in, so after loading what changed, a refresh goes back over every
+file that has one of the EINs it deleted or loaded, in path order, and
+re-adds those EINs' nfp, geo and tag rows; it ends up with the same rows
+as a full load.
+
+Rows are streamed from the city files and inserted `--batch-size` at a
+time with executemany, all in one transaction.  With --bulk the load
+also runs with journaling and fsync turned down and a bigger page cache
+(they are put back once it's done); if the load dies part way, delete
+the database and start again.
+
+Indexes (`create_nonprofitdb_indexes.sql`) are built once the data is
+in, which is much faster than keeping them up to date row by row.  So is
+the `nfp_search` full-text index (see `nfp_search.py`); after that,
+triggers on nfp keep it up to date.
+
+The `combined_data` view joins five tables every time it's queried.
+--materialize stores it as the table `combined_data_materialized`, with
+indexes on ein and (state, city); after changing the data, rebuild that
+table on its own with
+
+    python create_and_populate_database.py --refresh-combined
+
+The load time and peak memory use are printed at the end, to catch
+regressions.
+"""
+import argparse
+import collections
 import csv
+import fnmatch
+import functools
 import glob
+import hashlib
 import json
 import os
+import resource
 import sqlite3
+import sys
+import time
 import yaml
 
 from nonprofitdb_insertion_statements import insertions
 
 DBNAME = 'nonprofits.db'
-conn = sqlite3.connect(DBNAME)
-c = conn.cursor()
-create_statements = open('create_nonprofitdb_statements.sql').read()
-for stmt in create_statements.split("\n\n"):
-    c.execute(stmt)
-conn.commit()
+BATCH_SIZE = 10000
 
-
-# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Form 990/990N Data
-print("Loading the Form 990/990N data.")
-city_paths = glob.glob(os.path.join('data', 'form990*', '*', '*'))
 queries = insertions['statements']
 cols = insertions['columns']
 
+FORM_PATTERN = os.path.join('data', 'form990*', '*', '*')
+GEO_PATTERN = os.path.join('data', 'geo990*', '*', '*')
+TAGS_PATH = os.path.join('data', 'tagged_eins', 'all_tags.yml')
+TAGGED_PATTERN = os.path.join('data', 'tagged_eins', '*', '*.json')
+
+# The tables holding rows from each kind of source file
+FORM_TABLES = ('nfp', 'year_terminated', 'tax_return', 'latest_contact_info')
+GEO_TABLES = ('geo',)
+TAGGED_TABLES = ('tag_lookup',)
+
+
+class Batches:
+    """Collect parameter rows per statement and run them `batch_size` at a time."""
+    def __init__(self, cursor, batch_size=BATCH_SIZE):
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.pending = {}  # query --> list of parameter rows
+        self.counts = collections.Counter()  # query --> rows added
+
+    def add(self, query, params):
+        batch = self.pending.setdefault(query, [])
+        batch.append(params)
+        self.counts[query] += 1
+        if len(batch) >= self.batch_size:
+            self.cursor.executemany(query, batch)
+            self.pending[query] = []
+
+    def flush(self):
+        for query, batch in self.pending.items():
+            if batch:
+                self.cursor.executemany(query, batch)
+        self.pending = {}
+
+
+def read_rows(fname, **kwargs):
+    """Yield each row of the city file `fname` as a dict."""
+    with open(fname) as infile:
+        yield from csv.DictReader(infile, **kwargs)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Manifest of source files
+def file_sha1(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """The `source_file` table: what each file looked like when it was loaded."""
+    def __init__(self, conn):
+        self.conn = conn
+        self.known = {
+            path: (source_id, size, mtime, sha1)
+            for source_id, path, size, mtime, sha1 in conn.execute(
+                'SELECT id, path, size, mtime, sha1 FROM source_file')
+        }
+        self.changed = self.removed = 0
+
+    def changes(self, pattern):
+        """Compare the files matching `pattern` with the manifest.
+
+        Returns (stale, to_load): the source ids whose rows must be
+        deleted (files edited or gone), and the (source id, path) of each
+        file to load (new or edited).  The manifest is updated to match.
+        """
+        stale, to_load = [], []
+        paths = sorted(glob.glob(pattern))
+        for path in paths:
+            stat = os.stat(path)
+            known = self.known.get(path)
+            if known is not None and known[1:3] == (stat.st_size, stat.st_mtime):
+                continue
+            sha1 = file_sha1(path)
+            if known is None:
+                source_id = self.conn.execute(
+                    'INSERT INTO source_file (path, size, mtime, sha1) VALUES (?, ?, ?, ?)',
+                    (path, stat.st_size, stat.st_mtime, sha1)).lastrowid
+            else:
+                source_id = known[0]
+                self.conn.execute(
+                    'UPDATE source_file SET size = ?, mtime = ?, sha1 = ? WHERE id = ?',
+                    (stat.st_size, stat.st_mtime, sha1, source_id))
+            self.known[path] = (source_id, stat.st_size, stat.st_mtime, sha1)
+            if known is not None:
+                if known[3] == sha1:
+                    continue  # touched, but the same contents
+                stale.append(source_id)
+            to_load.append((source_id, path))
+        self.changed += len(to_load)
+
+        paths = set(paths)
+        for path, (source_id, __, __, __) in list(self.known.items()):
+            if fnmatch.fnmatch(path, pattern) and path not in paths:
+                stale.append(source_id)
+                self.conn.execute('DELETE FROM source_file WHERE id = ?', (source_id,))
+                del self.known[path]
+                self.removed += 1
+        return stale, to_load
+
+    def files(self, pattern):
+        """(source id, path) of every known file matching `pattern`, in path order."""
+        return [(source_id, path) for path, (source_id, __, __, __)
+                in sorted(self.known.items()) if fnmatch.fnmatch(path, pattern)]
+
+
+def delete_rows(c, tables, source_ids, mark_touched=False):
+    """Delete the rows that came from `source_ids` out of `tables`,
+    first recording their EINs in `touched` if `mark_touched`."""
+    for source_id in source_ids:
+        if mark_touched:
+            c.execute('INSERT OR IGNORE INTO touched (ein) '
+                      'SELECT ein FROM {} WHERE source_id = ?'.format(tables[-1]),
+                      (source_id,))
+        for table in tables:
+            c.execute('DELETE FROM {} WHERE source_id = ?'.format(table), (source_id,))
+
+
+def forget_sources(c, source_ids, refresh=False):
+    """Drop `source_ids` from `source_ein`, first recording their EINs in
+    `reowned` if `refresh`."""
+    for source_id in source_ids:
+        if refresh:
+            c.execute('INSERT OR IGNORE INTO reowned (ein) '
+                      'SELECT ein FROM source_ein WHERE source_id = ?', (source_id,))
+        c.execute('DELETE FROM source_ein WHERE source_id = ?', (source_id,))
+
+
+def replay(c, batches, manifest, pattern, add_rows):
+    """Re-add the rows for the EINs in `reowned` from each file matching
+    `pattern` that has any of them, in the order a full load reads them.
+
+    For the tables keeping one row per EIN (or per EIN and tag), where the
+    file loaded last wins.  `add_rows(batches, source_id, path, eins)`
+    adds one file's rows for `eins`.
+    """
+    eins = {ein for ein, in c.execute('SELECT ein FROM reowned')}
+    sources = {source_id for source_id, in c.execute(
+        'SELECT DISTINCT source_id FROM source_ein WHERE ein IN (SELECT ein FROM reowned)')}
+    c.execute('DELETE FROM reowned')
+    for source_id, path in manifest.files(pattern):
+        if source_id in sources:
+            add_rows(batches, source_id, path, eins)
+    batches.flush()
+
+
+def set_bulk_pragmas(conn, cache_mb):
+    conn.execute('PRAGMA journal_mode = MEMORY')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute('PRAGMA cache_size = {:d}'.format(-1024 * cache_mb))  # in KiB
+
+
+def reset_pragmas(conn):
+    conn.execute('PRAGMA journal_mode = DELETE')
+    conn.execute('PRAGMA synchronous = FULL')
+
+
+def run_sql_file(conn, path):
+    """Run the blank-line-separated statements in `path` in one transaction."""
+    with open(path) as infile:
+        statements = infile.read().split("\n\n")
+    conn.execute('BEGIN')
+    for stmt in statements:
+        conn.execute(stmt)
+    conn.commit()
+
+
+def create_indexes(conn):
+    print("Creating the indexes.")
+    run_sql_file(conn, 'create_nonprofitdb_indexes.sql')
+
+
+def refresh_combined_data(conn):
+    print("Materializing combined_data.")
+    run_sql_file(conn, 'refresh_combined_data.sql')
+
+
+def peak_rss_mb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return usage / (1 << 20) if sys.platform == 'darwin' else usage / 1024
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Form 990/990N Data
 def process_tax_return(row):
     result = []
     for c in cols['tax_return']:
@@ -31,74 +255,223 @@ def process_tax_return(row):
             result.append(row.get(c, ''))
     return result
 
-for fname in city_paths:
-    with open(fname) as infile:
-        rdr = csv.DictReader(infile, delimiter='\t')
-        dataset = [row for row in rdr]
-    c.executemany(
-        queries['nfp'],
-        [[row.get(c, '') for c in cols['nfp']] for row in dataset]
-    )
-    c.executemany(
-        queries['year_terminated'],
-        [(row.get('EIN'), int(row.get('TaxYr', 2015))) for row in dataset
-            if row.get('Is Terminated') == 'T' and row.get('EIN')
-        ]
-    )
-    c.executemany(
-        queries['tax_return'],
-        [process_tax_return(row) for row in dataset
-            if row.get('Is Terminated') != 'T'
-        ]
-    )
-    c.executemany(
-        queries['latest_contact_info'],
-        [[row.get(c, '') for c in cols['latest_contact_info']] for row in dataset
-            if row.get('Is Terminated') != 'T'
-        ]
-    )
-
-
-conn.commit()
+
+def nfp_params(row, source_id):
+    return [row.get(c, '') for c in cols['nfp']] + [source_id]
+
+
+def add_nfp_rows(batches, source_id, fname, eins):
+    for row in read_rows(fname, delimiter='\t'):
+        if row.get('EIN', '') in eins:
+            batches.add(queries['nfp'], nfp_params(row, source_id))
+
+
+def load_returns(c, batches, manifest, refresh=False):
+    print("Loading the Form 990/990N data.")
+    stale, to_load = manifest.changes(FORM_PATTERN)
+    forget_sources(c, stale, refresh)
+    delete_rows(c, FORM_TABLES, stale, mark_touched=True)
+    for source_id, fname in to_load:
+        for row in read_rows(fname, delimiter='\t'):
+            batches.add(queries['nfp'], nfp_params(row, source_id))
+            batches.add(queries['source_ein'], (source_id, row.get('EIN', '')))
+            if refresh:
+                batches.add(queries['reowned'], (row.get('EIN', ''),))
+            if row.get('Is Terminated') == 'T':
+                if row.get('EIN'):
+                    batches.add(queries['year_terminated'],
+                                (row.get('EIN'), int(row.get('TaxYr', 2015)), source_id))
+            else:
+                batches.add(queries['tax_return'], process_tax_return(row) + [source_id])
+                batches.add(queries['latest_contact_info'],
+                            [row.get(c, '') for c in cols['latest_contact_info']] + [source_id])
+                batches.add(queries['touched'], (row.get('EIN'),))
+    batches.flush()
+    if refresh:
+        replay(c, batches, manifest, FORM_PATTERN, add_nfp_rows)
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Geo (lon, lat) Data
-print("Loading the Geo (longitude, latitude) data.")
-city_paths = glob.glob(os.path.join('data', 'geo990*', '*', '*'))
-query = queries['latest_contact_info_geo_update']
 def row_to_lon_lat(row):
     ein = row.get('id')
     lon_lat = row.get('lon_lat')
-    if lon_lat is not None:
+    if lon_lat:  # blank or missing when the address wasn't located
         lon, lat = [float(deg) for deg in lon_lat.split(',')]
     else:
         lon = lat = None
     return lon, lat, ein
 
-for fname in city_paths:
-    with open(fname) as infile:
-        rdr = csv.DictReader(infile)
-        for row in rdr:
-            c.execute(query, row_to_lon_lat(row))
-            
-conn.commit()
+
+def add_geo_rows(batches, source_id, fname, eins):
+    for row in read_rows(fname):
+        lon, lat, ein = row_to_lon_lat(row)
+        if ein in eins:
+            batches.add(queries['geo'], (lon, lat, ein, source_id))
+            batches.add(queries['touched'], (ein,))
+
+
+def load_geo(c, batches, manifest, refresh=False):
+    """Keep the lon/lat pairs in the `geo` table, keyed by EIN, and copy
+    them into latest_contact_info and the `location` R*Tree for every EIN
+    whose rows changed."""
+    print("Loading the Geo (longitude, latitude) data.")
+    if c.execute('SELECT 1 FROM location LIMIT 1').fetchone() is None:
+        # Fill in the spatial index of a database built before it existed.
+        c.execute('INSERT OR IGNORE INTO touched (ein) SELECT ein FROM geo')
+    stale, to_load = manifest.changes(GEO_PATTERN)
+    forget_sources(c, stale, refresh)
+    delete_rows(c, GEO_TABLES, stale, mark_touched=True)
+    for source_id, fname in to_load:
+        for row in read_rows(fname):
+            lon, lat, ein = row_to_lon_lat(row)
+            batches.add(queries['geo'], (lon, lat, ein, source_id))
+            batches.add(queries['touched'], (ein,))
+            batches.add(queries['source_ein'], (source_id, ein))
+            if refresh:
+                batches.add(queries['reowned'], (ein,))
+    batches.flush()
+    if refresh:
+        replay(c, batches, manifest, GEO_PATTERN, add_geo_rows)
+    c.execute(queries['latest_contact_info_geo_update_touched'])
+    c.execute(queries['location_delete_touched'])
+    c.execute(queries['location_insert_touched'])
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Tags
-print("Loading the tags.")
-query = queries['tag']
-all_tags = yaml.load(open(os.path.join('data', 'tagged_eins', 'all_tags.yml')).read())
-c.executemany(query, [(k,) for k in all_tags.keys()])
-conn.commit()
-
-query = queries['tag_lookup']
-city_paths = glob.glob(os.path.join('data', 'tagged_eins', '*', '*.json'))
-for fname in city_paths:
-    data = json.loads(open(fname).read())
-    del data['EIN']  # TODO: fix the reason this exists...apparently tagged header too
+def add_tag_rows(tag_ids, batches, source_id, fname, eins=None):
+    """Add the tag_lookup rows from `fname`, only for `eins` if given, and
+    return the EINs they're for."""
+    with open(fname) as infile:
+        data = json.load(infile)
+    data.pop('EIN', None)  # files tagged before the header row was skipped have it
     for ein, tags in data.items():
+        if eins is not None and ein not in eins:
+            continue
+        batches.add(queries['source_ein'], (source_id, ein))
         for t in tags:
-            c.execute(query, (ein, t))
+            if t in tag_ids:  # tags missing from all_tags.yml are dropped
+                batches.add(queries['tag_lookup_by_id'], (tag_ids[t], ein, source_id))
+    return data.keys()
+
 
-conn.commit()
-print("Done. database is in {}".format(DBNAME))
+def load_tags(c, batches, manifest, refresh=False):
+    print("Loading the tags.")
+    __, tags_changed = manifest.changes(TAGS_PATH)
+    if tags_changed:
+        with open(TAGS_PATH) as infile:
+            all_tags = yaml.safe_load(infile)
+        c.executemany(queries['tag'], [(k,) for k in all_tags.keys()])
+        c.execute('CREATE TEMP TABLE current_tag (name TEXT PRIMARY KEY)')
+        c.executemany('INSERT INTO current_tag VALUES (?)', [(k,) for k in all_tags.keys()])
+        c.execute('DELETE FROM tag WHERE name NOT IN (SELECT name FROM current_tag)')
+        c.execute('DROP TABLE current_tag')
+    # Resolve tag names to ids once, instead of a subquery per insert.
+    tag_ids = dict(c.execute('SELECT name, id FROM tag'))
+
+    stale, to_load = manifest.changes(TAGGED_PATTERN)
+    if tags_changed:
+        # The tag list changed, so every file's tags need resolving again,
+        # in path order, which leaves nothing to replay.
+        refresh = False
+        c.execute('DELETE FROM tag_lookup')
+        to_load = manifest.files(TAGGED_PATTERN)
+    else:
+        delete_rows(c, TAGGED_TABLES, stale)
+    forget_sources(c, stale, refresh)
+    for source_id, fname in to_load:
+        eins = add_tag_rows(tag_ids, batches, source_id, fname)
+        if refresh:
+            for ein in eins:
+                batches.add(queries['reowned'], (ein,))
+    batches.flush()
+    if refresh:
+        replay(c, batches, manifest, TAGGED_PATTERN, functools.partial(add_tag_rows, tag_ids))
+
+
+def main(dbname=DBNAME, batch_size=BATCH_SIZE, bulk=False, cache_mb=256,
+         materialize=False, rebuild=False):
+    start = time.perf_counter()
+    if rebuild and os.path.exists(dbname):
+        os.remove(dbname)
+    new_db = not os.path.exists(dbname)
+    conn = sqlite3.connect(dbname)
+
+    def in_schema(name):
+        return conn.execute(
+            'SELECT 1 FROM sqlite_master WHERE name = ?', (name,)).fetchone() is not None
+    if not new_db and not in_schema('source_file'):
+        sys.exit('{} was built without a manifest of its source files; '
+                 'run again with --rebuild'.format(dbname))
+    if not new_db and not in_schema('source_ein'):
+        sys.exit('{} was built without a record of the EINs in each source file; '
+                 'run again with --rebuild'.format(dbname))
+    # The search triggers are the last thing create_indexes makes, in the
+    # same transaction as the indexes and the search index's contents, so
+    # without them (a build cut short, or one from before the search
+    # index) that step still has to run.
+    post_load = new_db or not in_schema('nfp_search_insert')
+    if in_schema('location') and 'ein' not in [
+            row[1] for row in conn.execute('PRAGMA table_info(location)')]:
+        # An R*Tree from before it kept the EIN as loaded; load_geo fills
+        # in the new one.
+        conn.execute('DROP TABLE location')
+    if bulk:
+        set_bulk_pragmas(conn, cache_mb)
+    c = conn.cursor()
+    create_statements = open('create_nonprofitdb_statements.sql').read()
+    for stmt in create_statements.split("\n\n"):
+        c.execute(stmt)
+    c.execute('CREATE TEMP TABLE touched (ein TEXT PRIMARY KEY) WITHOUT ROWID')
+    c.execute('CREATE TEMP TABLE reowned (ein TEXT PRIMARY KEY) WITHOUT ROWID')
+    conn.commit()
+    # Nothing to replay on the first load, which reads every file in order.
+    refresh = c.execute('SELECT 1 FROM source_ein LIMIT 1').fetchone() is not None
+
+    manifest = Manifest(conn)
+    batches = Batches(c, batch_size)
+    load_returns(c, batches, manifest, refresh)
+    # The other EINs' coordinates can't have changed, since geo rows only
+    # ever reach latest_contact_info by way of `touched`.
+    load_geo(c, batches, manifest, refresh)
+    load_tags(c, batches, manifest, refresh)
+    conn.commit()
+    if post_load:
+        create_indexes(conn)
+    if materialize:
+        refresh_combined_data(conn)
+    if bulk:
+        reset_pragmas(conn)
+    conn.close()
+
+    rows = sum(count for query, count in batches.counts.items()
+               if query not in (queries['touched'], queries['source_ein'], queries['reowned']))
+    print("Done. database is in {}".format(dbname))
+    print("{} files new or changed, {} removed".format(manifest.changed, manifest.removed))
+    print("Loaded {} rows in {:.1f}s, peak RSS {:.0f} MB".format(
+        rows, time.perf_counter() - start, peak_rss_mb()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create and populate {}.'.format(DBNAME))
+    parser.add_argument('--db', default=DBNAME,
+                        help='database file (default {})'.format(DBNAME))
+    parser.add_argument('--rebuild', action='store_true',
+                        help='delete the database and load everything from scratch')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='rows per executemany (default {})'.format(BATCH_SIZE))
+    parser.add_argument('--bulk', action='store_true',
+                        help='load with journaling and fsync off and a larger cache')
+    parser.add_argument('--cache-mb', type=int, default=256,
+                        help='page cache size for --bulk, in MB (default 256)')
+    parser.add_argument('--materialize', action='store_true',
+                        help='also store combined_data as the table combined_data_materialized')
+    parser.add_argument('--refresh-combined', action='store_true',
+                        help='only rebuild combined_data_materialized, without loading anything')
+    args = parser.parse_args()
+    if args.refresh_combined:
+        conn = sqlite3.connect(args.db)
+        refresh_combined_data(conn)
+        conn.close()
+    else:
+        main(args.db, args.batch_size, args.bulk, args.cache_mb, args.materialize,
+             args.rebuild)
@@ -0,0 +1,49 @@
+CREATE INDEX IF NOT EXISTS year_terminated_ein ON year_terminated (ein);
+
+CREATE INDEX IF NOT EXISTS tax_return_ein ON tax_return (ein);
+
+CREATE INDEX IF NOT EXISTS latest_contact_info_ein ON latest_contact_info (ein);
+
+CREATE INDEX IF NOT EXISTS latest_contact_info_state_city
+  ON latest_contact_info (business_addr_state, business_addr_city);
+
+CREATE INDEX IF NOT EXISTS tag_lookup_ein ON tag_lookup (ein);
+
+CREATE INDEX IF NOT EXISTS nfp_source ON nfp (source_id);
+
+CREATE INDEX IF NOT EXISTS year_terminated_source ON year_terminated (source_id);
+
+CREATE INDEX IF NOT EXISTS tax_return_source ON tax_return (source_id);
+
+CREATE INDEX IF NOT EXISTS latest_contact_info_source ON latest_contact_info (source_id);
+
+CREATE INDEX IF NOT EXISTS geo_source ON geo (source_id);
+
+CREATE INDEX IF NOT EXISTS tag_lookup_source ON tag_lookup (source_id);
+
+CREATE INDEX IF NOT EXISTS source_ein_ein ON source_ein (ein);
+
+INSERT OR REPLACE INTO nfp_search (rowid, name, mission, activity, description, dba)
+  SELECT
+    CAST(ein AS INTEGER), name, mission, activity, description,
+    trim(coalesce(doing_business_as1, '') || ' ' ||
+         coalesce(doing_business_as2, '') || ' ' ||
+         coalesce(doing_business_as3, ''))
+  FROM nfp;
+
+CREATE TRIGGER IF NOT EXISTS nfp_search_insert AFTER INSERT ON nfp BEGIN
+  DELETE FROM nfp_search WHERE rowid = CAST(new.ein AS INTEGER);
+  INSERT INTO nfp_search (rowid, name, mission, activity, description, dba)
+  VALUES (
+    CAST(new.ein AS INTEGER), new.name, new.mission, new.activity, new.description,
+    trim(coalesce(new.doing_business_as1, '') || ' ' ||
+         coalesce(new.doing_business_as2, '') || ' ' ||
+         coalesce(new.doing_business_as3, ''))
+  );
+END;
+
+CREATE TRIGGER IF NOT EXISTS nfp_search_delete AFTER DELETE ON nfp BEGIN
+  DELETE FROM nfp_search WHERE rowid = CAST(old.ein AS INTEGER);
+END;
+
+ANALYZE;
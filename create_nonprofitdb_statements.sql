@@ -1,3 +1,17 @@
+CREATE TABLE IF NOT EXISTS source_file (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    sha1 TEXT
+);
+
+CREATE TABLE IF NOT EXISTS source_ein (
+    source_id INTEGER REFERENCES source_file(id),
+    ein TEXT NOT NULL,
+    PRIMARY KEY (source_id, ein)
+) WITHOUT ROWID;
+
 CREATE TABLE IF NOT EXISTS nfp (
     ein TEXT PRIMARY KEY ON CONFLICT REPLACE,
     name TEXT,
@@ -8,12 +22,14 @@ CREATE TABLE IF NOT EXISTS nfp (
     doing_business_as2 TEXT,
     doing_business_as3 TEXT,
     is_501c3 INTEGER,
-    year_formed INTEGER
+    year_formed INTEGER,
+    source_id INTEGER REFERENCES source_file(id)
 );
 
 CREATE TABLE IF NOT EXISTS year_terminated (
     ein TEXT NOT NULL,
     year INTEGER NOT NULL,
+    source_id INTEGER REFERENCES source_file(id),
     FOREIGN KEY (ein) REFERENCES nfp(ein)
 );
 
@@ -36,6 +52,7 @@ CREATE TABLE IF NOT EXISTS tax_return (
     does_professional_fundrasing INTEGER,
     does_grants_to_organizations INTEGER,
     does_grants_to_individuals INTEGER,
+    source_id INTEGER REFERENCES source_file(id),
     FOREIGN KEY (ein) REFERENCES nfp(ein)
 );
 
@@ -55,7 +72,31 @@ CREATE TABLE IF NOT EXISTS latest_contact_info (
     principal_officer_state TEXT,
     principal_officer_zip TEXT,
     lon NUM,
-    lat NUM
+    lat NUM,
+    source_id INTEGER REFERENCES source_file(id)
+);
+
+CREATE TABLE IF NOT EXISTS geo (
+    ein TEXT PRIMARY KEY,
+    lon NUM,
+    lat NUM,
+    source_id INTEGER REFERENCES source_file(id)
+) WITHOUT ROWID;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS nfp_search USING fts5(
+    name,
+    mission,
+    activity,
+    description,
+    dba,
+    tokenize = 'porter unicode61'
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS location USING rtree(
+    id,  -- the EIN as an integer
+    min_lon, max_lon,
+    min_lat, max_lat,
+    +ein TEXT  -- the EIN as loaded, to join with geo
 );
 
 CREATE TABLE IF NOT EXISTS tag (
@@ -66,6 +107,7 @@ CREATE TABLE IF NOT EXISTS tag (
 CREATE TABLE IF NOT EXISTS tag_lookup (
   tag_id INTEGER NOT NULL,
   ein TEXT NOT NULL,
+  source_id INTEGER REFERENCES source_file(id),
   FOREIGN KEY (tag_id) REFERENCES tag(id),
   FOREIGN KEY (ein) REFERENCES nfp(ein),
   UNIQUE (tag_id, ein) ON CONFLICT REPLACE
@@ -82,9 +124,31 @@ CREATE VIEW IF NOT EXISTS ein_to_joined_tags AS
   FROM ein_to_tag
   GROUP BY ein;
 
-CREATE VIEW IF NOT EXISTS combined_data AS
-  SELECT 
-    tr.*,
+-- Made again every run, so databases built with an older version of it
+-- pick up this one.  The tax_return columns are listed to leave out its
+-- source_id.
+DROP VIEW IF EXISTS combined_data;
+
+CREATE VIEW combined_data AS
+  SELECT
+    tr.ein,
+    tr.tax_year,
+    tr.gross_receipts_lt_25k,
+    tr.total_employees,
+    tr.total_volunteers,
+    tr.py_total_revenue,
+    tr.cy_total_revenue,
+    tr.gross_receipts,
+    tr.assets_at_beginning_of_year,
+    tr.assets_at_end_of_year,
+    tr.liabilities_at_beginning_of_year,
+    tr.liabilities_at_end_of_year,
+    tr.total_program_service_expenses,
+    tr.does_political_campain_activity,
+    tr.does_lobbying,
+    tr.does_professional_fundrasing,
+    tr.does_grants_to_organizations,
+    tr.does_grants_to_individuals,
     nfp.name,
     nfp.mission,
     nfp.activity,
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""Compact EIN --> Form 990 filing index built from the S3 index files.
+
+The yearly index files (index_2011.json through the current year) are
+each one big JSON object, {"Filings2016": [{...}, {...}, ...]}, hundreds
+of MB apiece.  `iter_filings` decodes the filings one at a time while
+reading the file in chunks, so none of them is ever loaded whole, and
+`build` keeps only what's needed to find a return -- EIN, tax period,
+form type and object id -- in an SQLite table clustered by EIN:
+
+    python filing_index.py build data/index_*.json
+    python filing_index.py lookup 010000007 --all
+
+Re-running `build` skips index files that are already loaded and
+unchanged.  In Python:
+
+    index = FilingIndex()
+    index.latest('010000007')   # the most recent tax period, or None
+    index.all('010000007')      # every filing, oldest first
+"""
+import argparse
+import collections
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+
+
+INDEX_DB = os.path.join('data', 'filing_index.db')
+URL_TEMPLATE = 'https://s3.amazonaws.com/irs-form-990/{}_public.xml'
+CHUNK_SIZE = 1 << 20
+
+
+class Filing(collections.namedtuple(
+        'Filing', ['ein', 'tax_period', 'object_id', 'form_type'])):
+    __slots__ = ()
+
+    @property
+    def url(self):
+        return URL_TEMPLATE.format(self.object_id)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS filing (
+    ein INTEGER NOT NULL,
+    tax_period INTEGER NOT NULL,
+    object_id INTEGER NOT NULL,
+    form_type TEXT,
+    PRIMARY KEY (ein, tax_period, object_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS index_file (
+    name TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    num_filings INTEGER
+);
+"""
+
+
+# ------------------------------------------------------------ Streaming parse
+def iter_filings(path, chunk_size=CHUNK_SIZE):
+    """Yield each filing dict in the index file at `path`, reading it in chunks."""
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r'[\s,]*')
+    with open(path) as infile:
+        buffer = ''
+        eof = False
+
+        def fill():
+            nonlocal buffer, eof
+            chunk = infile.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+
+        # Skip ahead to the start of the list of filings.
+        while '[' not in buffer:
+            fill()
+            if eof:
+                return
+        pos = buffer.index('[') + 1
+
+        while True:
+            pos = whitespace.match(buffer, pos).end()
+            if pos == len(buffer):
+                buffer = ''
+                pos = 0
+                fill()
+                if eof:
+                    raise ValueError('{} ended inside the list of filings'.format(path))
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                filing, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # The filing runs past the end of the buffer; read more.
+                buffer = buffer[pos:]
+                pos = 0
+                fill()
+                continue
+            yield filing
+            pos = end
+
+
+def _to_row(filing):
+    return (
+        int(filing['EIN']),
+        int(filing.get('TaxPeriod') or 0),
+        int(filing['ObjectId'] if filing.get('ObjectId') else
+            os.path.basename(filing['URL']).split('_', 1)[0]),
+        filing.get('FormType', ''),
+    )
+
+
+# ---------------------------------------------------------------- The store
+class FilingIndex:
+    def __init__(self, path=INDEX_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Lookups can come from the fetcher's job thread; the index is
+        # read-only once built.
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+    def build(self, index_paths, batch_size=10000, out=sys.stdout):
+        """Load every index file in `index_paths` that has changed."""
+        for path in index_paths:
+            name = os.path.basename(path)
+            stat = os.stat(path)
+            known = self.conn.execute(
+                'SELECT size, mtime FROM index_file WHERE name = ?', (name,)
+            ).fetchone()
+            if known == (stat.st_size, stat.st_mtime):
+                print('{}: already loaded'.format(name), file=out)
+                continue
+            count = 0
+            with self.conn:
+                batch = []
+                for filing in iter_filings(path):
+                    batch.append(_to_row(filing))
+                    if len(batch) == batch_size:
+                        self._insert(batch)
+                        count += len(batch)
+                        batch = []
+                self._insert(batch)
+                count += len(batch)
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO index_file VALUES (?, ?, ?, ?)',
+                    (name, stat.st_size, stat.st_mtime, count))
+            print('{}: {} filings'.format(name, count), file=out)
+
+    def _insert(self, rows):
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO filing VALUES (?, ?, ?, ?)', rows)
+
+    def all(self, ein):
+        """Every filing for `ein`, oldest tax period first."""
+        if not str(ein).isdigit():
+            return []
+        return [Filing(*row) for row in self.conn.execute(
+            'SELECT * FROM filing WHERE ein = ? ORDER BY tax_period, object_id',
+            (int(ein),))]
+
+    def latest(self, ein):
+        """The filing for the most recent tax period for `ein`, or None."""
+        if not str(ein).isdigit():
+            return None
+        row = self.conn.execute(
+            'SELECT * FROM filing WHERE ein = ? '
+            'ORDER BY tax_period DESC, object_id DESC LIMIT 1',
+            (int(ein),)).fetchone()
+        return Filing(*row) if row else None
+
+    def __len__(self):
+        return self.conn.execute('SELECT count(*) FROM filing').fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+def open_index(path=INDEX_DB, index_paths=None):
+    """Return the FilingIndex at `path`, first loading any new or changed
+    index files (by default every data/index_*.json)."""
+    if index_paths is None:
+        index_paths = sorted(glob.glob(os.path.join('data', 'index_*.json')))
+    index = FilingIndex(path)
+    index.build(index_paths)
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or query the EIN --> filing index.')
+    parser.add_argument('--db', default=INDEX_DB,
+                        help='index database (default {})'.format(INDEX_DB))
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='load S3 index_<year>.json files')
+    build.add_argument('index_files', nargs='+')
+    lookup = subparsers.add_parser('lookup', help='show the filings for an EIN')
+    lookup.add_argument('ein')
+    lookup.add_argument('--all', action='store_true',
+                        help='list every filing instead of only the latest')
+    args = parser.parse_args()
+
+    index = FilingIndex(args.db)
+    if args.command == 'build':
+        index.build(args.index_files)
+        print('{} filings indexed in {}'.format(len(index), args.db))
+    else:
+        filings = index.all(args.ein) if args.all else [index.latest(args.ein)]
+        for filing in filings:
+            if filing is not None:
+                print('{:09d}\t{}\t{}\t{}'.format(
+                    filing.ein, filing.tax_period, filing.form_type, filing.url))
+    index.close()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Local, compressed cache of downloaded Form 990 XML documents.
+
+A filed return never changes, so each document is stored once, keyed by
+the object id in its URL (the '201541349349307794' in
+https://s3.amazonaws.com/irs-form-990/201541349349307794_public.xml).
+Documents are gzipped and sharded two directories deep on the last
+digits of the object id so no single directory gets too large:
+
+    data/xml_cache/94/77/201541349349307794.xml.gz
+
+Hit and miss counts are accumulated across runs in `stats.json` in the
+cache directory.  To see them:
+
+    python form990_cache.py stats
+"""
+import argparse
+import gzip
+import json
+import os
+import threading
+import zlib
+
+
+CACHE_DIR = os.path.join('data', 'xml_cache')
+
+
+def object_id(url):
+    """'.../201541349349307794_public.xml' --> '201541349349307794'"""
+    return os.path.basename(url).split('_', 1)[0]
+
+
+class DocumentCache:
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        self.stats_path = os.path.join(directory, 'stats.json')
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.bytes_saved = 0
+
+    def path(self, url):
+        oid = object_id(url)
+        return os.path.join(self.directory, oid[-2:], oid[-4:-2], oid + '.xml.gz')
+
+    def get(self, url):
+        """Return the cached document for `url`, or None if it isn't cached
+        or its entry can't be read (it's fetched and stored again)."""
+        try:
+            with gzip.open(self.path(url), 'rb') as infile:
+                content = infile.read()
+        except (OSError, EOFError, zlib.error):  # OSError includes BadGzipFile
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += len(content)
+        return content
+
+    def put(self, url, content):
+        path = self.path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a temporary name first so a crash never leaves a
+        # truncated document behind for the next run to trust.
+        partial = '{}.{}.partial'.format(path, threading.get_ident())
+        with gzip.open(partial, 'wb') as outfile:
+            outfile.write(content)
+        os.replace(partial, path)
+
+    def load_stats(self):
+        if not os.path.exists(self.stats_path):
+            return dict(hits=0, misses=0, bytes_saved=0)
+        with open(self.stats_path) as infile:
+            return json.load(infile)
+
+    def save_stats(self):
+        """Add this run's counts to the running totals in `stats.json`."""
+        totals = self.load_stats()
+        with self._lock:
+            totals['hits'] += self.hits
+            totals['misses'] += self.misses
+            totals['bytes_saved'] += self.bytes_saved
+            self.hits = self.misses = self.bytes_saved = 0
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.stats_path, 'w') as outfile:
+            json.dump(totals, outfile)
+
+    def summary(self, stats=None):
+        stats = stats or dict(
+            hits=self.hits, misses=self.misses, bytes_saved=self.bytes_saved)
+        lookups = stats['hits'] + stats['misses']
+        return '{} hits / {} lookups ({:.1f}% hit rate), {:.1f} MB not downloaded'.format(
+            stats['hits'], lookups, 100 * stats['hits'] / max(lookups, 1),
+            stats['bytes_saved'] / 1e6)
+
+    def disk_usage(self):
+        """Return (number of documents, compressed bytes on disk)."""
+        count = size = 0
+        for dirpath, __, filenames in os.walk(self.directory):
+            for fname in filenames:
+                if fname.endswith('.xml.gz'):
+                    count += 1
+                    size += os.path.getsize(os.path.join(dirpath, fname))
+        return count, size
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect the Form 990 XML cache.')
+    parser.add_argument('command', choices=['stats'])
+    parser.add_argument('--dir', default=CACHE_DIR,
+                        help='cache directory (default {})'.format(CACHE_DIR))
+    args = parser.parse_args()
+    cache = DocumentCache(args.dir)
+    count, size = cache.disk_usage()
+    print('Cache:', args.dir)
+    print('  {} documents, {:.1f} MB on disk'.format(count, size / 1e6))
+    print('  All runs:', cache.summary(cache.load_stats()))
@@ -0,0 +1,112 @@
+"""Fetch Form 990 XML documents concurrently over pooled connections.
+
+All requests go through one `requests.Session`, whose connection pool is
+sized to the number of worker threads so every worker keeps its own
+keep-alive connection to S3 open.  Transient failures (connection errors,
+timeouts, throttling and 5xx responses) are retried with exponential
+backoff.
+
+    fetcher = Fetcher(workers=16)
+    for url, content in fetcher.fetch_all(urls):
+        ...
+
+`fetch_all` yields documents in the same order as the URLs it was given,
+no matter which request finishes first, so output files stay deterministic.
+
+Given a `form990_cache.DocumentCache`, the fetcher looks there first and
+stores every newly downloaded document in it.
+"""
+import collections
+import concurrent.futures
+import sys
+import time
+
+import requests
+
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class Fetcher:
+    def __init__(self, workers=8, retries=4, backoff=0.5, timeout=60,
+                 base_url=None, cache=None):
+        """
+        workers     -- the number of requests in flight at once
+        retries     -- how many times to retry a transient failure
+        backoff     -- seconds to wait before the first retry; doubles each time
+        timeout     -- seconds before giving up on a single request
+        base_url    -- serve documents from here instead of the S3 bucket
+                       (for example a local mirror or test server)
+        cache       -- a DocumentCache to check before going to the network
+        """
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.base_url = base_url
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def resolve(self, url):
+        """Point `url` at `base_url`, if one was given."""
+        if self.base_url is None:
+            return url
+        return self.base_url.rstrip('/') + '/' + url.rsplit('/', 1)[-1]
+
+    def fetch(self, url):
+        """Return the content at `url`, or None if it couldn't be retrieved."""
+        if self.cache is not None:
+            content = self.cache.get(url)
+            if content is not None:
+                return content
+        content = self.download(self.resolve(url))
+        if content is not None and self.cache is not None:
+            self.cache.put(url, content)
+        return content
+
+    def download(self, url):
+        """Get `url` from the network, retrying transient failures."""
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.content
+                problem = 'HTTP {}'.format(response.status_code)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                problem = e.__class__.__name__
+            except requests.HTTPError as e:
+                sys.stderr.write('Skipping {}: {}\n'.format(url, e))
+                return None
+            if attempt < self.retries:
+                time.sleep(delay)
+                delay *= 2
+        sys.stderr.write('Giving up on {} after {} tries ({})\n'.format(
+            url, self.retries + 1, problem))
+        return None
+
+    def fetch_all(self, urls):
+        """Yield (url, content) pairs in the order of `urls`.
+
+        Only a bounded window of requests is outstanding at a time, so a slow
+        document never lets finished ones pile up in memory.
+        """
+        window = 2 * self.workers
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+            pending = collections.deque()
+            for url in urls:
+                pending.append((url, executor.submit(self.fetch, url)))
+                if len(pending) >= window:
+                    url, future = pending.popleft()
+                    yield url, future.result()
+            while pending:
+                url, future = pending.popleft()
+                yield url, future.result()
+
+    def close(self):
+        self.session.close()
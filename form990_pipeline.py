@@ -0,0 +1,170 @@
+"""Download, parse and write Form 990 returns as three overlapping stages.
+
+    download threads --> raw queue --> process pool --> single writer
+      (Fetcher)         (bounded)    (FieldExtractor)   (write callback)
+
+The fetcher's threads spend their time waiting on the network, the
+process pool keeps every core busy pulling columns out of the XML, and
+the calling thread writes finished rows in the same order the jobs were
+given.  Both queues are bounded, so a slow stage holds back the ones
+before it instead of letting documents pile up in memory.
+
+`PipelineStats` keeps per-stage counts and throughput and the depth of
+each queue, printed every `report_every` seconds and once at the end,
+to help size the workers:
+
+    downloaded 5120 (41.3/s, 3.2 MB/s) | raw queue 64/64 | parsing 32 (40.9/s) | written 5088
+"""
+import collections
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from form990_extractor import FieldExtractor
+
+
+_DONE = object()
+
+_extractor = None
+
+
+def _init_worker(fields):
+    global _extractor
+    _extractor = FieldExtractor(fields)
+
+
+def _extract(content):
+    start = time.perf_counter()
+    row = _extractor.extract(content)
+    return row, time.perf_counter() - start
+
+
+class PipelineStats:
+    def __init__(self, queue_size, parse_window):
+        self.start = time.perf_counter()
+        self.queue_size = queue_size
+        self.parse_window = parse_window
+        self.downloaded = self.bytes_downloaded = self.missing = 0
+        self.parsed = self.written = 0
+        self.parse_seconds = 0.0
+        self.raw_queue_depth = self.parsing = 0
+        self.max_raw_queue_depth = self.max_parsing = 0
+
+    def sample(self, raw_queue_depth, parsing):
+        self.raw_queue_depth = raw_queue_depth
+        self.parsing = parsing
+        self.max_raw_queue_depth = max(self.max_raw_queue_depth, raw_queue_depth)
+        self.max_parsing = max(self.max_parsing, parsing)
+
+    def report(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return (
+            'downloaded {} ({:.1f}/s, {:.1f} MB/s) | raw queue {}/{} | '
+            'parsing {} ({:.1f}/s) | written {}'
+        ).format(
+            self.downloaded, self.downloaded / elapsed,
+            self.bytes_downloaded / elapsed / 1e6,
+            self.raw_queue_depth, self.queue_size,
+            self.parsing, self.parsed / elapsed, self.written)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        return '\n'.join((
+            'Finished in {:.1f}s'.format(elapsed),
+            '  download: {} documents, {:.1f} MB, {} unavailable'.format(
+                self.downloaded, self.bytes_downloaded / 1e6, self.missing),
+            '  raw queue: peak {} of {}'.format(self.max_raw_queue_depth, self.queue_size),
+            '  parse: {} documents, {:.1f} CPU-seconds, peak {} of {} in flight'.format(
+                self.parsed, self.parse_seconds, self.max_parsing, self.parse_window),
+            '  write: {} rows'.format(self.written),
+        ))
+
+
+def run(jobs, fetcher, fields, write, parse_workers=None, queue_size=64,
+        report_every=30, out=sys.stdout):
+    """Fetch, extract and write every job; return the PipelineStats.
+
+    jobs    -- iterable of (key, url); `key` is passed back to `write`
+    fetcher -- a form990_fetcher.Fetcher
+    fields  -- the field spec to extract (see form990_extractor)
+    write   -- called as write(key, row) for each document, in job order
+    """
+    jobs = iter(jobs)
+    keys = queue.Queue()  # keys in job order, consumed alongside the documents
+    raw = queue.Queue(maxsize=queue_size)
+    failure = []
+
+    def urls():
+        for key, url in jobs:
+            keys.put(key)
+            yield url
+
+    def download():
+        try:
+            for url, content in fetcher.fetch_all(urls()):
+                if content is None:
+                    stats.missing += 1
+                else:
+                    stats.downloaded += 1
+                    stats.bytes_downloaded += len(content)
+                raw.put(content)
+        except BaseException as e:
+            failure.append(e)
+        finally:
+            raw.put(_DONE)
+
+    parse_workers = parse_workers or os.cpu_count()
+    parse_window = 2 * parse_workers
+    stats = PipelineStats(queue_size, parse_window)
+    pending = collections.deque()  # (key, future or None) in job order
+
+    def write_ready(outstanding):
+        """Write finished rows from the front of `pending`, waiting on the
+        oldest one while more than `outstanding` are queued."""
+        while pending:
+            key, future = pending[0]
+            if (future is not None and not future.done() and
+                    len(pending) <= outstanding):
+                return
+            pending.popleft()
+            if future is None:
+                continue  # the download failed; nothing to write
+            row, seconds = future.result()
+            stats.parsed += 1
+            stats.parse_seconds += seconds
+            write(key, row)
+            stats.written += 1
+
+    # Spawn rather than fork: the download threads are already running
+    # by the time the pool starts its worker processes.
+    with ProcessPoolExecutor(parse_workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(list(fields),)) as pool:
+        downloader = threading.Thread(target=download, daemon=True)
+        downloader.start()
+        last_report = time.perf_counter()
+        while True:
+            content = raw.get()
+            if content is _DONE:
+                break
+            key = keys.get()
+            if content is None:
+                pending.append((key, None))
+            else:
+                pending.append((key, pool.submit(_extract, content)))
+            write_ready(parse_window)
+            stats.sample(raw.qsize(), sum(1 for __, f in pending if f is not None))
+            if report_every and time.perf_counter() - last_report >= report_every:
+                print(stats.report(), file=out, flush=True)
+                last_report = time.perf_counter()
+
+        if failure:
+            raise failure[0]
+        write_ready(0)
+    print(stats.summary(), file=out, flush=True)
+    return stats
@@ -0,0 +1,67 @@
+"""Offline city/state --> (lon, lat) lookup from the Census places gazetteer.
+
+`get_census_places_lon_lats.py` writes one file per state to
+`data/census_places_lon_lat/<ST>.txt` (tab-separated city, lon, lat,
+where lon/lat are the place's internal point).  `Gazetteer` reads a
+state's file the first time it's asked about that state and keeps a
+dict of normalized city name --> (lon, lat):
+
+    >>> places = Gazetteer()
+    >>> places.locate('St. Louis', 'mo')
+    ('-90.244582', '38.635701')
+
+City names are normalized the way `geocode_cache.normalize_address`
+does it, plus the usual abbreviations (ST/SAINT, FT/FORT, MT/MOUNT), so
+both spellings find the same place.  The places file has no ZIP codes,
+so there are no ZIP centroids to fall back on; rows with an unknown city
+get no location.
+"""
+import csv
+import os
+
+from geocode_cache import normalize_address
+
+
+PLACES_DIR = os.path.join('data', 'census_places_lon_lat')
+
+_abbreviations = {'SAINT': 'ST', 'FORT': 'FT', 'MOUNT': 'MT'}
+
+
+def place_key(city):
+    __, city, __, __ = normalize_address('', city, '', '').split('|')
+    words = city.split()
+    if words and words[0] in _abbreviations:
+        words[0] = _abbreviations[words[0]]
+    return ' '.join(words)
+
+
+def read_places(state, directory=PLACES_DIR):
+    """Yield (city, lon, lat) for each place in a state's file, if it has one."""
+    path = os.path.join(directory, state + '.txt')
+    if os.path.exists(path):
+        with open(path) as infile:
+            rdr = csv.reader(infile, delimiter='\t')
+            next(rdr, None)  # discard the header row
+            yield from rdr
+
+
+class Gazetteer:
+    def __init__(self, directory=PLACES_DIR):
+        self.directory = directory
+        self.states = {}  # state --> {place key: (lon, lat)}
+
+    def _places(self, state):
+        state = state.strip().upper()
+        if state not in self.states:
+            places = {}
+            for city, lon, lat in read_places(state, self.directory):
+                # The first place listed wins when two share a name.
+                places.setdefault(place_key(city), (lon, lat))
+            self.states[state] = places
+        return self.states[state]
+
+    def locate(self, city, state):
+        """Return the (lon, lat) strings for `city`, `state`, or None."""
+        if not city or not state:
+            return None
+        return self._places(state).get(place_key(city))
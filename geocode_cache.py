@@ -0,0 +1,74 @@
+"""SQLite cache of Census geocoder results, keyed by normalized address.
+
+Many organizations share an address -- fiscal sponsors, PO boxes, office
+towers -- and plenty appear in both the 990 and the 990-N data, so the
+same address would otherwise be geocoded again and again, in every run.
+Addresses are normalized (upper case, punctuation dropped, whitespace
+collapsed, 5-digit ZIP) so trivially different spellings share an entry:
+
+    >>> normalize_address('c/o Jo  Smith, 8606 S. Blackstone Ave.', 'Chicago', 'il', '60619-1234')
+    'C O JO SMITH 8606 S BLACKSTONE AVE|CHICAGO|IL|60619'
+
+Each entry holds the geocoder's response columns after the id -- for
+matches and for 'No_Match' alike -- so a cached address never goes back
+to the service.  Batches that fail outright are not cached.
+
+The 990 and 990-N geocoding runs (see `run_pipeline.py`) share the cache
+at the same time, so it's kept in WAL mode, and a writer waits up to
+TIMEOUT seconds for the other one's transaction instead of failing.
+"""
+import os
+import re
+import sqlite3
+
+
+CACHE_DB = os.path.join('data', 'geocode_cache.db')
+TIMEOUT = 60.0
+
+_punctuation = re.compile(r'[^\w\s]')
+
+
+def _clean(text):
+    return ' '.join(_punctuation.sub(' ', text.upper()).split())
+
+
+def normalize_address(addr, city, state, zipcode):
+    return '|'.join((_clean(addr), _clean(city), _clean(state), zipcode.strip()[:5]))
+
+
+class GeocodeCache:
+    def __init__(self, path=CACHE_DB):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=TIMEOUT)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS geocode (
+                address TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                updated TEXT DEFAULT CURRENT_TIMESTAMP
+            ) WITHOUT ROWID
+        """)
+        self.hits = self.misses = 0
+
+    def get(self, address):
+        """Return the cached result columns for `address`, or None."""
+        row = self.conn.execute(
+            'SELECT result FROM geocode WHERE address = ?', (address,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0].split('\t')
+
+    def put_many(self, results):
+        """Store an iterable of (address, result columns)."""
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO geocode (address, result) VALUES (?, ?)',
+                ((address, '\t'.join(result)) for address, result in results))
+
+    def __len__(self):
+        return self.conn.execute('SELECT count(*) FROM geocode').fetchone()[0]
+
+    def close(self):
+        self.conn.close()
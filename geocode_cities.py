@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Geocode every city file under `data/form990*/` in one process.
+
+Each `data/form990<suffix>/<state>/<city>.txt` goes to
+`data/geo990<suffix>/<state>/<city>.txt`, in the same format that
+`census_geocoder_mapper.py` writes.  Rows from all the cities are read as
+one stream, so small towns share full-size batches instead of each
+sending its own, and one pooled connection, cache and rate limit serve
+the whole run:
+
+    python geocode_cities.py --states IL WA --gazetteer
+
+Takes the same geocoder options as `census_geocoder_mapper.py`, plus
+--states/--cities to choose which city files to do and --sources to do
+only some of the data/form990* directories.
+"""
+import argparse
+import csv
+import glob
+import os
+import sys
+
+from census_geocoder_mapper import (
+    COLUMN_NAMES, add_geocoder_arguments, geocode_rows, geocoder_from_args, read_rows)
+from city_partitioner import CityPartitioner, add_selection_arguments, selection
+from gazetteer import PLACES_DIR, Gazetteer
+from geocode_cache import GeocodeCache
+
+
+def city_files(wanted, sources=None):
+    """Yield (source directory, state, city, path) for every wanted city file."""
+    if sources is None:
+        sources = sorted(glob.glob(os.path.join('data', 'form990*')))
+    for source in sources:
+        for path in sorted(glob.glob(os.path.join(source, '*', '*.txt'))):
+            state = os.path.basename(os.path.dirname(path))
+            city = os.path.splitext(os.path.basename(path))[0]
+            if wanted(state, city):
+                yield source, state, city, path
+
+
+def destination(source):
+    """data/form990N --> data/geo990N"""
+    parent, name = os.path.split(source)
+    return os.path.join(parent, name.replace('form', 'geo', 1))
+
+
+def geocode_cities(files, **kwargs):
+    """Geocode `files` (from `city_files`) into their geo990 directories.
+
+    Keyword arguments are passed on to `census_geocoder_mapper.geocode_rows`.
+    """
+    partitioners = {}  # source directory --> CityPartitioner for its output
+
+    def rows():
+        for source, state, city, path in files:
+            if source not in partitioners:
+                partitioners[source] = CityPartitioner(
+                    destination(source), COLUMN_NAMES, delimiter=',',
+                    quoting=csv.QUOTE_ALL, lineterminator='\n')
+            # Cities with no rows still get a file with just the header.
+            partitioners[source].start(state, city)
+            with open(path) as infile:
+                for line in read_rows(infile):
+                    yield (source, state, city), line
+
+    def write(key, row):
+        source, state, city = key
+        partitioners[source].write(state, city, row)
+
+    try:
+        stats = geocode_rows(rows(), write, **kwargs)
+    finally:
+        for partitioner in partitioners.values():
+            partitioner.close()
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Geocode every data/form990*/<state>/<city> file into data/geo990*/.')
+    add_selection_arguments(parser)
+    add_geocoder_arguments(parser)
+    parser.add_argument('--sources', nargs='+', metavar='DIR', default=None,
+                        help='the data/form990* directories to geocode (default: all of them)')
+    args = parser.parse_args()
+    cache = None if args.no_cache else GeocodeCache(args.cache)
+    gazetteer = None
+    if args.gazetteer or args.offline:
+        gazetteer = Gazetteer(args.gazetteer or PLACES_DIR)
+    files = list(city_files(selection(args), args.sources))
+    sys.stderr.write('Geocoding {} city files\n'.format(len(files)))
+    stats = geocode_cities(files, geocoder=geocoder_from_args(args), cache=cache,
+                           gazetteer=gazetteer, offline=args.offline)
+    sys.stderr.write(stats.summary())
+    if cache is not None:
+        cache.close()
@@ -4,162 +4,212 @@ The EINs are mapped to URLs via the index files that can be pulled
 from the S3 bucket, like this example:
   https://s3.amazonaws.com/irs-form-990/201541349349307794_public.xml.
 
-To get the indexes you need, run the commands:
+To get the indexes you need, run a command like this for each year
+(2011 onward) that you want to draw returns from:
   aws s3 cp s3://irs-form-990/index_2016.json data/index_2016.json
-  aws s3 cp s3://irs-form-990/index_2015.json data/index_2015.json
+
+They are loaded, a filing at a time, into the compact lookup table in
+data/filing_index.db (see `filing_index.py`); each EIN's latest filing
+is the one that gets pulled.
 
 Documentaton is at:
     https://aws.amazon.com/public-datasets/irs-990/
+
+The returns are downloaded several at a time over pooled connections
+(see `form990_fetcher.py`); use --workers to change how many.
+To run against a local copy of the documents, pass --base-url.
+
+Downloaded documents are kept in a compressed local cache (see
+`form990_cache.py`), so later runs -- for example after adding a column
+to `getters` -- only download returns they haven't seen before.
+
+Downloading and parsing overlap (see `form990_pipeline.py`): the XML is
+parsed in a pool of --parse-workers processes while the next documents
+download, and progress for each stage is printed every --report-every
+seconds.
+
+City files are written through a journal (see `crawl_journal.py`) and
+only appear under data/form990/ once complete.  If a crawl is
+interrupted, run it again with --resume to pick up where it left off.
+--format parquet or sqlite writes the rows there instead (see
+`city_sinks.py`), with the amounts and counts as numbers, but can't be
+resumed.
 """
-import csv
-import difflib
+import argparse
 import glob
-import json
 import os
-import requests
-import xml.etree.ElementTree as ET
-
-
-ns = dict(irs="http://www.irs.gov/efile")
-
-def get(xpath):
-    result = root.find(xpath, ns)
-    if result is not None:
-        return ' '.join(result.text.strip().split())
-    else:
-        return ''
-
-def getsubgroup(xpath):
-    result = root.find(xpath, ns)
-    if result is not None:
-        return ' '.join(' '.join(result.itertext()).strip().split())
-    else:
-        return ''
 
+from city_sinks import SinkCityFiles, add_sink_arguments, sink_from_args
+from crawl_journal import CityFiles
+from form990_cache import CACHE_DIR, DocumentCache
+from form990_extractor import CONSTANT, SUBGROUP, TEXT, UNDER_25K
+from form990_fetcher import Fetcher
+from filing_index import INDEX_DB, open_index
+import form990_pipeline
 
-def try_receipts_less_than_25k():
-    try:
-        amt = float(get('.//irs:ReturnData//irs:GrossReceiptsAmt'))
-    except ValueError:
-        return False
-    return amt < 25000
-        
 
 getters = [
-    ('EIN', lambda: get('.//irs:EIN')),
-    ('TaxYr', lambda: get('.//irs:ReturnHeader//irs:TaxYr')),
-    ('BusinessName', lambda: getsubgroup('.//irs:Filer//irs:BusinessName')),
-    ('Gross Receipts are under $25k', try_receipts_less_than_25k),
-    ('Is Terminated', lambda: ''),
-    ('Tax Period Begins', lambda: get('.//irs:TaxPeriodBeginDt')),
-    ('Tax Period Ends', lambda: get('.//irs:TaxPeriodEndDt')),
-    ('WebsiteAddress', lambda: get('.//irs:ReturnData//irs:WebsiteAddressTxt')),
-    ('PrincipalOfficerNm', lambda: get('.//irs:ReturnData//irs:PrincipalOfficerNm')),
-    ('Officer Address Line1', lambda: get('.//irs:ReturnData//irs:USAddress//irs:AddressLine1Txt')),
-    ('Officer Address Line2', lambda: get('.//irs:ReturnData//irs:USAddress//irs:AddressLine2Txt')),
-    ('Officer Address City', lambda: get('.//irs:ReturnData//irs:USAddress//irs:CityNm')),
-    ('Officer Address Province', lambda: ''),
-    ('Officer Address State', lambda: get('.//irs:ReturnData//irs:USAddress//irs:StateAbbreviationCd')),
-    ('Officer Address Postal Code', lambda: get('.//irs:ReturnData//irs:USAddress//irs:ZIPCd')),
-    ('Officer Address Country', lambda: 'USA'),
-    ('AddressLine1', lambda: get('.//irs:Filer//irs:USAddress//irs:AddressLine1Txt')),
-    ('AddressLine2', lambda: get('.//irs:Filer//irs:USAddress//irs:AddressLine2Txt')),
-    ('City', lambda: get('.//irs:Filer//irs:USAddress//irs:CityNm')),
-    ('Province', lambda: ''),
-    ('State', lambda: get('.//irs:Filer//irs:USAddress//irs:StateAbbreviationCd')),
-    ('ZIPCd', lambda: get('.//irs:Filer//irs:USAddress//irs:ZIPCd')),
-    ('Organization Address Country', lambda: 'USA'),
-    ('Doing Business As Name 1', lambda: ''),  # I just don't know the XML tag for this
-    ('Doing Business As Name 2', lambda: ''),
-    ('Doing Business As Name 3', lambda: ''),
-    ('Form', lambda: '990'),
-    ('GrossReceiptsAmt', lambda: get('.//irs:ReturnData//irs:GrossReceiptsAmt')),
-    ('Is_501c3', lambda: get('.//irs:ReturnData//irs:Organization501c3Ind')),
-    ('PhoneNum', lambda: get('.//irs:Filer//irs:PhoneNum')),
-    ('ActivityOrMissionDesc', lambda: get('.//irs:ReturnData//irs:ActivityOrMissionDesc')),
-    ('FormationYr', lambda: get('.//irs:ReturnData//irs:FormationYr')),
-    ('LegalDomicileStateCd', lambda: get('.//irs:ReturnData//irs:LegalDomicileStateCd')),
-    ('TotalEmployeeCnt', lambda: get('.//irs:ReturnData//irs:TotalEmployeeCnt')),
-    ('TotalVolunteersCnt', lambda: get('.//irs:ReturnData//irs:TotalVolunteersCnt')),
-    ('PYTotalRevenueAmt', lambda: get('.//irs:ReturnData//irs:PYTotalRevenueAmt')),
-    ('CYTotalRevenueAmt', lambda: get('.//irs:ReturnData//irs:CYTotalRevenueAmt')),
-    ('PYSalariesCompEmpBnftPaidAmt', lambda: get('.//irs:ReturnData//irs:PYSalariesCompEmpBnftPaidAmt')),
-    ('CYSalariesCompEmpBnftPaidAmt', lambda: get('.//irs:ReturnData//irs:CYSalariesCompEmpBnftPaidAmt')),
-    ('TotalAssetsBOYAmt', lambda: get('.//irs:ReturnData//irs:TotalAssetsBOYAmt')),
-    ('TotalAssetsEOYAmt', lambda: get('.//irs:ReturnData//irs:TotalAssetsEOYAmt')),
-    ('TotalLiabilitiesBOYAmt', lambda: get('.//irs:ReturnData//irs:TotalLiabilitiesBOYAmt')),
-    ('TotalLiabilitiesEOYAmt', lambda: get('.//irs:ReturnData//irs:TotalLiabilitiesEOYAmt')),
-    ('TotalProgramServiceExpensesAmt', lambda: get('.//irs:ReturnData//irs:TotalProgramServiceExpensesAmt')),
-    ('PoliticalCampaignActyInd', lambda: get('.//irs:ReturnData//irs:PoliticalCampaignActyInd')),
-    ('LobbyingActivitiesInd', lambda: get('.//irs:ReturnData//irs:LobbyingActivitiesInd')),
-    ('SubjectToProxyTaxInd', lambda: get('.//irs:ReturnData//irs:SubjectToProxyTaxInd')),
-    ('MoreThan5000KToOrgInd', lambda: get('.//irs:ReturnData//irs:MoreThan5000KToOrgInd')),
-    ('MoreThan5000KToIndividualsInd', lambda: get('.//irs:ReturnData//irs:MoreThan5000KToIndividualsInd')),
-    ('ProfessionalFundraisingInd', lambda: get('.//irs:ReturnData//irs:ProfessionalFundraisingInd')),
-    ('GrantsToOrganizationsInd', lambda: get('.//irs:ReturnData//irs:GrantsToOrganizationsInd')),
-    ('GrantsToIndividualsInd', lambda: get('.//irs:ReturnData//irs:GrantsToIndividualsInd')),
-    ('MissionDesc', lambda: get('.//irs:ReturnData//irs:MissionDesc')),
-    ('Desc', lambda: get('.//irs:ReturnData//irs:Desc')),
+    ('EIN', TEXT, './/irs:EIN'),
+    ('TaxYr', TEXT, './/irs:ReturnHeader//irs:TaxYr'),
+    ('BusinessName', SUBGROUP, './/irs:Filer//irs:BusinessName'),
+    ('Gross Receipts are under $25k', UNDER_25K, './/irs:ReturnData//irs:GrossReceiptsAmt'),
+    ('Is Terminated', CONSTANT, ''),
+    ('Tax Period Begins', TEXT, './/irs:TaxPeriodBeginDt'),
+    ('Tax Period Ends', TEXT, './/irs:TaxPeriodEndDt'),
+    ('WebsiteAddress', TEXT, './/irs:ReturnData//irs:WebsiteAddressTxt'),
+    ('PrincipalOfficerNm', TEXT, './/irs:ReturnData//irs:PrincipalOfficerNm'),
+    ('Officer Address Line1', TEXT, './/irs:ReturnData//irs:USAddress//irs:AddressLine1Txt'),
+    ('Officer Address Line2', TEXT, './/irs:ReturnData//irs:USAddress//irs:AddressLine2Txt'),
+    ('Officer Address City', TEXT, './/irs:ReturnData//irs:USAddress//irs:CityNm'),
+    ('Officer Address Province', CONSTANT, ''),
+    ('Officer Address State', TEXT, './/irs:ReturnData//irs:USAddress//irs:StateAbbreviationCd'),
+    ('Officer Address Postal Code', TEXT, './/irs:ReturnData//irs:USAddress//irs:ZIPCd'),
+    ('Officer Address Country', CONSTANT, 'USA'),
+    ('AddressLine1', TEXT, './/irs:Filer//irs:USAddress//irs:AddressLine1Txt'),
+    ('AddressLine2', TEXT, './/irs:Filer//irs:USAddress//irs:AddressLine2Txt'),
+    ('City', TEXT, './/irs:Filer//irs:USAddress//irs:CityNm'),
+    ('Province', CONSTANT, ''),
+    ('State', TEXT, './/irs:Filer//irs:USAddress//irs:StateAbbreviationCd'),
+    ('ZIPCd', TEXT, './/irs:Filer//irs:USAddress//irs:ZIPCd'),
+    ('Organization Address Country', CONSTANT, 'USA'),
+    ('Doing Business As Name 1', CONSTANT, ''),  # I just don't know the XML tag for this
+    ('Doing Business As Name 2', CONSTANT, ''),
+    ('Doing Business As Name 3', CONSTANT, ''),
+    ('Form', CONSTANT, '990'),
+    ('GrossReceiptsAmt', TEXT, './/irs:ReturnData//irs:GrossReceiptsAmt'),
+    ('Is_501c3', TEXT, './/irs:ReturnData//irs:Organization501c3Ind'),
+    ('PhoneNum', TEXT, './/irs:Filer//irs:PhoneNum'),
+    ('ActivityOrMissionDesc', TEXT, './/irs:ReturnData//irs:ActivityOrMissionDesc'),
+    ('FormationYr', TEXT, './/irs:ReturnData//irs:FormationYr'),
+    ('LegalDomicileStateCd', TEXT, './/irs:ReturnData//irs:LegalDomicileStateCd'),
+    ('TotalEmployeeCnt', TEXT, './/irs:ReturnData//irs:TotalEmployeeCnt'),
+    ('TotalVolunteersCnt', TEXT, './/irs:ReturnData//irs:TotalVolunteersCnt'),
+    ('PYTotalRevenueAmt', TEXT, './/irs:ReturnData//irs:PYTotalRevenueAmt'),
+    ('CYTotalRevenueAmt', TEXT, './/irs:ReturnData//irs:CYTotalRevenueAmt'),
+    ('PYSalariesCompEmpBnftPaidAmt', TEXT, './/irs:ReturnData//irs:PYSalariesCompEmpBnftPaidAmt'),
+    ('CYSalariesCompEmpBnftPaidAmt', TEXT, './/irs:ReturnData//irs:CYSalariesCompEmpBnftPaidAmt'),
+    ('TotalAssetsBOYAmt', TEXT, './/irs:ReturnData//irs:TotalAssetsBOYAmt'),
+    ('TotalAssetsEOYAmt', TEXT, './/irs:ReturnData//irs:TotalAssetsEOYAmt'),
+    ('TotalLiabilitiesBOYAmt', TEXT, './/irs:ReturnData//irs:TotalLiabilitiesBOYAmt'),
+    ('TotalLiabilitiesEOYAmt', TEXT, './/irs:ReturnData//irs:TotalLiabilitiesEOYAmt'),
+    ('TotalProgramServiceExpensesAmt', TEXT, './/irs:ReturnData//irs:TotalProgramServiceExpensesAmt'),
+    ('PoliticalCampaignActyInd', TEXT, './/irs:ReturnData//irs:PoliticalCampaignActyInd'),
+    ('LobbyingActivitiesInd', TEXT, './/irs:ReturnData//irs:LobbyingActivitiesInd'),
+    ('SubjectToProxyTaxInd', TEXT, './/irs:ReturnData//irs:SubjectToProxyTaxInd'),
+    ('MoreThan5000KToOrgInd', TEXT, './/irs:ReturnData//irs:MoreThan5000KToOrgInd'),
+    ('MoreThan5000KToIndividualsInd', TEXT, './/irs:ReturnData//irs:MoreThan5000KToIndividualsInd'),
+    ('ProfessionalFundraisingInd', TEXT, './/irs:ReturnData//irs:ProfessionalFundraisingInd'),
+    ('GrantsToOrganizationsInd', TEXT, './/irs:ReturnData//irs:GrantsToOrganizationsInd'),
+    ('GrantsToIndividualsInd', TEXT, './/irs:ReturnData//irs:GrantsToIndividualsInd'),
+    ('MissionDesc', TEXT, './/irs:ReturnData//irs:MissionDesc'),
+    ('Desc', TEXT, './/irs:ReturnData//irs:Desc'),
 ]
 header = [g[0] for g in getters]
+# Stored as numbers by --format parquet and sqlite
+column_types = {name: int for name in header if name.endswith(('Amt', 'Cnt', 'Yr'))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pull IRS Form 990 data from S3.')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='number of downloads in flight at once (default 8)')
+    parser.add_argument('--retries', type=int, default=4,
+                        help='retries per document on transient errors (default 4)')
+    parser.add_argument('--base-url', default=None,
+                        help='fetch the *_public.xml documents from here instead of S3')
+    parser.add_argument('--index-db', default=INDEX_DB,
+                        help='EIN --> filing index (default {})'.format(INDEX_DB))
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help='where to cache downloaded documents (default {})'.format(CACHE_DIR))
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always download, and do not store, the documents')
+    parser.add_argument('--parse-workers', type=int, default=None,
+                        help='processes parsing XML (default: one per core)')
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help='downloaded documents allowed to wait for a parser (default 64)')
+    parser.add_argument('--report-every', type=float, default=30,
+                        help='seconds between progress reports (default 30)')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the cities and returns finished by an interrupted run')
+    add_sink_arguments(parser)
+    args = parser.parse_args()
+    if args.resume and args.format != 'tsv':
+        parser.error('--resume only works with --format tsv')
+
+    filings = open_index(args.index_db)
+
+    # ---------- set up for pulling the AWS data --------- #
+    aws990s = os.path.join('data', 'form990')
+    if not os.path.exists(aws990s):
+        os.makedirs(aws990s)
+
+
+    desired_cities = (
+        #('Seattle', 'WA'), ) #,
+        ('New York', 'NY'),
+        ('Atlanta', 'GA'),
+        ('Chicago', 'IL'),
+        ('Detroit', 'MI'),
+        ('Missoula', 'MT'))
+
+    desired_states = ('WA', 'NY', 'GA', 'IL', 'MI', 'MT')
+
+    cache = None if args.no_cache else DocumentCache(args.cache_dir)
+    fetcher = Fetcher(workers=args.workers, retries=args.retries,
+                      base_url=args.base_url, cache=cache)
+
+    if args.format == 'tsv':
+        city_files = CityFiles(aws990s, header, resume=args.resume)
+    else:
+        city_files = SinkCityFiles(sink_from_args(args, 'form990', header, column_types))
+
+    def jobs():
+        """Yield ((city, EIN), url) for every return to fetch, city by city."""
+        #for city, state in desired_cities:
+        for state in desired_states:
+            #print('Working on {}, {}'.format(city, state))
+            print('Working on', state)
+            possible_files = glob.glob(os.path.join('data', 'pub78',state, '*'))
+            #possible_cities = [os.path.basename(f)[:-4].lower() for f in possible_files]
+            #match = difflib.get_close_matches(city.lower(), possible_cities, n=1)[0]
+            #idx = possible_cities.index(match)
+            #filename = possible_files[idx]
+            if not os.path.exists(os.path.join(aws990s, state)):
+                os.makedirs(os.path.join(aws990s, state))
+            for filename in possible_files:
+                city = os.path.join(state, os.path.basename(filename))
+                already_done = city_files.start(city)
+                if already_done is None:
+                    continue  # finished in an earlier run
+                with open(filename) as list_of_eins:
+                    eins = [line.split('\t', 1)[0] for line in list_of_eins]
+                for ein in eins:
+                    if ein in already_done:
+                        continue
+                    filing = filings.latest(ein)
+                    if filing is not None:
+                        yield (city, ein), filing.url
+
+    def write(key, row):
+        city, ein = key
+        city_files.write(city, ein, row)
 
-
-ein_lookups = {}
-details = json.loads(open(os.path.join('data', 'index_2015.json')).read())
-for row in details['Filings2015']:
-    ein_lookups[row['EIN']] = row['URL']
-
-details = json.loads(open(os.path.join('data', 'index_2016.json')).read())
-for row in details['Filings2016']:
-    ein_lookups[row['EIN']] = row['URL']
-
-del details  # for memory
-
-
-# ---------- set up for pulling the AWS data --------- #
-aws990s = os.path.join('data', 'form990')
-if not os.path.exists(aws990s):
-    os.makedirs(aws990s)
-
-
-desired_cities = (
-    #('Seattle', 'WA'), ) #,
-    ('New York', 'NY'),
-    ('Atlanta', 'GA'),
-    ('Chicago', 'IL'),
-    ('Detroit', 'MI'),
-    ('Missoula', 'MT'))
-
-desired_states = ('WA', 'NY', 'GA', 'IL', 'MI', 'MT')
-
-#for city, state in desired_cities:
-for state in desired_states:
-    #print('Working on {}, {}'.format(city, state))
-    print('Working on', state)
-    possible_files = glob.glob(os.path.join('data', 'pub78',state, '*'))
-    #possible_cities = [os.path.basename(f)[:-4].lower() for f in possible_files]
-    #match = difflib.get_close_matches(city.lower(), possible_cities, n=1)[0]
-    #idx = possible_cities.index(match)
-    #filename = possible_files[idx]
-    if not os.path.exists(os.path.join(aws990s, state)):
-        os.makedirs(os.path.join(aws990s, state))
-    for filename in possible_files:
-        print('.....', filename)
-        with open(filename) as list_of_eins:
-            eins = [line.split('\t', 1)[0] for line in list_of_eins]
-        #if not os.path.exists(os.path.join(aws990s, state)):
-        #    os.makedirs(os.path.join(aws990s, state))
-        city = os.path.basename(filename)    
-        with open(os.path.join(aws990s, state, city), 'w') as csvfile:
-            data_writer = csv.writer(csvfile, delimiter='\t')
-            data_writer.writerow(header)
-            counter = 0
-            for ein in eins:
-                if ein in ein_lookups:
-                    url = ein_lookups[ein]
-                    response = requests.get(url)
-                    root = ET.fromstring(response.content.decode('utf-8'))
-                    data_writer.writerow([g[1]() for g in getters])
-                    counter += 1
-                    if counter %250 == 0:
-                        print(counter)
+    try:
+        form990_pipeline.run(
+            jobs(), fetcher, getters, write,
+            parse_workers=args.parse_workers,
+            queue_size=args.queue_size,
+            report_every=args.report_every)
+        city_files.close()
+    finally:
+        # Interrupted crawls (the ones --resume picks up) count too.
+        if cache is not None:
+            print('Cache:', cache.summary())
+            cache.save_stats()
+
+    fetcher.close()
+    filings.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -7,40 +7,29 @@ abbreviation.
     File output format is tab-separated: city\tlon\tlat.
 """
 import csv
-import io
 import os
-import urllib.request
-import zipfile
+
+from streaming_zip import open_zipped_text
 
 
 data_url = (
     'http://www2.census.gov/geo/docs/maps-data/data/gazetteer/'
     '2016_Gazetteer/2016_Gaz_place_national.zip'
 )
-response = urllib.request.urlopen(data_url)
-buffered_zipfile = io.BytesIO()
-chunk = response.read(16384)
-while chunk:
-    buffered_zipfile.write(chunk)
-    chunk = response.read(16384)
-
-z = zipfile.ZipFile(buffered_zipfile)
-fname = z.namelist()[0]
-gaz = io.StringIO(z.open(fname).read().decode('latin-1'))
-
-rdr = csv.reader(gaz, delimiter='\t')
-header = [h.strip() for h in next(rdr)]
-entries = [[r.strip() for r in row] for row in rdr]
 locations = {}
-for e in entries:
-    state = e[0]
-    city = e[3].rsplit(' ', 1)[0]
-    lon = e[-1]
-    lat = e[-2]
-    if state not in locations:
-        locations[state] = [[city, lon, lat]]
-    else:
-        locations[state].append([city, lon, lat])
+with open_zipped_text(data_url, encoding='latin-1') as gaz:
+    rdr = csv.reader(gaz, delimiter='\t')
+    header = [h.strip() for h in next(rdr)]
+    for row in rdr:
+        e = [r.strip() for r in row]
+        state = e[0]
+        city = e[3].rsplit(' ', 1)[0]
+        lon = e[-1]
+        lat = e[-2]
+        if state not in locations:
+            locations[state] = [[city, lon, lat]]
+        else:
+            locations[state].append([city, lon, lat])
 
 census_places_lon_lat = os.path.join('data', 'census_places_lon_lat')
 if not os.path.exists(census_places_lon_lat):
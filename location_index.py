@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Find nonprofits by location, using the `location` R*Tree in nonprofits.db.
+
+`create_and_populate_database.py` keeps `location` up to date: one point
+per EIN that has a lon/lat, keyed by the EIN as an integer, and holding
+the EIN as it was loaded.  The R*Tree narrows a search to a bounding box
+without scanning every row; exact coordinates then come from the `geo`
+table, joined on that EIN, so EINs stored without their leading zeros
+are found too.
+
+    index = LocationIndex()
+    index.bbox(-87.94, 41.64, -87.52, 42.02)            # Places in a box
+    index.radius(-87.63, 41.88, 5, tags=['arts'])       # within 5 km, nearest first
+    index.nearest(-87.63, 41.88, k=10, states=['IL'])   # the 10 closest
+
+`tags` keeps places with any of the given tags, `states` those whose
+business address is in any of the given states.  From the shell:
+
+    python location_index.py radius -87.63 41.88 5 --tag arts --state IL
+    python location_index.py nearest -87.63 41.88 -k 10
+    python location_index.py bbox -87.94 41.64 -87.52 42.02
+"""
+import argparse
+import collections
+import math
+import sqlite3
+
+from create_and_populate_database import DBNAME
+
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+HALF_CIRCUMFERENCE_KM = math.pi * EARTH_RADIUS_KM
+
+Place = collections.namedtuple('Place', ['ein', 'lon', 'lat', 'distance_km'])
+
+
+def haversine_km(lon1, lat1, lon2, lat2):
+    """Great-circle distance between two points, in km."""
+    lon1, lat1, lon2, lat2 = map(math.radians, (lon1, lat1, lon2, lat2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_box(lon, lat, radius_km):
+    """The (min_lon, min_lat, max_lon, max_lat) box around a circle.
+
+    The box may run past +/-180 degrees of longitude; see `lon_ranges`.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    if min_lat == -90.0 or max_lat == 90.0:
+        return -180.0, min_lat, 180.0, max_lat  # the circle takes in a pole
+    # The circle is widest in longitude at the latitude where its edge
+    # is tangent to a meridian.
+    dlon = math.degrees(math.asin(min(1.0, math.sin(math.radians(dlat)) /
+                                      math.cos(math.radians(lat)))))
+    return lon - dlon, min_lat, lon + dlon, max_lat
+
+
+def lon_ranges(min_lon, max_lon):
+    """Split a longitude range that crosses +/-180 into ranges that don't."""
+    if max_lon - min_lon >= 360:
+        return [(-180.0, 180.0)]
+    if min_lon < -180:
+        return [(min_lon + 360, 180.0), (-180.0, max_lon)]
+    if max_lon > 180:
+        return [(min_lon, 180.0), (-180.0, max_lon - 360)]
+    return [(min_lon, max_lon)]
+
+
+class LocationIndex:
+    def __init__(self, path=DBNAME):
+        self.conn = sqlite3.connect(path)
+
+    def _filters(self, tags, states):
+        sql, params = '', []
+        if states:
+            sql += (
+                ' AND EXISTS (SELECT 1 FROM latest_contact_info AS lci'
+                ' WHERE lci.ein = g.ein AND lci.business_addr_state IN ({}))'
+            ).format(', '.join('?' * len(states)))
+            params.extend(states)
+        if tags:
+            sql += (
+                ' AND EXISTS (SELECT 1 FROM tag_lookup AS tl'
+                ' WHERE tl.ein = g.ein AND tl.tag_id IN'
+                ' (SELECT id FROM tag WHERE name IN ({})))'
+            ).format(', '.join('?' * len(tags)))
+            params.extend(tags)
+        return sql, params
+
+    def _box(self, min_lon, min_lat, max_lon, max_lat, tags, states):
+        """Yield (ein, lon, lat) for every place in the box."""
+        filters, filter_params = self._filters(tags, states)
+        query = (
+            "SELECT g.ein, g.lon, g.lat FROM location AS r"
+            " JOIN geo AS g ON g.ein = r.ein"
+            " WHERE r.max_lon >= ? AND r.min_lon <= ?"
+            " AND r.max_lat >= ? AND r.min_lat <= ?"
+            # The R*Tree stores 32-bit floats, rounded outward; check exactly.
+            " AND g.lon BETWEEN ? AND ? AND g.lat BETWEEN ? AND ?"
+        ) + filters
+        for west, east in lon_ranges(min_lon, max_lon):
+            yield from self.conn.execute(
+                query, [west, east, min_lat, max_lat] * 2 + filter_params)
+
+    def bbox(self, min_lon, min_lat, max_lon, max_lat, tags=None, states=None):
+        """Every place in the box, in no particular order."""
+        return [Place(ein, lon, lat, None) for ein, lon, lat in
+                self._box(min_lon, min_lat, max_lon, max_lat, tags, states)]
+
+    def radius(self, lon, lat, radius_km, tags=None, states=None):
+        """Every place within `radius_km` of (lon, lat), nearest first."""
+        places = []
+        for ein, place_lon, place_lat in self._box(
+                *radius_box(lon, lat, radius_km), tags, states):
+            distance = haversine_km(lon, lat, place_lon, place_lat)
+            if distance <= radius_km:
+                places.append(Place(ein, place_lon, place_lat, distance))
+        places.sort(key=lambda place: place.distance_km)
+        return places
+
+    def nearest(self, lon, lat, k=10, tags=None, states=None, start_km=2.0):
+        """The `k` places nearest (lon, lat), nearest first.
+
+        Searches ever wider circles, starting at `start_km`, until one
+        holds at least `k` places; nothing outside it can be nearer.
+        """
+        radius_km = start_km
+        while True:
+            places = self.radius(lon, lat, radius_km, tags, states)
+            if len(places) >= k or radius_km >= HALF_CIRCUMFERENCE_KM:
+                return places[:k]
+            radius_km *= 4
+
+    def names(self, eins):
+        """Map each EIN in `eins` to its organization's name."""
+        names = {}
+        for ein in eins:
+            row = self.conn.execute('SELECT name FROM nfp WHERE ein = ?', (ein,)).fetchone()
+            names[ein] = row[0] if row else ''
+        return names
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find nonprofits by location.')
+    parser.add_argument('--db', default=DBNAME,
+                        help='database file (default {})'.format(DBNAME))
+    parser.add_argument('--tag', dest='tags', action='append',
+                        help='only places with this tag (repeat for any of several)')
+    parser.add_argument('--state', dest='states', action='append',
+                        help='only places in this state (repeat for any of several)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bbox = subparsers.add_parser('bbox', help='places in a bounding box')
+    for name in ('min_lon', 'min_lat', 'max_lon', 'max_lat'):
+        bbox.add_argument(name, type=float)
+    radius = subparsers.add_parser('radius', help='places within a distance')
+    nearest = subparsers.add_parser('nearest', help='the closest places')
+    for subparser in (radius, nearest):
+        subparser.add_argument('lon', type=float)
+        subparser.add_argument('lat', type=float)
+    radius.add_argument('km', type=float)
+    nearest.add_argument('-k', type=int, default=10, help='how many (default 10)')
+    args = parser.parse_args()
+
+    index = LocationIndex(args.db)
+    if args.command == 'bbox':
+        places = index.bbox(args.min_lon, args.min_lat, args.max_lon, args.max_lat,
+                            args.tags, args.states)
+    elif args.command == 'radius':
+        places = index.radius(args.lon, args.lat, args.km, args.tags, args.states)
+    else:
+        places = index.nearest(args.lon, args.lat, args.k, args.tags, args.states)
+    names = index.names(place.ein for place in places)
+    for place in places:
+        distance = '' if place.distance_km is None else '{:.2f}'.format(place.distance_km)
+        print('{}\t{:.5f}\t{:.5f}\t{}\t{}'.format(
+            place.ein, place.lon, place.lat, distance, names[place.ein]))
+    index.close()
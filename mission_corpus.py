@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""Load every organization's EIN, name, mission and city from data/form990*/.
+
+Parsing all of the city files takes minutes.  `load()` does it once and
+saves the result in one file, `data/corpus.snapshot`, which later calls
+memory-map instead.  The snapshot lists the size and modification time
+of every city file it was built from, and is rebuilt when any of them
+changes or is added or removed.
+
+    corpus = load()
+    corpus.missions()         # {ein: mission}
+    corpus.nfp_names()        # {ein: name}
+    corpus.ein_state_city()   # {state: {city: [ein, ...]}}
+    corpus.text('mission', 10)  # one mission, without decoding the rest
+
+A 990 filer's mission is its name, activity, mission and description
+(each once) joined by two spaces; a 990N filer's is just its name.  When
+an EIN is in several files the last one read wins, 990N after 990.
+
+The snapshot is a JSON header followed by columns, one row per EIN.
+Text columns are their strings' UTF-8 joined by NULs, with an array of
+offsets to find any one string; the cities are arrays of row numbers.
+Arrays are in the machine's byte order, so don't copy snapshots between
+machines; delete one (or pass --rebuild) to build it again.
+
+    python mission_corpus.py --rebuild
+"""
+import argparse
+import array
+import csv
+import glob
+import json
+import mmap
+import os
+import time
+
+
+SNAPSHOT = os.path.join('data', 'corpus.snapshot')
+SOURCES = (os.path.join('data', 'form990'), os.path.join('data', 'form990N'))
+MAGIC = b'NFPCORPUS1\n'
+
+NAME_FIELDS = ('BusinessName', 'Organization Name')
+MISSION_FIELDS = ('ActivityOrMissionDesc', 'MissionDesc', 'Desc')
+
+
+def get_city(path):
+    return os.path.basename(path)[:-4]
+
+
+def source_files(sources=SOURCES):
+    """[(path, size, mtime_ns)] for every city file, in the order they're read."""
+    files = []
+    for source in sources:
+        for path in sorted(glob.glob(os.path.join(source, '*', '*'))):
+            stat = os.stat(path)
+            files.append((path, stat.st_size, stat.st_mtime_ns))
+    return files
+
+
+def read_city_file(path):
+    """Yield (ein, name, mission) for each row of a form990 or form990N file."""
+    with open(path) as infile:
+        rdr = csv.reader(infile, delimiter='\t')
+        first = next(rdr, None)
+        if first is None:
+            return
+        if first[0] == 'EIN':
+            columns = {name: i for i, name in enumerate(first)}
+            rows = rdr
+        else:
+            # No header: the column positions of older files.
+            columns = {NAME_FIELDS[0]: 2, MISSION_FIELDS[0]: 27,
+                       MISSION_FIELDS[1]: -2, MISSION_FIELDS[2]: -1}
+            rows = [first]
+            rows.extend(rdr)
+        name = next(columns[f] for f in NAME_FIELDS if f in columns)
+        mission = [columns[f] for f in MISSION_FIELDS if f in columns]
+        for row in rows:
+            if not mission:
+                yield row[0], row[name], row[name]
+                continue
+            texts = [row[name]] + [row[i] for i in mission if len(row) > abs(i)]
+            yield row[0], row[name], '  '.join(dict.fromkeys(t for t in texts if t))
+
+
+def read_corpus(files):
+    """Return ({ein: (name, mission)}, {(state, city): [ein, ...]}) from `files`."""
+    organizations = {}
+    cities = {}
+    for path, __, __ in files:
+        key = os.path.basename(os.path.dirname(path)), get_city(path)
+        eins = cities.setdefault(key, [])
+        for ein, name, mission in read_city_file(path):
+            organizations[ein] = name, mission
+            eins.append(ein)
+    return organizations, cities
+
+
+def _text_column(strings):
+    encoded = [s.replace('\0', '').encode('utf-8') for s in strings]
+    offsets = array.array('Q', [0])
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data) + 1)
+    return b'\0'.join(encoded), offsets
+
+
+def write_snapshot(path, files, organizations, cities):
+    row = {ein: i for i, ein in enumerate(organizations)}
+    city_start = array.array('I', [0])
+    city_rows = array.array('I')
+    for eins in cities.values():
+        city_rows.extend(row[ein] for ein in eins)
+        city_start.append(len(city_rows))
+    columns = {
+        'ein': list(organizations),
+        'name': [name for name, __ in organizations.values()],
+        'mission': [mission for __, mission in organizations.values()],
+        'state': [state for state, __ in cities],
+        'city': [city for __, city in cities],
+    }
+    sections = []
+    for name, strings in columns.items():
+        data, offsets = _text_column(strings)
+        sections += [(name, data), (name + '.offsets', offsets.tobytes())]
+    sections += [('city_start', city_start.tobytes()), ('city_rows', city_rows.tobytes())]
+
+    layout, position = {}, 0
+    for name, data in sections:
+        layout[name] = [position, len(data)]
+        position += len(data) + (-len(data) % 8)  # keep the arrays aligned
+    header = json.dumps({'sources': files, 'rows': len(organizations),
+                         'cities': len(cities), 'sections': layout}).encode('utf-8')
+    header += b' ' * (-(len(MAGIC) + 8 + len(header)) % 8)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as outfile:
+        outfile.write(MAGIC)
+        outfile.write(len(header).to_bytes(8, 'little'))
+        outfile.write(header)
+        for name, data in sections:
+            outfile.write(data)
+            outfile.write(b'\0' * (-len(data) % 8))
+    os.replace(tmp, path)
+
+
+class Corpus:
+    def __init__(self, path=SNAPSHOT):
+        self.path = path
+        with open(path, 'rb') as infile:
+            self.mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            self.mm.close()
+            raise ValueError('{} is not a corpus snapshot'.format(path))
+        size = int.from_bytes(self.mm[len(MAGIC):len(MAGIC) + 8], 'little')
+        start = len(MAGIC) + 8
+        self.header = json.loads(self.mm[start:start + size].decode('utf-8'))
+        self.base = start + size
+        self._views = {}
+
+    def __len__(self):
+        return self.header['rows']
+
+    def sources(self):
+        return [tuple(source) for source in self.header['sources']]
+
+    def _section(self, name, fmt=None):
+        if name not in self._views:
+            offset, length = self.header['sections'][name]
+            view = memoryview(self.mm)[self.base + offset:self.base + offset + length]
+            self._views[name] = view.cast(fmt) if fmt else view
+        return self._views[name]
+
+    def column(self, name):
+        """Every string in a text column: ein, name, mission, state or city."""
+        count = self.header['rows'] if name in ('ein', 'name', 'mission') else self.header['cities']
+        if count == 0:
+            return []
+        return bytes(self._section(name)).decode('utf-8').split('\0')
+
+    def text(self, name, i):
+        """The `i`th string of a text column, decoding only that one."""
+        offsets = self._section(name + '.offsets', 'Q')
+        start, end = offsets[i], offsets[i + 1] - 1
+        return bytes(self._section(name)[start:end]).decode('utf-8')
+
+    def nfp_names(self):
+        return dict(zip(self.column('ein'), self.column('name')))
+
+    def missions(self):
+        missions = dict(zip(self.column('ein'), self.column('mission')))
+        missions.pop('', None)  # There was an empty EIN somewhere
+        return missions
+
+    def ein_state_city(self):
+        eins = self.column('ein')
+        start = self._section('city_start', 'I')
+        rows = self._section('city_rows', 'I')
+        lookup = {}
+        for i, (state, city) in enumerate(zip(self.column('state'), self.column('city'))):
+            lookup.setdefault(state, {})[city] = [eins[r] for r in rows[start[i]:start[i + 1]]]
+        return lookup
+
+    def close(self):
+        for view in self._views.values():
+            view.release()
+        self._views = {}
+        self.mm.close()
+
+
+def load(path=SNAPSHOT, rebuild=False, sources=SOURCES):
+    """Return a Corpus for the current city files, rebuilding the snapshot if needed."""
+    files = source_files(sources)
+    if not rebuild and os.path.exists(path):
+        try:
+            corpus = Corpus(path)
+        except ValueError:
+            pass
+        else:
+            if corpus.sources() == [tuple(f) for f in files]:
+                return corpus
+            corpus.close()
+    organizations, cities = read_corpus(files)
+    write_snapshot(path, files, organizations, cities)
+    return Corpus(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or check the corpus snapshot.')
+    parser.add_argument('--snapshot', default=SNAPSHOT,
+                        help='snapshot file (default {})'.format(SNAPSHOT))
+    parser.add_argument('--rebuild', action='store_true',
+                        help='rebuild it even if the city files have not changed')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    corpus = load(args.snapshot, args.rebuild)
+    loaded = time.perf_counter()
+    missions = corpus.missions()
+    ein_state_city = corpus.ein_state_city()
+    print('{} organizations in {} cities from {} files'.format(
+        len(corpus), sum(len(c) for c in ein_state_city.values()), len(corpus.sources())))
+    print('snapshot ready in {:.2f}s, dicts built in {:.2f}s'.format(
+        loaded - start, time.perf_counter() - loaded))
+    del missions, ein_state_city
+    corpus.close()
@@ -0,0 +1,131 @@
+"""Tag mission statements with the matchers in all_tags.yml, in one pass each.
+
+`all_tags.yml` maps each tag to a list of matchers; a mission gets a tag
+if any of its matchers appears anywhere in the lowercased mission.  The
+straightforward way to check (`naive_tags`) scans the mission once per
+matcher, about 400 times.  `Tagger` compiles every matcher into one
+Aho-Corasick automaton instead, and walks each mission once:
+
+    tagger = Tagger(yaml.safe_load(open('all_tags.yml')))
+    tagger.tags('Youth choir and music lessons')   # ['arts', 'youth']
+
+Tags come back in the order of the YAML file, as they do from
+`naive_tags`.  `tag_missions` spreads the work over a pool of processes.
+"""
+import collections
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def naive_tags(tags, text):
+    """The tags whose matchers appear in `text`, checked one matcher at a time."""
+    text = text.lower()
+    found = []
+    for tag, matchers in tags.items():
+        for m in matchers:
+            if m in text:
+                found.append(tag)
+                break
+    return found
+
+
+class Tagger:
+    # Walking the automaton costs the same per character however many
+    # matchers there are; with only a few, scanning for each is quicker.
+    SCAN_LIMIT = 60
+
+    def __init__(self, tags):
+        self.names = list(tags)
+        self.scan = None
+        if sum(len(matchers) for matchers in tags.values()) <= self.SCAN_LIMIT:
+            self.scan = tags
+        # Build the trie of matchers; each node's output is a bitmask of tags.
+        goto = [{}]
+        masks = [0]
+        for bit, matchers in enumerate(tags.values()):
+            for matcher in matchers:
+                node = 0
+                for ch in matcher:
+                    if ch not in goto[node]:
+                        goto.append({})
+                        masks.append(0)
+                        goto[node][ch] = len(goto) - 1
+                    node = goto[node][ch]
+                masks[node] |= 1 << bit
+        # Breadth first, fill in the failure links and turn the trie into a
+        # DFA: every node gets a transition for every character that leads
+        # anywhere but the root, so matching never has to backtrack.
+        fail = [0] * len(goto)
+        self.delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = collections.deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            moves = dict(self.delta[fail[node]])
+            for ch, child in goto[node].items():
+                fail[child] = self.delta[fail[node]].get(ch, 0) if node else 0
+                masks[child] |= masks[fail[child]]
+                moves[ch] = child
+                queue.append(child)
+            self.delta[node] = moves
+        self.masks = masks
+
+    def mask(self, text):
+        """A bitmask of the tags found in `text`."""
+        delta, masks = self.delta, self.masks
+        node, found = 0, masks[0]
+        for ch in text.lower():
+            node = delta[node].get(ch, 0)
+            found |= masks[node]
+        return found
+
+    def tags(self, text):
+        """The tags whose matchers appear in `text`, in the tags file's order."""
+        if self.scan is not None:
+            return naive_tags(self.scan, text)
+        found = self.mask(text)
+        return [name for bit, name in enumerate(self.names) if found >> bit & 1]
+
+
+_tagger = None
+
+
+def _init_worker(tags):
+    global _tagger
+    _tagger = Tagger(tags)
+
+
+def _tag_chunk(chunk):
+    return [(ein, _tagger.tags(mission)) for ein, mission in chunk]
+
+
+def _chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def tag_missions(missions, tags, processes=None, chunksize=5000):
+    """Yield (ein, tags) for each (ein, mission) in `missions`, in order.
+
+    Uses `processes` worker processes (default: one per CPU); with 1,
+    tags everything in this process.
+    """
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        tagger = Tagger(tags)
+        for ein, mission in missions:
+            yield ein, tagger.tags(mission)
+        return
+    # Fork where we can, so the workers start without re-importing the caller.
+    context = None
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(processes, mp_context=context,
+                             initializer=_init_worker, initargs=(tags,)) as executor:
+        for tagged in executor.map(_tag_chunk, _chunks(missions, chunksize)):
+            yield from tagged
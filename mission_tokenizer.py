@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Split mission statements into the Porter-stemmed words that get clustered.
+
+A `Tokenizer` works like `tokenize` in cluster_missions.ipynb: lowercase,
+split on spaces and punctuation, drop English stopwords, stem, and
+return the set of stems.  Stopwords are a frozenset rather than NLTK's
+list, and stems are memoized: far fewer distinct words than words come
+up, and stemming is most of the cost.
+
+    tokenize = Tokenizer()
+    tokenize('Feeding the hungry of Chicago')   # {'feed', 'hungri', 'chicago'}
+
+`tokenize_corpus` does a whole corpus in chunks across worker processes,
+keeping the order, and tallies the tokens and stem cache hits in a
+`TokenizerStats`:
+
+    stats = TokenizerStats()
+    token_sets = list(tokenize_corpus(missions.values(), stats=stats))
+    print(stats.summary())
+
+Run on its own, it tokenizes the missions from `mission_corpus` and
+prints those statistics:
+
+    python mission_tokenizer.py --processes 4
+"""
+import argparse
+import functools
+import itertools
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from nltk.corpus import stopwords
+from nltk.stem.porter import PorterStemmer
+
+
+STOPWORDS = frozenset(stopwords.words('english'))
+CACHE_SIZE = 500000
+
+
+class TokenizerStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.documents = self.tokens = self.hits = self.misses = 0
+
+    def add(self, documents, tokens, hits, misses):
+        self.documents += documents
+        self.tokens += tokens
+        self.hits += hits
+        self.misses += misses
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        lookups = self.hits + self.misses
+        return '{} documents, {} tokens in {:.1f}s ({:.0f} tokens/s); stem cache hit rate {:.1f}%'.format(
+            self.documents, self.tokens, elapsed, self.tokens / elapsed,
+            100 * self.hits / lookups if lookups else 0)
+
+
+class Tokenizer:
+    def __init__(self, stopwords=STOPWORDS, cache_size=CACHE_SIZE,
+                 space_or_punct=re.compile(r"[\s,;:!\.]+")):
+        self.stopwords = frozenset(stopwords)
+        self.split = space_or_punct.split
+        # Keyed by the word as it appears (lowercased); the least recently
+        # used stems are dropped once there are `cache_size` of them.
+        self.stem = functools.lru_cache(maxsize=cache_size)(PorterStemmer().stem)
+        self.tokens = 0
+
+    def __call__(self, phrase):
+        words = [word for word in self.split(phrase.lower())
+                 if word and word not in self.stopwords]
+        self.tokens += len(words)
+        stem = self.stem
+        return set(stem(word) for word in words)
+
+    def counts(self):
+        """(tokens, cache hits, cache misses) so far."""
+        info = self.stem.cache_info()
+        return self.tokens, info.hits, info.misses
+
+
+_tokenizer = None
+
+
+def _init_worker(cache_size):
+    global _tokenizer
+    _tokenizer = Tokenizer(cache_size=cache_size)
+
+
+def _tokenize_chunk(chunk):
+    before = _tokenizer.counts()
+    token_sets = [_tokenizer(text) for text in chunk]
+    after = _tokenizer.counts()
+    return token_sets, [a - b for a, b in zip(after, before)]
+
+
+def _chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def tokenize_corpus(texts, processes=None, chunksize=2000, cache_size=CACHE_SIZE, stats=None):
+    """Yield the token set of each of `texts`, in order.
+
+    Uses `processes` worker processes (default: one per CPU), each with its
+    own stem cache; with 1, tokenizes everything in this process.  Counts
+    go into `stats` if it's given.
+    """
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        _init_worker(cache_size)
+        for token_sets, counts in map(_tokenize_chunk, _chunks(texts, chunksize)):
+            if stats is not None:
+                stats.add(len(token_sets), *counts)
+            yield from token_sets
+        return
+    context = None
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(processes, mp_context=context, initializer=_init_worker,
+                             initargs=(cache_size,)) as executor:
+        for token_sets, counts in executor.map(_tokenize_chunk, _chunks(texts, chunksize)):
+            if stats is not None:
+                stats.add(len(token_sets), *counts)
+            yield from token_sets
+
+
+if __name__ == '__main__':
+    import mission_corpus
+
+    parser = argparse.ArgumentParser(description='Tokenize every mission and report the speed.')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE,
+                        help='stems to remember per process (default {})'.format(CACHE_SIZE))
+    parser.add_argument('--limit', type=int, default=None,
+                        help='only tokenize this many missions')
+    args = parser.parse_args()
+
+    corpus = mission_corpus.load()
+    missions = list(itertools.islice(corpus.missions().values(), args.limit))
+    corpus.close()
+    stats = TokenizerStats()
+    vocabulary = set()
+    for tokens in tokenize_corpus(missions, args.processes, cache_size=args.cache_size,
+                                  stats=stats):
+        vocabulary.update(tokens)
+    print(stats.summary())
+    print('{} distinct stems'.format(len(vocabulary)))
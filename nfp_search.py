@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Ranked full-text search over organization names, missions and activities.
+
+`create_and_populate_database.py` keeps an FTS5 index, `nfp_search`,
+over each nfp row's name, mission, activity, description and
+doing-business-as names, Porter-stemmed like the tokenizer in
+`cluster_missions.ipynb` ("shelters" finds "shelter").  Its rowid is the
+EIN as an integer.
+
+    index = SearchIndex()
+    index.search('food bank', limit=10)      # [Hit(ein, score, snippet), ...]
+    index.combined('food bank', limit=10)    # combined_data rows, best first
+
+By default the words of a query must all appear, in any column; pass
+raw=True to use FTS5 query syntax instead ('food OR meal', 'name: choir',
+'"food bank"', 'shelt*').  A name match counts for the most.
+
+    python nfp_search.py food bank --limit 10
+    python nfp_search.py --raw 'name: choir NOT church'
+
+To join the hits to other tables in SQL, match on the rowid:
+
+    SELECT cd.* FROM nfp_search JOIN combined_data AS cd
+      ON cd.ein = printf('%09d', nfp_search.rowid)
+    WHERE nfp_search MATCH 'food bank' ORDER BY nfp_search.rank
+"""
+import argparse
+import collections
+import sqlite3
+
+from create_and_populate_database import DBNAME
+
+
+# bm25() weights for name, mission, activity, description, dba
+WEIGHTS = (10.0, 5.0, 5.0, 2.0, 8.0)
+
+Hit = collections.namedtuple('Hit', ['ein', 'score', 'snippet'])
+
+
+def plain_query(text):
+    """Quote each word of `text`, so punctuation can't be read as FTS5 syntax."""
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in text.split())
+
+
+class SearchIndex:
+    def __init__(self, path=DBNAME):
+        self.conn = sqlite3.connect(path)
+
+    def _match(self, text, raw):
+        return text if raw else plain_query(text)
+
+    def search(self, text, limit=20, offset=0, raw=False):
+        """The best matches for `text`, best first; lower scores are better."""
+        query = (
+            "SELECT printf('%09d', rowid), bm25(nfp_search, {}),"
+            " snippet(nfp_search, -1, '[', ']', '...', 12)"
+            " FROM nfp_search WHERE nfp_search MATCH ?"
+            " ORDER BY 2 LIMIT ? OFFSET ?"
+        ).format(', '.join(str(w) for w in WEIGHTS))
+        return [Hit(*row) for row in self.conn.execute(
+            query, (self._match(text, raw), limit, offset))]
+
+    def combined(self, text, limit=20, raw=False):
+        """The combined_data rows (as dicts) for the best matches, best first.
+
+        Reads `combined_data_materialized` if the database has it, which
+        is much faster than the view.
+        """
+        table = 'combined_data'
+        if self.conn.execute("SELECT 1 FROM sqlite_master "
+                             "WHERE name = 'combined_data_materialized'").fetchone():
+            table = 'combined_data_materialized'
+        hits = self.search(text, limit, raw=raw)
+        rows = []
+        for hit in hits:
+            cursor = self.conn.execute(
+                'SELECT * FROM {} WHERE ein = ?'.format(table), (hit.ein,))
+            names = [d[0] for d in cursor.description]
+            rows.extend(dict(zip(names, row), snippet=hit.snippet) for row in cursor)
+        return rows
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search nonprofit names and missions.')
+    parser.add_argument('words', nargs='+')
+    parser.add_argument('--db', default=DBNAME,
+                        help='database file (default {})'.format(DBNAME))
+    parser.add_argument('--limit', type=int, default=20,
+                        help='how many results (default 20)')
+    parser.add_argument('--raw', action='store_true',
+                        help='treat the words as an FTS5 query')
+    args = parser.parse_args()
+
+    index = SearchIndex(args.db)
+    for hit in index.search(' '.join(args.words), args.limit, raw=args.raw):
+        print('{}\t{:.2f}\t{}'.format(hit.ein, hit.score, hit.snippet))
+    index.close()
@@ -11,10 +11,13 @@ insertions = {
         doing_business_as2,
         doing_business_as3,
         is_501c3,
-        year_formed
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+        year_formed,
+        source_id
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+    """,
+    "year_terminated": """
+      INSERT INTO year_terminated (ein, year, source_id) VALUES (?, ?, ?);
     """,
-    "year_terminated": "INSERT INTO year_terminated (ein, year) VALUES (?, ?);",
     "tax_return": """
       INSERT INTO tax_return (
         ein,
@@ -34,8 +37,9 @@ insertions = {
         does_lobbying,
         does_professional_fundrasing,
         does_grants_to_organizations,
-        does_grants_to_individuals
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+        does_grants_to_individuals,
+        source_id
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
     """,
     "latest_contact_info": """
       INSERT INTO latest_contact_info (
@@ -52,18 +56,36 @@ insertions = {
         principal_officer_addr_line_2,
         principal_officer_city,
         principal_officer_state,
-        principal_officer_zip)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+        principal_officer_zip,
+        source_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+    """,
+    "geo": """
+        INSERT OR REPLACE INTO geo (lon, lat, ein, source_id) VALUES (?, ?, ?, ?);
+    """,
+    "touched": "INSERT OR IGNORE INTO touched (ein) VALUES (?)",
+    "source_ein": "INSERT OR IGNORE INTO source_ein (source_id, ein) VALUES (?, ?)",
+    "reowned": "INSERT OR IGNORE INTO reowned (ein) VALUES (?)",
+    "latest_contact_info_geo_update_touched": """
+        UPDATE latest_contact_info
+        SET lon = (SELECT lon FROM geo WHERE geo.ein = latest_contact_info.ein),
+            lat = (SELECT lat FROM geo WHERE geo.ein = latest_contact_info.ein)
+        WHERE ein IN (SELECT ein FROM touched);
+    """,
+    "location_delete_touched": """
+        DELETE FROM location WHERE id IN (SELECT CAST(ein AS INTEGER) FROM touched);
+    """,
+    "location_insert_touched": """
+        INSERT OR REPLACE INTO location (id, min_lon, max_lon, min_lat, max_lat, ein)
+        SELECT DISTINCT CAST(ein AS INTEGER), lon, lon, lat, lat, ein
+        FROM latest_contact_info
+        WHERE ein IN (SELECT ein FROM touched)
+          AND ein != '' AND lon IS NOT NULL AND lat IS NOT NULL;
     """,
-    "latest_contact_info_geo_update": """
-        UPDATE OR IGNORE latest_contact_info
-        SET lon = ?, lat = ? WHERE ein = ?;
+    "tag": "INSERT OR IGNORE INTO tag (name) VALUES(?)",
+    "tag_lookup_by_id": """
+        INSERT INTO tag_lookup (tag_id, ein, source_id) VALUES (?, ?, ?)
     """,
-    "tag": "INSERT INTO tag (name) VALUES(?)",
-    "tag_lookup": """
-        INSERT INTO tag_lookup (tag_id, ein)
-        SELECT id, ? FROM tag WHERE tag.name = ?
-    """
   },
   "columns": {
     "nfp": [
@@ -94,6 +116,5 @@ insertions = {
         "Officer Address Line1", "Officer Address Line2",
         "Officer Address City", "Officer Address State", "Officer Address Postal Code"
     ],
-    "latest_contact_info_geo_update": ["lat_lon", "id"],
   }
 }
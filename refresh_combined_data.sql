@@ -0,0 +1,10 @@
+DROP TABLE IF EXISTS combined_data_materialized;
+
+CREATE TABLE combined_data_materialized AS
+  SELECT * FROM combined_data;
+
+CREATE INDEX combined_data_materialized_ein
+  ON combined_data_materialized (ein);
+
+CREATE INDEX combined_data_materialized_state_city
+  ON combined_data_materialized (state, city);
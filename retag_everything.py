@@ -1,105 +1,103 @@
-import csv
-import glob
+"""Tag every organization's mission and write data/tagged_eins/<state>/<city>.json.
+
+Missions are matched against `all_tags.yml` by `mission_tagger.Tagger`,
+in a pool of --processes worker processes.  --check also tags every
+mission the old way, one matcher at a time, and stops without writing
+anything if the two disagree anywhere:
+
+    python retag_everything.py --check
+
+The missions come from `mission_corpus`, which only re-reads the city
+files when one of them has changed.
+
+Each run saves the tags file it used as data/tagged_eins/all_tags.yml.
+After editing all_tags.yml, --incremental compares it with that copy,
+looks only for the tags whose matchers changed, and rewrites only the
+city files whose tags changed.  It assumes the form990 data is the same
+as last time; after new data comes in, retag everything.
+"""
+import argparse
 import json
 import os
+import shutil
+import sys
+import time
 import yaml
 from collections import Counter
 
+import mission_corpus
+from mission_tagger import naive_tags, tag_missions
 
-nfp_names = {}  # Map the EIN number to the business name
-missions = {}  # Map the EIN number to the mission statement(s)
-
-
-# We will also want a future lookup of state + city --> EIN
-ein_state_city = {}
-
-def get_city(path):
-    return os.path.basename(path)[:-4]
-
-
-# Go through all of the entries from all of the Form 990 tax forms.
-# We want
-#  - the EIN number (to identify the business)
-#  - their business name (because sometimes that's all there is)
-#  - their mission statement(s)
-state_paths = glob.glob(os.path.join('data', 'form990', '*'))
-for dirname in state_paths:
-    cities_990 = glob.glob(os.path.join(dirname, '*'))
-    # Set up to collect all of the EINs in a given state and city.
-    state_abbr = os.path.basename(dirname)
-    ein_state_city[state_abbr] = {}
-
-    for fname in cities_990:
-        city = get_city(fname)
-        ein_state_city[state_abbr][city] = []
-        with open(fname) as infile:
-            rdr = csv.reader(infile, delimiter='\t')
-            nfp_names_etc = [
-                (row[0], row[2], row[27], row[-1], row[-2])
-                for row in rdr
-            ]
-            nfp_names.update(dict(entry[:2] for entry in nfp_names_etc))
-            missions.update(dict(
-                    (entry[0], '  '.join(set(entry[1:])))  # remove duplicates
-                    for entry in nfp_names_etc
-            ))
-            ein_state_city[state_abbr][city].extend(
-                [row[0] for row in nfp_names_etc]
-            )
-
-# Also go through the Form 990N tax forms.
-state_paths = glob.glob(os.path.join('data', 'form990N', '*'))
-for dirname in state_paths:
-    state_abbr = os.path.basename(dirname)
-    if state_abbr not in ein_state_city:
-        ein_state_city[state_abbr] = {}
-    cities_990 = glob.glob(os.path.join(dirname, '*'))
-    for fname in cities_990:
-        city = get_city(fname)
-        if city not in ein_state_city[state_abbr]:
-            ein_state_city[state_abbr][city] = []
-        with open(fname) as infile:
-            rdr = csv.reader(infile, delimiter='\t')
-            ein_to_name = dict((row[0], row[2]) for row in rdr)
-            nfp_names.update(ein_to_name)
-            # Missions too (use the name as the mission for 990Ns)...
-            missions.update(ein_to_name)
-            ein_state_city[state_abbr][city].extend(ein_to_name.keys())
-
-
-del missions['']  # There was an empty EIN somewhere
 
+def read_missions(rebuild=False):
+    """Return (nfp_names, missions, ein_state_city) from the form990 files."""
+    corpus = mission_corpus.load(rebuild=rebuild)
+    try:
+        return corpus.nfp_names(), corpus.missions(), corpus.ein_state_city()
+    finally:
+        corpus.close()
 
-#-------------------------------------------------------------------- Tagging
-# Read in the YAML tags file
-tags_path = 'all_tags.yml'
-tags = yaml.load(open(tags_path).read())
-
-tagged_missions = {}
-unmatched = 0
-no_mission = 0
-for ein, mission in missions.items():
-    if len(ein) == 0:  # Skip the ones wihout eins
-        continue
-    tagged_missions[ein] = []
-    lower_mission = mission.lower()
-    if len(lower_mission) == 0:
-        no_mission += 1
-        continue
-    for tag, matchers in tags.items():
-        for m in matchers:
-            if m in lower_mission:
-                tagged_missions[ein].append(tag)
-                break
-    if len(tagged_missions[ein]) == 0:
-        unmatched += 1
 
+#-------------------------------------------------------------------- Tagging
+def changed_tags(old_tags, tags):
+    """The tags that were added, removed, or given different matchers."""
+    return {tag for tag in set(old_tags) | set(tags) if old_tags.get(tag) != tags.get(tag)}
+
+
+def tag_everything(missions, tags, processes=None, previous=None, changed=None):
+    """Return ({ein: [tags]}, unmatched, no_mission) for every mission.
+
+    With `previous` ({ein: [tags]} from an earlier run) and `changed` (the
+    tags whose matchers differ since then), only the changed tags are
+    looked for in missions that `previous` has; the rest keep their tags,
+    which must be in the same order as `tags`.
+    """
+    previous = previous or {}
+    changed = changed or set()
+    partial = {tag: matchers for tag, matchers in tags.items() if tag in changed}
+    tagged_missions = {}
+    unmatched = 0
+    no_mission = 0
+    to_tag, to_retag = [], []
+    for ein, mission in missions.items():
+        if len(ein) == 0:  # Skip the ones wihout eins
+            continue
+        tagged_missions[ein] = []
+        if len(mission) == 0:
+            no_mission += 1
+            continue
+        if ein in previous:
+            to_retag.append((ein, mission))
+        else:
+            to_tag.append((ein, mission))
+    for ein, found in tag_missions(to_tag, tags, processes):
+        tagged_missions[ein] = found
+    position = {tag: i for i, tag in enumerate(tags)}
+    if partial:
+        retagged = tag_missions(to_retag, partial, processes)
+    else:
+        retagged = ((ein, []) for ein, __ in to_retag)
+    for ein, found in retagged:
+        kept = [tag for tag in previous[ein] if tag not in changed]
+        if found:
+            kept = sorted(kept + found, key=position.get)
+        tagged_missions[ein] = kept
+    for ein, __ in to_tag + to_retag:
+        if len(tagged_missions[ein]) == 0:
+            unmatched += 1
+    return tagged_missions, unmatched, no_mission
+
+
+def check(missions, tags, tagged_missions):
+    """Return the EINs whose tags differ from tagging one matcher at a time."""
+    return [ein for ein, found in tagged_missions.items()
+            if found != (naive_tags(tags, missions[ein]) if missions[ein] else [])]
 
 
 #-------------------------------------------------------------------- Output
-msg = '{} out of {} missions remain unmatched'
-print(msg.format(unmatched, len(tagged_missions)))
-print('{} missions have no statement at all'.format(no_mission))
+TAGGED_DIR = os.path.join('data', 'tagged_eins')
+# The tags file the output was made with; create_and_populate_database.py reads it too.
+SNAPSHOT = os.path.join(TAGGED_DIR, 'all_tags.yml')
 
 
 # Make all directories if they don't exist
@@ -108,37 +106,142 @@ def setup_path(directory):
         os.makedirs(directory)
 
 
+def by_city(tagged_missions, ein_state_city):
+    """Return {(state, city): {ein: tags}}, in one pass over `tagged_missions`."""
+    cities = {}
+    where = {}  # EIN --> the (state, city) keys it's listed under
+    for state, city_lookups in ein_state_city.items():
+        for city, selected_eins in city_lookups.items():
+            cities[state, city] = {}
+            for ein in selected_eins:
+                where.setdefault(ein, set()).add((state, city))
+    for ein, tags in tagged_missions.items():
+        for key in where.get(ein, ()):
+            cities[key][ein] = tags
+    return cities
+
+
+def city_path(state, city):
+    return os.path.join(TAGGED_DIR, state, city + '.json')
+
+
+def read_tagged(ein_state_city):
+    """Return ({(state, city): {ein: tags}}, {ein: tags}) from the existing output."""
+    cities, tagged_missions = {}, {}
+    for state, city_lookups in ein_state_city.items():
+        for city in city_lookups:
+            try:
+                with open(city_path(state, city)) as infile:
+                    cities[state, city] = json.load(infile)
+            except (FileNotFoundError, ValueError):
+                continue
+            tagged_missions.update(cities[state, city])
+    return cities, tagged_missions
+
+
 # Write JSON objects containing the EINS and tags to file.
 # Directory structure:
 #   . tagged_eins
 #   |-- <state-abbr>
 #     |-- <city>.json
-directory = os.path.join('data', 'tagged_eins')
-setup_path(directory)
-for state, city_lookups in ein_state_city.items():
-    subdir = os.path.join(directory, state)
-    setup_path(subdir)
-    for city, selected_eins in city_lookups.items():
-        eins_destination = os.path.join(subdir, city + '.json')
-        tagged_subset = dict(
-            (k, v) for k, v in tagged_missions.items()
-            if k in selected_eins
-        )
-        with open(eins_destination, 'w') as outfile:
+def write_tagged(cities, previous=None):
+    """Write each city's file, skipping those that would be the same as in
+    `previous`.  Return how many were written."""
+    previous = previous or {}
+    setup_path(TAGGED_DIR)
+    written = 0
+    for (state, city), tagged_subset in cities.items():
+        if previous.get((state, city)) == tagged_subset:
+            continue
+        setup_path(os.path.join(TAGGED_DIR, state))
+        with open(city_path(state, city), 'w') as outfile:
             outfile.write(json.dumps(tagged_subset))
+        written += 1
+    return written
+
+
+def read_tags(path):
+    with open(path) as infile:
+        return yaml.safe_load(infile)
 
 
 #---------------------------------------------- Quick performance assessment
-tag_counts = Counter(
-        [tag for tag_list in tagged_missions.values()
-         for tag in tag_list]
-    )
-
-total_missions = len(tagged_missions)
-print('Total nonprofits classified: ', total_missions)
-for entry in tag_counts.most_common():
-    tag, count = entry
-    print('{:<14}'.format(tag), end='  ')
-    print('{:2.0f}% ({})'.format(100 * count / total_missions, count))
-
-print('Done.\n')
+def report(tagged_missions):
+    tag_counts = Counter(
+            [tag for tag_list in tagged_missions.values()
+             for tag in tag_list]
+        )
+
+    total_missions = len(tagged_missions)
+    print('Total nonprofits classified: ', total_missions)
+    for entry in tag_counts.most_common():
+        tag, count = entry
+        print('{:<14}'.format(tag), end='  ')
+        print('{:2.0f}% ({})'.format(100 * count / total_missions, count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--tags', default='all_tags.yml',
+                        help='the tags file (default all_tags.yml)')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='tagging processes (default: one per CPU)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only look again for the tags that changed since '
+                             'the last run, and only rewrite the cities that changed')
+    parser.add_argument('--check', action='store_true',
+                        help='also tag one matcher at a time, and stop if the results differ')
+    parser.add_argument('--rebuild-corpus', action='store_true',
+                        help='re-read every city file even if none has changed')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    nfp_names, missions, ein_state_city = read_missions(args.rebuild_corpus)
+    print('Read {} missions in {:.1f}s'.format(len(missions), time.perf_counter() - start))
+    # Read in the YAML tags file
+    tags = read_tags(args.tags)
+
+    previous_cities, previous, changed = {}, None, None
+    if args.incremental:
+        old_tags = read_tags(SNAPSHOT) if os.path.exists(SNAPSHOT) else None
+        previous_cities, previous = read_tagged(ein_state_city)
+        if old_tags is None or not previous:
+            print('No earlier output to update; retagging everything')
+            previous = None
+        elif [t for t in old_tags if t in tags] != [t for t in tags if t in old_tags]:
+            print('The tags were reordered; retagging everything')
+            previous = None
+        else:
+            changed = changed_tags(old_tags, tags)
+            print('Changed tags: {}'.format(', '.join(sorted(changed)) or 'none'))
+
+    start = time.perf_counter()
+    tagged_missions, unmatched, no_mission = tag_everything(
+        missions, tags, args.processes, previous, changed)
+    print('Tagged {} missions in {:.1f}s'.format(
+        len(tagged_missions), time.perf_counter() - start))
+    msg = '{} out of {} missions remain unmatched'
+    print(msg.format(unmatched, len(tagged_missions)))
+    print('{} missions have no statement at all'.format(no_mission))
+
+    if args.check:
+        different = check(missions, tags, tagged_missions)
+        if different:
+            for ein in different[:20]:
+                print('{}: {} != {}'.format(
+                    ein, tagged_missions[ein], naive_tags(tags, missions[ein])))
+            sys.exit('{} missions were tagged differently; nothing written'.format(
+                len(different)))
+        print('Checked: every mission has the same tags as before')
+
+    cities = by_city(tagged_missions, ein_state_city)
+    written = write_tagged(cities, previous_cities)
+    print('Wrote {} of {} city files'.format(written, len(cities)))
+    if os.path.abspath(args.tags) != os.path.abspath(SNAPSHOT):
+        shutil.copyfile(args.tags, SNAPSHOT)
+    report(tagged_missions)
+    print('Done.\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""Run the acquisition steps from the README, skipping what's up to date.
+
+    python run_pipeline.py                  # everything, up to nonprofits.db
+    python run_pipeline.py retag            # just what retagging needs
+    python run_pipeline.py --dry-run        # say what would run, and why
+    python run_pipeline.py --force pub78    # download pub78 again
+
+Each stage is one of the top-level scripts, run as its own process, with
+the files it reads (`inputs`) and writes (`outputs`) declared below as
+glob patterns.  A stage runs when it has never finished, when any of its
+outputs are missing, or when its fingerprint -- the command, plus the
+size and modification time of the script and of every input file --
+differs from the one it finished with last time (kept in
+data/pipeline_state.json).  Stages that download from the IRS or the
+Census have no input files, so once they've finished they only run again
+with --force; their new outputs then make everything downstream stale.
+
+Stages run as soon as the stages they come `after` have finished, up to
+--jobs at a time: the 990-N branch (download, geocode) and the 990 branch
+(pub78, crawl, geocode) run side by side, the geocoding stages also wait
+for the Census places (the gazetteer fallback reads them), and retagging
+starts once both tax datasets are in.  If a stage fails, the stages after it are blocked
+but the other branches carry on.  Each stage's output goes to
+data/logs/<stage>.log.
+
+Every run ends with a report of each stage's status and time, which is
+also appended to data/pipeline_timings.tsv.  --states is passed to the
+stages that take it; anything else goes to one stage with --stage-args,
+e.g. --stage-args 'geocode990N=--gazetteer'.
+"""
+import argparse
+import collections
+import glob
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+STATE_FILE = os.path.join('data', 'pipeline_state.json')
+TIMINGS_FILE = os.path.join('data', 'pipeline_timings.tsv')
+LOG_DIR = os.path.join('data', 'logs')
+
+Stage = collections.namedtuple('Stage', ['name', 'command', 'inputs', 'outputs', 'after'])
+
+
+def pipeline(states=None, stage_args=None):
+    """The stages, in the README's order.  `states` goes to the stages that
+    take --states; `stage_args` is {stage name: [extra arguments]}."""
+    by_state = ['--states'] + list(states) if states else []
+    places = os.path.join('data', 'census_places_lon_lat', '*.txt')
+    stages = [
+        Stage('census_places', ['get_census_places_lon_lats.py'], [], [places], []),
+        Stage('pub78', ['get_pub78_data.py'] + by_state,
+              [], [os.path.join('data', 'pub78', '*', '*.txt')], []),
+        Stage('form990N', ['get_form990N_data.py'] + by_state,
+              [], [os.path.join('data', 'form990N', '*', '*.txt')], []),
+        Stage('form990', ['get_aws_990_data.py'],
+              [os.path.join('data', 'pub78', '*', '*.txt'), os.path.join('data', 'index_*.json')],
+              [os.path.join('data', 'form990', '*', '*.txt')], ['pub78']),
+        Stage('geocode990N',
+              ['geocode_cities.py', '--sources', os.path.join('data', 'form990N')] + by_state,
+              [os.path.join('data', 'form990N', '*', '*.txt'), places],
+              [os.path.join('data', 'geo990N', '*', '*.txt')], ['census_places', 'form990N']),
+        Stage('geocode990',
+              ['geocode_cities.py', '--sources', os.path.join('data', 'form990')] + by_state,
+              [os.path.join('data', 'form990', '*', '*.txt'), places],
+              [os.path.join('data', 'geo990', '*', '*.txt')], ['census_places', 'form990']),
+        Stage('retag', ['retag_everything.py'],
+              ['all_tags.yml', os.path.join('data', 'form990*', '*', '*')],
+              [os.path.join('data', 'tagged_eins', '*', '*.json')], ['form990N', 'form990']),
+        Stage('database', ['create_and_populate_database.py'],
+              ['create_nonprofitdb_statements.sql', 'create_nonprofitdb_indexes.sql',
+               os.path.join('data', 'form990*', '*', '*'),
+               os.path.join('data', 'geo990*', '*', '*'),
+               os.path.join('data', 'tagged_eins', 'all_tags.yml'),
+               os.path.join('data', 'tagged_eins', '*', '*.json')],
+              ['nonprofits.db'], ['geocode990N', 'geocode990', 'retag']),
+    ]
+    stage_args = stage_args or {}
+    unknown = set(stage_args) - {stage.name for stage in stages}
+    if unknown:
+        raise ValueError('no such stage: {}'.format(', '.join(sorted(unknown))))
+    return [stage._replace(command=stage.command + stage_args.get(stage.name, []))
+            for stage in stages]
+
+
+DEFAULT_TARGETS = ['database']
+
+
+def plan(stages, targets):
+    """The stages `targets` need, themselves included, in dependency order."""
+    by_name = {stage.name: stage for stage in stages}
+    order, visited, visiting = [], set(), set()
+
+    def visit(name, path):
+        if name not in by_name:
+            raise ValueError('no such stage: {}'.format(name))
+        if name in visiting:
+            raise ValueError('stages depend on each other: {}'.format(' -> '.join(path + [name])))
+        if name in visited:
+            return
+        visiting.add(name)
+        for before in by_name[name].after:
+            visit(before, path + [name])
+        visiting.discard(name)
+        visited.add(name)
+        order.append(by_name[name])
+
+    for name in targets:
+        visit(name, [])
+    return order
+
+
+# ------------------------------------------------------------- staleness
+def input_files(stage):
+    """[(path, size, mtime_ns)] for the stage's script and every input file."""
+    files = set()
+    for pattern in [stage.command[0]] + stage.inputs:
+        for path in glob.glob(pattern):
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                files.add((path, stat.st_size, stat.st_mtime_ns))
+    return sorted(files)
+
+
+def fingerprint(stage):
+    text = json.dumps([stage.command, input_files(stage)])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def outputs_exist(stage):
+    return all(glob.glob(pattern) for pattern in stage.outputs)
+
+
+def why_stale(stage, state, forced):
+    """Why the stage has to run, or None if it's up to date."""
+    if forced:
+        return 'forced'
+    if stage.name not in state:
+        return 'never run'
+    if not outputs_exist(stage):
+        return 'outputs missing'
+    if state[stage.name]['fingerprint'] != fingerprint(stage):
+        return 'inputs changed'
+    return None
+
+
+def read_state(path=STATE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as infile:
+        return json.load(infile)
+
+
+def write_state(state, path=STATE_FILE):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as outfile:
+        json.dump(state, outfile, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+# -------------------------------------------------------------- running
+Result = collections.namedtuple('Result', ['stage', 'status', 'reason', 'started', 'seconds'])
+
+
+def run_stage(stage, log_dir=LOG_DIR):
+    """Run one stage's script; return its exit code."""
+    os.makedirs(log_dir, exist_ok=True)
+    with open(os.path.join(log_dir, stage.name + '.log'), 'w') as log:
+        return subprocess.call([sys.executable] + stage.command,
+                               stdout=log, stderr=subprocess.STDOUT)
+
+
+def run(stages, targets=DEFAULT_TARGETS, jobs=4, force=(), dry_run=False,
+        state_path=STATE_FILE, log_dir=LOG_DIR):
+    """Run what `targets` need; return a Result for each stage, in plan order.
+
+    Statuses are 'ran', 'failed', 'up to date', 'blocked' (something it
+    comes after failed) and, with `dry_run`, 'would run'.
+    """
+    if jobs < 1:
+        raise ValueError('jobs must be at least 1, not {}'.format(jobs))
+    order = plan(stages, targets)
+    force = set(force)
+    if 'all' in force:
+        force = {stage.name for stage in order}
+    state = read_state(state_path)
+    start = time.perf_counter()
+    results = {}
+    pending = list(order)
+    running = {}  # future --> (stage, reason, started)
+
+    def finish(stage, status, reason='', started=None, seconds=0.0):
+        results[stage.name] = Result(stage.name, status, reason,
+                                     started if started is not None else time.perf_counter() - start,
+                                     seconds)
+
+    with ThreadPoolExecutor(jobs) as executor:
+        while pending or running:
+            # Start (or settle) every stage whose predecessors are done.
+            progress = True
+            while progress:
+                progress = False
+                for stage in list(pending):
+                    if any(before not in results for before in stage.after):
+                        continue
+                    befores = [results[before].status for before in stage.after]
+                    if any(status in ('failed', 'blocked') for status in befores):
+                        finish(stage, 'blocked')
+                    elif dry_run:
+                        reason = why_stale(stage, state, stage.name in force)
+                        if reason is None and 'would run' in befores:
+                            reason = 'runs after ' + ', '.join(
+                                b for b in stage.after if results[b].status == 'would run')
+                        finish(stage, 'would run' if reason else 'up to date', reason or '')
+                    else:
+                        reason = why_stale(stage, state, stage.name in force)
+                        if reason is None:
+                            finish(stage, 'up to date')
+                        elif len(running) < jobs:
+                            print('starting {} ({})'.format(stage.name, reason), flush=True)
+                            started = time.perf_counter() - start
+                            running[executor.submit(run_stage, stage, log_dir)] = stage, reason, started
+                        else:
+                            continue
+                    pending.remove(stage)
+                    progress = True
+            if not running:
+                continue
+            done, __ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, reason, started = running.pop(future)
+                seconds = time.perf_counter() - start - started
+                try:
+                    code = future.result()
+                except OSError as e:
+                    code, reason = None, str(e)
+                if code == 0:
+                    finish(stage, 'ran', reason, started, seconds)
+                    state[stage.name] = {'fingerprint': fingerprint(stage),
+                                         'seconds': round(seconds, 1),
+                                         'finished': time.strftime('%Y-%m-%d %H:%M:%S')}
+                    write_state(state, state_path)
+                    print('finished {} in {:.1f}s'.format(stage.name, seconds), flush=True)
+                else:
+                    if code is not None:
+                        reason = 'exit code {}; see {}'.format(
+                            code, os.path.join(log_dir, stage.name + '.log'))
+                    finish(stage, 'failed', reason, started, seconds)
+                    print('FAILED {} after {:.1f}s ({})'.format(stage.name, seconds, reason),
+                          flush=True)
+    return [results[stage.name] for stage in order]
+
+
+def report(results, wall_seconds):
+    lines = ['{:<14} {:<11} {:>9} {:>9}  {}'.format(
+        'stage', 'status', 'start', 'seconds', 'why')]
+    for r in results:
+        timing = ('{:9.1f} {:9.1f}'.format(r.started, r.seconds) if r.status in ('ran', 'failed')
+                  else '{:>9} {:>9}'.format('-', '-'))
+        lines.append('{:<14} {:<11} {}  {}'.format(r.stage, r.status, timing, r.reason))
+    busy = sum(r.seconds for r in results)
+    lines.append('{:.1f}s of stages in {:.1f}s'.format(busy, wall_seconds))
+    return '\n'.join(lines)
+
+
+def append_timings(results, path=TIMINGS_FILE):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    new = not os.path.exists(path)
+    run_at = time.strftime('%Y-%m-%d %H:%M:%S')
+    with open(path, 'a') as outfile:
+        if new:
+            outfile.write('run\tstage\tstatus\tstart\tseconds\n')
+        for r in results:
+            outfile.write('{}\t{}\t{}\t{:.1f}\t{:.1f}\n'.format(
+                run_at, r.stage, r.status, r.started, r.seconds))
+
+
+def parse_stage_args(values):
+    """['geocode990N=--gazetteer --offline'] --> {'geocode990N': ['--gazetteer', '--offline']}"""
+    stage_args = {}
+    for value in values or []:
+        name, sep, args = value.partition('=')
+        if not sep:
+            raise ValueError('--stage-args wants STAGE=ARGS, not {!r}'.format(value))
+        stage_args.setdefault(name, []).extend(shlex.split(args))
+    return stage_args
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('targets', nargs='*', default=DEFAULT_TARGETS, metavar='STAGE',
+                        help='stages to bring up to date, with everything they need '
+                             '(default: {})'.format(' '.join(DEFAULT_TARGETS)))
+    parser.add_argument('--jobs', type=int, default=4,
+                        help='stages to run at once (default 4)')
+    parser.add_argument('--force', nargs='+', metavar='STAGE', default=[],
+                        help='run these stages even if they look up to date ("all" for every one)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only say which stages would run')
+    parser.add_argument('--states', nargs='+', metavar='ST', default=None,
+                        help='passed to the pub78, 990-N and geocoding stages')
+    parser.add_argument('--stage-args', action='append', metavar='STAGE=ARGS',
+                        help="more arguments for one stage's script (repeatable)")
+    parser.add_argument('--list', action='store_true',
+                        help='list the stages and what they read and write')
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+
+    try:
+        stages = pipeline(args.states, parse_stage_args(args.stage_args))
+        plan(stages, args.targets + [f for f in args.force if f != 'all'])
+    except ValueError as e:
+        parser.error(str(e))
+    if args.list:
+        for stage in stages:
+            print('{}: {}'.format(stage.name, ' '.join(stage.command)))
+            print('    after:   {}'.format(', '.join(stage.after) or '-'))
+            print('    inputs:  {}'.format(', '.join(stage.inputs) or '- (downloads)'))
+            print('    outputs: {}'.format(', '.join(stage.outputs)))
+        return
+
+    start = time.perf_counter()
+    results = run(stages, args.targets, args.jobs, args.force, args.dry_run)
+    print(report(results, time.perf_counter() - start))
+    if not args.dry_run:
+        append_timings(results)
+    if any(r.status in ('failed', 'blocked') for r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Stream the text file inside a zipped download without holding it in memory.
+
+The IRS and Census bulk files are zip archives holding a single large text
+file.  Rather than buffering the whole archive and then the whole decoded
+text, `open_zipped_text` inflates the first member straight off the socket
+and hands back a text stream, so rows can be parsed while the rest of the
+archive is still downloading:
+
+    with open_zipped_text(data_url) as infile:
+        for row in csv.reader(infile, delimiter='|'):
+            ...
+
+Archives whose first member can't be inflated as it arrives (not deflated,
+or encrypted) are spooled to a temporary file on disk instead, and the
+member is then read from there through `zipfile`.  Either way memory use
+stays flat regardless of the archive size.
+"""
+import contextlib
+import io
+import shutil
+import struct
+import tempfile
+import urllib.request
+import zipfile
+import zlib
+
+
+CHUNK_SIZE = 1 << 16
+
+# Local file header, from section 4.3.7 of the zip spec:
+#   https://pkware.cachefly.net/webdocs/casestudies/APPNOTE.TXT
+_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+_DEFLATED = 8
+_ENCRYPTED_FLAG = 0x1
+
+
+class _InflatingReader(io.RawIOBase):
+    """Raw stream of the inflated bytes of one deflated zip member,
+    decompressed chunk by chunk as it is read from `response`."""
+
+    def __init__(self, response, chunk_size=CHUNK_SIZE):
+        self._response = response
+        self._chunk_size = chunk_size
+        self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._decompressor.eof:
+            data = (
+                self._decompressor.unconsumed_tail or
+                self._response.read(self._chunk_size)
+            )
+            if not data:
+                raise zipfile.BadZipFile('Download ended partway through the zip member')
+            inflated = self._decompressor.decompress(data, len(buffer))
+            if inflated:
+                buffer[:len(inflated)] = inflated
+                return len(inflated)
+        return 0
+
+
+def _read_exactly(response, size):
+    data = b''
+    while len(data) < size:
+        chunk = response.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _open_streaming_member(response, spool, chunk_size=CHUNK_SIZE):
+    """Return a raw stream that inflates the first zip member as it arrives,
+    or None if it can't be streamed.
+
+    Everything read from `response` while deciding is written to `spool` so
+    that the caller can fall back to `zipfile` on the complete download.
+    """
+    head = _read_exactly(response, _LOCAL_HEADER.size)
+    spool.write(head)
+    if len(head) < _LOCAL_HEADER.size:
+        return None
+    (signature, __, flags, method, __, __, __, __, __,
+     name_length, extra_length) = _LOCAL_HEADER.unpack(head)
+    if (signature != _LOCAL_HEADER_SIGNATURE or
+            method != _DEFLATED or flags & _ENCRYPTED_FLAG):
+        return None
+
+    # Skip over the member's file name and extra field.
+    skipped = _read_exactly(response, name_length + extra_length)
+    spool.write(skipped)
+    if len(skipped) < name_length + extra_length:
+        return None
+    return _InflatingReader(response, chunk_size)
+
+
+@contextlib.contextmanager
+def open_zipped_text(url, encoding='utf-8', chunk_size=CHUNK_SIZE):
+    """Yield a text stream over the first file inside the zip archive at `url`.
+
+    The stream is opened with newline='' so it can be passed directly to
+    `csv.reader`.
+    """
+    with contextlib.ExitStack() as stack:
+        response = stack.enter_context(urllib.request.urlopen(url))
+        spool = stack.enter_context(tempfile.TemporaryFile())
+        raw = _open_streaming_member(response, spool, chunk_size)
+        if raw is None:
+            # Not streamable: finish spooling the archive to disk and read
+            # the member from there.
+            shutil.copyfileobj(response, spool, chunk_size)
+            spool.seek(0)
+            archive = stack.enter_context(zipfile.ZipFile(spool))
+            raw = archive.open(archive.namelist()[0])
+        else:
+            raw = io.BufferedReader(raw, chunk_size)
+        text = stack.enter_context(
+            io.TextIOWrapper(raw, encoding=encoding, newline='')
+        )
+        yield text
@@ -0,0 +1,164 @@
+import http.server
+import threading
+
+import pytest
+
+import census_geocoder_mapper
+from census_geocoder_mapper import (
+    CITY_CENTROID, COLUMN_NAMES, EXACT, NO_LOCATION, BatchGeocoder, geocode_rows)
+from gazetteer import Gazetteer
+from geocode_cache import GeocodeCache, normalize_address
+
+
+def form990N_row(ein, street, city, state, zipcode, province=''):
+    """A tab-separated 990-N row (see get_form990N_data.py's header)."""
+    row = [''] * 26
+    row[0] = ein
+    row[2] = 'Some Nonprofit'
+    row[9], row[11], row[13], row[14] = '1 Officer Way', city, state, zipcode
+    row[16], row[18], row[19], row[20], row[21] = street, city, province, state, zipcode
+    row[22] = 'US'
+    return '\t'.join(row)
+
+
+def places(tmp_path):
+    directory = tmp_path / 'places'
+    directory.mkdir()
+    (directory / 'IL.txt').write_text('city\tlon\tlat\nChicago\t-87.68\t41.84\n')
+    return Gazetteer(str(directory))
+
+
+def test_ein_address_reads_the_organization_state_and_zip():
+    row = form990N_row('363157630', '8606 S Blackstone Ave', 'Chicago', 'IL', '60619')
+    ein, addr, city, state, zipcode = census_geocoder_mapper.ein_address(row)
+    assert (ein, addr.strip(), city, state, zipcode) == (
+        '363157630', '8606 S Blackstone Ave', 'Chicago', 'IL', '60619')
+
+
+def test_offline_row_gets_its_city_centroid(tmp_path):
+    written = []
+    row = form990N_row('363157630', '8606 S Blackstone Ave', 'Chicago', 'IL', '60619')
+    stats = geocode_rows([('key', row)], lambda key, out: written.append((key, out)),
+                         gazetteer=places(tmp_path), offline=True)
+    [(key, out)] = written
+    assert key == 'key'
+    assert len(out) == len(COLUMN_NAMES)
+    assert out[0] == '363157630'
+    assert out[COLUMN_NAMES.index('lon_lat')] == '-87.68,41.84'
+    assert out[-1] == CITY_CENTROID
+    assert stats.precision[CITY_CENTROID] == 1
+
+
+class FakeService:
+    """A local stand-in for the batch geocoder that answers every request
+    with `status`, matching only the addresses on `street`."""
+    def __init__(self, status, street=None):
+        self.requests = 0
+        service = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+                service.requests += 1
+                answer = ''
+                if status == 200 and street:
+                    for line in body.splitlines():
+                        if street in line:
+                            ident = line.split(',', 1)[0].strip('"')
+                            answer += ('"{}","{}","Match","Exact","{}","-87.6,41.7",'
+                                       '"1","R","17","031","1","1"\n').format(ident, street, street)
+                self.send_response(status)
+                self.end_headers()
+                self.wfile.write(answer.encode('utf-8'))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def geocode_with(service, rows, gazetteer=None, cache=None):
+    geocoder = BatchGeocoder(url=service.url, rate=1000, retries=2, backoff=0, timeout=10)
+    written = {}
+    stats = geocode_rows(rows, lambda key, out: written.setdefault(key, out),
+                         geocoder=geocoder, gazetteer=gazetteer, cache=cache)
+    return written, stats
+
+
+ROWS = [
+    ('a', form990N_row('360000001', '8606 S Blackstone Ave', 'Chicago', 'IL', '60619')),
+    ('b', form990N_row('360000002', '100 N State St', 'Chicago', 'IL', '60602')),
+    ('c', form990N_row('360000003', '100 N State St', 'Chicago', 'IL', '60602')),
+]
+
+
+@pytest.mark.parametrize('status, tries', [(503, 3), (400, 1)])
+def test_failed_batches_are_written_as_no_match(status, tries):
+    service = FakeService(status)
+    try:
+        written, stats = geocode_with(service, ROWS)
+    finally:
+        service.close()
+    assert service.requests == tries  # 5xx is retried, 4xx is not
+    assert sorted(written) == ['a', 'b', 'c']
+    for key, out in written.items():
+        assert out[COLUMN_NAMES.index('match_or_not')] == 'No_Match'
+        assert out[-1] == NO_LOCATION
+    assert stats.failed == 3
+    assert stats.precision[NO_LOCATION] == 3
+
+
+def test_rows_left_out_of_an_answer_fall_back_to_the_gazetteer(tmp_path):
+    service = FakeService(200, street='8606 S Blackstone Ave')
+    try:
+        written, stats = geocode_with(service, ROWS, gazetteer=places(tmp_path))
+    finally:
+        service.close()
+    assert written['a'][-1] == EXACT
+    assert [written[k][-1] for k in 'bc'] == [CITY_CENTROID, CITY_CENTROID]
+    assert stats.failed == 2
+
+
+def test_orig_address_is_always_the_rows_own(tmp_path):
+    cache = GeocodeCache(str(tmp_path / 'cache.db'))
+    cache.put_many([(normalize_address('1 Cached Rd', 'Chicago', 'IL', '60601'),
+                     ['1 CACHED RD, CHICAGO, IL, 60601', 'No_Match'])])
+    rows = ROWS + [
+        ('d', form990N_row('360000004', '100 N. State St.', 'Chicago', 'IL', '60602')),
+        ('e', form990N_row('360000005', '1 Cached Rd', 'Chicago', 'IL', '60601')),
+    ]
+    service = FakeService(200, street='8606 S Blackstone Ave')
+    try:
+        written, stats = geocode_with(service, rows, cache=cache)
+    finally:
+        service.close()
+        cache.close()
+    assert stats.cached == 1 and stats.duplicates == 2 and stats.failed == 3
+    orig = COLUMN_NAMES.index('orig_address')
+    assert {key: out[orig] for key, out in written.items()} == {
+        'a': '8606 S Blackstone Ave, Chicago, IL, 60619',  # matched
+        'b': '100 N State St, Chicago, IL, 60602',          # left out of the answer
+        'c': '100 N State St, Chicago, IL, 60602',
+        'd': '100 N. State St., Chicago, IL, 60602',        # a duplicate address
+        'e': '1 Cached Rd, Chicago, IL, 60601',             # from the cache
+    }
+
+
+def test_po_boxes_are_never_sent():
+    row = form990N_row('360000006', 'PO Box 439465', 'Chicago', 'IL', '60643')
+    row = row.replace('1 Officer Way', 'PO Box 12')
+    service = FakeService(200, street='PO Box')
+    try:
+        written, stats = geocode_with(service, [('a', row)])
+    finally:
+        service.close()
+    assert service.requests == 0
+    assert written['a'][COLUMN_NAMES.index('match_or_not')] == 'No_Match'
+    assert written['a'][-1] == NO_LOCATION
+    assert stats.local == 1
@@ -0,0 +1,74 @@
+"""The trigram index must correct city names the way the old difflib scan
+over every place did, except where two places are equally close."""
+import difflib
+import random
+
+import pytest
+
+from benchmark_city_matcher import SYLLABLES, misspell, scan_correct, synthetic_places
+from city_matcher import CityMatcher, CitySpeller, expand_direction
+
+
+@pytest.mark.parametrize('seed', range(2))
+def test_index_agrees_with_the_scan(seed):
+    rng = random.Random(seed)
+    places = synthetic_places(150, rng)
+    cities = {}
+    for place in places:
+        cities.setdefault(place.lower(), place)
+    queries = [misspell(rng.choice(places), rng) for __ in range(150)]
+    queries += [misspell(''.join(rng.choice(SYLLABLES) for __ in range(3)), rng)
+                for __ in range(50)]
+    queries += places[::10] + [place.upper() for place in places[::15]]
+
+    matcher = CityMatcher(places)
+    disagree = 0
+    for query in queries:
+        indexed, scanned = matcher.correct(query), scan_correct(query, cities)
+        if indexed != scanned:
+            # Only a tie for closest place may come out differently.
+            disagree += 1
+            name = expand_direction(query.lower())
+            best = max(difflib.SequenceMatcher(None, c, name).ratio() for c in cities)
+            assert matcher.match(name)[1] == best, (query, indexed, scanned)
+    assert disagree <= len(queries) // 50
+
+
+def test_correct():
+    matcher = CityMatcher(['Chicago', 'Cicero', 'North Chicago', 'New York', 'CHICAGO'])
+    assert matcher.correct('chicgo') == 'Chicago'
+    assert matcher.correct('CHICAGO') == 'Chicago'  # first spelling wins
+    assert matcher.correct('N. Chicago') == 'North Chicago'
+    assert matcher.correct('n chicgo') == 'North Chicago'
+    assert matcher.correct('Springfield') == 'Springfield'  # nothing close
+    assert matcher.correct('Xhicago') == 'Xhicago'  # first letter differs
+    assert matcher.correct('') == ''
+    assert matcher.correct_many(['chicgo', 'chicgo', 'Cicro']) == {
+        'chicgo': 'Chicago', 'Cicro': 'Cicero'}
+
+
+@pytest.mark.parametrize('name, expanded', [
+    ('n. chicago', 'north chicago'),
+    ('n chicago', 'north chicago'),
+    ('s. bend', 'south bend'),
+    ('w linn', 'west linn'),
+    ('e. st louis', 'east st louis'),
+    ('north chicago', 'north chicago'),
+    ('n.', 'n.'),
+    ('newark', 'newark'),
+    ('ne portland', 'ne portland'),
+])
+def test_expand_direction(name, expanded):
+    assert expand_direction(name) == expanded
+
+
+def test_speller_reads_each_state_once(tmp_path):
+    (tmp_path / 'IL.txt').write_text(
+        'city\tlon\tlat\nChicago\t-87.6\t41.8\nEvanston\t-87.7\t42.0\n')
+    speller = CitySpeller(str(tmp_path))
+    assert speller.correct('Chicgo', 'il ') == 'Chicago'
+    assert speller.correct_all([('IL', 'Evanstn'), ('WA', 'Seatle'), ('IL', 'Chicgo')]) == [
+        'Evanston', 'Seatle', 'Chicago']
+    assert sorted(speller.matchers) == ['IL', 'WA']
+    assert speller.matchers['WA'] is None  # no places file: kept as given
+    assert speller.corrected[('IL', 'Chicgo')] == 'Chicago'
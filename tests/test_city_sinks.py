@@ -0,0 +1,130 @@
+"""Run get_aws_990_data.py end to end into each --format.
+
+The returns come from a local HTTP server; the crawl starts cities on
+the fetcher's thread and writes rows on the main one, as it does for real.
+"""
+import csv
+import functools
+import http.server
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+import pytest
+
+import get_aws_990_data
+
+
+RETURN = """<?xml version="1.0" encoding="utf-8"?>
+<Return xmlns="http://www.irs.gov/efile">
+  <ReturnHeader>
+    <TaxPeriodBeginDt>2016-01-01</TaxPeriodBeginDt>
+    <TaxPeriodEndDt>2016-12-31</TaxPeriodEndDt>
+    <TaxYr>2016</TaxYr>
+    <Filer>
+      <EIN>{ein}</EIN>
+      <BusinessName><BusinessNameLine1Txt>{name}</BusinessNameLine1Txt></BusinessName>
+    </Filer>
+  </ReturnHeader>
+  <ReturnData>
+    <IRS990>
+      <GrossReceiptsAmt>{receipts}</GrossReceiptsAmt>
+      <MissionDesc>{mission}</MissionDesc>
+    </IRS990>
+  </ReturnData>
+</Return>
+"""
+
+ORGANIZATIONS = [
+    # ein, object id, name, gross receipts, mission
+    ('360000001', '201600000001', 'Chicago Food Bank', '12000', 'Feeding the hungry'),
+    ('360000002', '201600000002', 'Lakeshore Arts', '900000', 'Art for everyone'),
+]
+
+
+@pytest.fixture
+def crawl(tmp_path, monkeypatch):
+    """Set up pub78 lists, an index file and a server for the returns;
+    return a function that crawls with the given extra arguments."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join('data', 'pub78', 'IL'))
+    with open(os.path.join('data', 'pub78', 'IL', 'Chicago.txt'), 'w') as outfile:
+        outfile.write('EIN\tLegal Name\tDeductibility Status Description\n')
+        for ein, __, name, __, __ in ORGANIZATIONS:
+            outfile.write('{}\t{}\tPC\n'.format(ein, name))
+    with open(os.path.join('data', 'pub78', 'IL', 'Evanston.txt'), 'w') as outfile:
+        outfile.write('EIN\tLegal Name\tDeductibility Status Description\n')
+        outfile.write('360000003\tNo Filings Yet\tPC\n')
+    with open(os.path.join('data', 'index_2016.json'), 'w') as outfile:
+        json.dump({'Filings2016': [
+            {'EIN': ein, 'TaxPeriod': '201612', 'ObjectId': object_id, 'FormType': '990'}
+            for ein, object_id, __, __, __ in ORGANIZATIONS]}, outfile)
+
+    returns = tmp_path / 'returns'
+    returns.mkdir()
+    for ein, object_id, name, receipts, mission in ORGANIZATIONS:
+        (returns / '{}_public.xml'.format(object_id)).write_text(RETURN.format(
+            ein=ein, name=name, receipts=receipts, mission=mission))
+
+    class Quiet(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', 0), functools.partial(Quiet, directory=str(returns)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def run(*args):
+        monkeypatch.setattr(sys, 'argv', [
+            'get_aws_990_data.py', '--base-url', 'http://127.0.0.1:{}'.format(server.server_port),
+            '--no-cache', '--workers', '2', '--parse-workers', '1', '--report-every', '0'
+        ] + list(args))
+        get_aws_990_data.main()
+
+    yield run
+    server.shutdown()
+    server.server_close()
+
+
+def expected_rows():
+    return {ein: (name, str(int(receipts) < 25000), mission)
+            for ein, __, name, receipts, mission in ORGANIZATIONS}
+
+
+def test_tsv(crawl):
+    crawl()
+    with open(os.path.join('data', 'form990', 'IL', 'Chicago.txt')) as infile:
+        rows = list(csv.DictReader(infile, delimiter='\t'))
+    assert {row['EIN']: (row['BusinessName'], row['Gross Receipts are under $25k'],
+                         row['MissionDesc']) for row in rows} == expected_rows()
+    assert {row['TaxYr'] for row in rows} == {'2016'}
+    with open(os.path.join('data', 'form990', 'IL', 'Evanston.txt')) as infile:
+        assert list(csv.reader(infile, delimiter='\t')) == [get_aws_990_data.header]
+
+
+def test_sqlite(crawl):
+    crawl('--format', 'sqlite')
+    conn = sqlite3.connect(os.path.join('data', 'acquired.db'))
+    rows = conn.execute(
+        'SELECT file_state, file_city, "EIN", "BusinessName", '
+        '"Gross Receipts are under $25k", "MissionDesc", "TaxYr" FROM form990').fetchall()
+    conn.close()
+    assert {row[2]: row[3:6] for row in rows} == expected_rows()
+    assert {row[:2] for row in rows} == {('IL', 'Chicago')}
+    assert {row[6] for row in rows} == {2016}
+
+
+def test_parquet(crawl):
+    dataset = pytest.importorskip('pyarrow.dataset')
+    crawl('--format', 'parquet')
+    directory = os.path.join('data', 'parquet', 'form990')
+    table = dataset.dataset(directory, partitioning='hive').to_table()
+    rows = table.to_pylist()
+    assert {row['EIN']: (row['BusinessName'], row['Gross Receipts are under $25k'],
+                         row['MissionDesc']) for row in rows} == expected_rows()
+    assert {(row['file_state'], row['file_city']) for row in rows} == {('IL', 'Chicago')}
+    assert {row['TaxYr'] for row in rows} == {2016}
+    # A city with no rows is still started: its partition exists, empty.
+    assert os.path.isdir(os.path.join(directory, 'file_state=IL', 'file_city=Evanston'))
@@ -0,0 +1,112 @@
+"""A crawl that crashes and is resumed must end with the same city files
+as one that never stopped."""
+import os
+
+import pytest
+
+from crawl_journal import CityFiles
+
+HEADER = ['EIN', 'Name']
+CITIES = {
+    'IL/Chicago.txt': ['1', '2', '3'],
+    'IL/Evanston.txt': ['4'],
+    'MI/Detroit.txt': ['5', '6'],
+}
+
+
+class Crash(Exception):
+    pass
+
+
+def crawl(directory, resume=False, crash_after=None):
+    """Write a row per EIN the way get_aws_990_data does, raising Crash
+    (without closing anything) after `crash_after` rows."""
+    city_files = CityFiles(directory, HEADER, resume=resume)
+    written = []
+    for city, eins in CITIES.items():
+        done = city_files.start(city)
+        if done is None:
+            continue
+        for ein in eins:
+            if ein in done:
+                continue
+            if len(written) == crash_after:
+                city_files.journal.close()  # what dying leaves behind
+                raise Crash
+            city_files.write(city, ein, [ein, 'Org ' + ein])
+            written.append(ein)
+    city_files.close()
+    return written
+
+
+def outputs(directory):
+    found = {}
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for fname in filenames:
+            if not fname.startswith('.'):
+                path = os.path.join(dirpath, fname)
+                with open(path) as infile:
+                    found[os.path.relpath(path, directory)] = infile.read()
+    return found
+
+
+@pytest.fixture
+def expected(tmp_path):
+    directory = str(tmp_path / 'uninterrupted')
+    crawl(directory)
+    return outputs(directory)
+
+
+def test_uninterrupted_crawl(expected):
+    assert expected['IL/Chicago.txt'] == 'EIN\tName\n1\tOrg 1\n2\tOrg 2\n3\tOrg 3\n'
+    assert sorted(expected) == sorted(CITIES)
+
+
+@pytest.mark.parametrize('crash_after', range(6))
+def test_resume_after_a_crash(tmp_path, expected, crash_after):
+    directory = str(tmp_path / 'crawl')
+    with pytest.raises(Crash):
+        crawl(directory, crash_after=crash_after)
+    # Only finished cities are visible, and they're already complete.
+    for city, content in outputs(directory).items():
+        assert content == expected[city]
+
+    resumed = crawl(directory, resume=True)
+    assert len(resumed) == 6 - crash_after  # nothing fetched twice
+    assert outputs(directory) == expected
+    assert not os.path.exists(os.path.join(directory, '.partial'))
+
+
+def test_row_written_but_not_journaled(tmp_path, expected):
+    directory = str(tmp_path / 'crawl')
+    with pytest.raises(Crash):
+        crawl(directory, crash_after=2)
+    # Died after writing EIN 3's row but before journaling it, and
+    # part-way through writing the journal line too.
+    with open(os.path.join(directory, '.partial', 'IL', 'Chicago.txt'), 'a') as outfile:
+        outfile.write('3\tOrg 3\n')
+    with open(os.path.join(directory, '.journal'), 'a') as outfile:
+        outfile.write('W\tIL/Chicago.txt\t3')
+
+    assert crawl(directory, resume=True) == ['3', '4', '5', '6']
+    assert outputs(directory) == expected
+
+
+def test_partial_row_is_cut_back(tmp_path, expected):
+    directory = str(tmp_path / 'crawl')
+    with pytest.raises(Crash):
+        crawl(directory, crash_after=1)
+    with open(os.path.join(directory, '.partial', 'IL', 'Chicago.txt'), 'a') as outfile:
+        outfile.write('2\tOr')
+
+    assert crawl(directory, resume=True) == ['2', '3', '4', '5', '6']
+    assert outputs(directory) == expected
+
+
+def test_without_resume_starts_over(tmp_path, expected):
+    directory = str(tmp_path / 'crawl')
+    with pytest.raises(Crash):
+        crawl(directory, crash_after=4)
+    assert len(crawl(directory)) == 6
+    assert outputs(directory) == expected
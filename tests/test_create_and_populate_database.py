@@ -0,0 +1,104 @@
+import json
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+import create_and_populate_database
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SQL_FILES = ['create_nonprofitdb_statements.sql', 'create_nonprofitdb_indexes.sql',
+             'refresh_combined_data.sql']
+
+
+def write_form(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as outfile:
+        outfile.write('EIN\tBusinessName\tIs Terminated\tTaxYr\n')
+        for ein, name in rows:
+            outfile.write('{}\t{}\tF\t2016\n'.format(ein, name))
+
+
+def write_geo(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as outfile:
+        outfile.write('"id","lon_lat"\n')
+        for ein, lon_lat in rows:
+            outfile.write('"{}","{}"\n'.format(ein, lon_lat))
+
+
+def write_tagged(path, tags):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as outfile:
+        json.dump(tags, outfile)
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Two cities sharing EIN 2: Evanston's rows come later in path order."""
+    for name in SQL_FILES:
+        shutil.copy(os.path.join(REPO, name), str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    write_form('data/form990/IL/Chicago.txt', [('1', 'One'), ('2', 'Two in Chicago')])
+    write_form('data/form990N/IL/Evanston.txt', [('2', 'Two in Evanston'), ('3', 'Three')])
+    write_geo('data/geo990/IL/Chicago.txt', [('1', '-87.6,41.8'), ('2', '-87.6,41.9')])
+    write_geo('data/geo990N/IL/Evanston.txt', [('2', '-87.7,42.0'), ('3', '-87.7,42.1')])
+    write_tagged('data/tagged_eins/IL/Chicago.json', {'1': ['arts'], '2': ['arts']})
+    write_tagged('data/tagged_eins/IL/Evanston.json', {'2': ['arts', 'health'], '3': []})
+    with open('data/tagged_eins/all_tags.yml', 'w') as outfile:
+        outfile.write('arts: []\nhealth: []\n')
+    return tmp_path
+
+
+def contents(dbname):
+    conn = sqlite3.connect(dbname)
+    queries = {
+        'nfp': 'SELECT ein, name, path FROM nfp JOIN source_file ON source_id = id',
+        'geo': 'SELECT ein, lon, lat, path FROM geo JOIN source_file ON source_id = id',
+        'tag_lookup': ('SELECT tag.name, ein, path FROM tag_lookup '
+                       'JOIN tag ON tag.id = tag_id JOIN source_file ON source_id = source_file.id'),
+        'location': 'SELECT * FROM location',
+        'nfp_search': 'SELECT rowid, name FROM nfp_search',
+    }
+    found = {table: sorted(conn.execute(query)) for table, query in queries.items()}
+    conn.close()
+    return found
+
+
+def refresh_matches_rebuild():
+    create_and_populate_database.main('refreshed.db')
+    create_and_populate_database.main('rebuilt.db', rebuild=True)
+    assert contents('refreshed.db') == contents('rebuilt.db')
+
+
+def test_refresh_after_removing_the_later_file(data_dir):
+    create_and_populate_database.main('refreshed.db')
+    os.remove('data/form990N/IL/Evanston.txt')
+    os.remove('data/geo990N/IL/Evanston.txt')
+    os.remove('data/tagged_eins/IL/Evanston.json')
+    refresh_matches_rebuild()
+    assert ('2', 'Two in Chicago', os.path.join('data', 'form990', 'IL', 'Chicago.txt')) in \
+        contents('refreshed.db')['nfp']
+
+
+def test_refresh_after_editing_the_earlier_file(data_dir):
+    create_and_populate_database.main('refreshed.db')
+    write_form('data/form990/IL/Chicago.txt', [('1', 'One'), ('2', 'Two, edited')])
+    write_geo('data/geo990/IL/Chicago.txt', [('1', '-87.6,41.8'), ('2', '-87.5,41.5')])
+    write_tagged('data/tagged_eins/IL/Chicago.json', {'1': ['arts'], '2': ['health']})
+    refresh_matches_rebuild()
+    assert ('2', 'Two in Evanston', os.path.join('data', 'form990N', 'IL', 'Evanston.txt')) in \
+        contents('refreshed.db')['nfp']
+
+
+def test_combined_data_leaves_out_source_id(data_dir):
+    create_and_populate_database.main('nonprofits.db', materialize=True)
+    conn = sqlite3.connect('nonprofits.db')
+    for table in ('combined_data', 'combined_data_materialized'):
+        columns = [row[1] for row in conn.execute('PRAGMA table_info({})'.format(table))]
+        assert 'source_id' not in columns
+        assert columns[:2] == ['ein', 'tax_year'] and 'joined_tags' in columns
+    assert conn.execute("SELECT name, joined_tags FROM combined_data WHERE ein = '1'"
+                        ).fetchall() == [('One', 'arts')]
+    conn.close()
@@ -0,0 +1,85 @@
+"""The index files are parsed in chunks; every chunk size must give the
+same filings as loading the whole file."""
+import io
+import json
+import os
+
+import pytest
+
+from filing_index import FilingIndex, iter_filings
+
+
+FILINGS = [
+    {'EIN': '010000007', 'TaxPeriod': '201412', 'FormType': '990',
+     'ObjectId': '201541349349307794',
+     'URL': 'https://s3.amazonaws.com/irs-form-990/201541349349307794_public.xml'},
+    {'EIN': '010000007', 'TaxPeriod': '201512', 'FormType': '990',
+     'ObjectId': '201621349349300112', 'OrganizationName': 'A "quoted" name, [with] {braces}'},
+    {'EIN': '123456789', 'TaxPeriod': '201506', 'FormType': '990EZ',
+     'URL': 'https://s3.amazonaws.com/irs-form-990/201600000000000001_public.xml'},
+    {'EIN': '000012345', 'TaxPeriod': None, 'FormType': '990PF',
+     'ObjectId': '201700000000000002', 'OrganizationName': 'Ω ☃'},
+]
+
+
+def write_index(path, filings=FILINGS, indent=None):
+    with open(str(path), 'w') as outfile:
+        json.dump({'Filings2016': filings}, outfile, indent=indent)
+    return str(path)
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+def test_every_chunk_size_matches_json_load(tmp_path, indent):
+    path = write_index(tmp_path / 'index_2016.json', indent=indent)
+    with open(path) as infile:
+        expected = json.load(infile)['Filings2016']
+    for chunk_size in range(1, os.path.getsize(path) + 2):
+        assert list(iter_filings(path, chunk_size)) == expected, chunk_size
+
+
+def test_empty_and_padded_lists(tmp_path):
+    path = tmp_path / 'index.json'
+    for text, expected in [
+            ('{"Filings2016": []}', []),
+            ('{"Filings2016": [ \n ]}', []),
+            ('{"Filings2016": [\n{"EIN": "1"} ,\n\t{"EIN": "2"}\n]}', [{'EIN': '1'}, {'EIN': '2'}]),
+            ('{}', [])]:
+        path.write_text(text)
+        for chunk_size in (1, 3, 1 << 20):
+            assert list(iter_filings(str(path), chunk_size)) == expected, (text, chunk_size)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 1 << 20])
+def test_truncated_file_raises(tmp_path, chunk_size):
+    path = write_index(tmp_path / 'index_2016.json')
+    with open(path) as infile:
+        text = infile.read()
+    for cut in (text.index('}, {') + 1, len(text) - 5, len(text) - 2):
+        with open(path, 'w') as outfile:
+            outfile.write(text[:cut])
+        with pytest.raises(ValueError):
+            list(iter_filings(path, chunk_size))
+
+
+def test_build_latest_and_all(tmp_path):
+    path = write_index(tmp_path / 'index_2016.json')
+    index = FilingIndex(str(tmp_path / 'filing_index.db'))
+    out = io.StringIO()
+    index.build([path], batch_size=3, out=out)
+    assert out.getvalue() == 'index_2016.json: 4 filings\n'
+    assert len(index) == 4
+
+    latest = index.latest('010000007')
+    assert (latest.ein, latest.tax_period, latest.form_type) == (10000007, 201512, '990')
+    assert latest.url == 'https://s3.amazonaws.com/irs-form-990/201621349349300112_public.xml'
+    assert [f.tax_period for f in index.all('010000007')] == [201412, 201512]
+    # No ObjectId: it comes from the URL.
+    assert index.latest('123456789').object_id == 201600000000000001
+    assert index.latest('12345').form_type == '990PF'
+    assert index.latest('999999999') is None
+    assert index.latest('not an ein') is None and index.all('') == []
+
+    out = io.StringIO()
+    index.build([path], out=out)
+    assert out.getvalue() == 'index_2016.json: already loaded\n'
+    index.close()
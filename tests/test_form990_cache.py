@@ -0,0 +1,72 @@
+import json
+import gzip
+import os
+import sys
+import zlib
+
+import pytest
+
+import form990_pipeline
+import get_aws_990_data
+from form990_cache import DocumentCache
+
+URL = 'https://s3.amazonaws.com/irs-form-990/201541349349307794_public.xml'
+DOCUMENT = b'<Return>' + b' '.join(str(i * 7919 % 10007).encode() for i in range(2000)) + b'</Return>'
+
+
+def test_put_and_get(tmp_path):
+    cache = DocumentCache(str(tmp_path))
+    assert cache.get(URL) is None
+    cache.put(URL, DOCUMENT)
+    assert cache.path(URL).endswith(os.path.join('94', '77', '201541349349307794.xml.gz'))
+    assert cache.get(URL) == DOCUMENT
+    assert (cache.hits, cache.misses, cache.bytes_saved) == (1, 1, len(DOCUMENT))
+
+
+def truncated(data):
+    return data[:len(data) // 2]
+
+
+def corrupt_deflate(data):
+    # A good 10-byte gzip header followed by a damaged deflate stream,
+    # which zlib itself rejects.
+    data = gzip.compress(DOCUMENT)
+    damaged = data[:10] + bytes(b ^ 0xff for b in data[10:14]) + data[14:]
+    with pytest.raises(zlib.error):
+        gzip.decompress(damaged)
+    return damaged
+
+
+def not_gzip(data):
+    return b'<Return>not compressed</Return>'
+
+
+@pytest.mark.parametrize('damage', [truncated, corrupt_deflate, not_gzip])
+def test_unreadable_entries_are_misses(tmp_path, damage):
+    cache = DocumentCache(str(tmp_path))
+    cache.put(URL, DOCUMENT)
+    with open(cache.path(URL), 'rb') as infile:
+        data = infile.read()
+    with open(cache.path(URL), 'wb') as outfile:
+        outfile.write(damage(data))
+    assert cache.get(URL) is None
+    assert cache.misses == 1
+    cache.put(URL, DOCUMENT)  # fetched again, and stored over it
+    assert cache.get(URL) == DOCUMENT
+
+
+def test_an_interrupted_crawl_keeps_its_stats(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache_dir = str(tmp_path / 'xml_cache')
+    DocumentCache(cache_dir).put(URL, DOCUMENT)
+
+    def interrupted(jobs, fetcher, *args, **kwargs):
+        fetcher.cache.get(URL)
+        fetcher.cache.get(URL.replace('7794', '0000'))
+        raise KeyboardInterrupt
+    monkeypatch.setattr(form990_pipeline, 'run', interrupted)
+    monkeypatch.setattr(sys, 'argv', ['get_aws_990_data.py', '--cache-dir', cache_dir])
+    with pytest.raises(KeyboardInterrupt):
+        get_aws_990_data.main()
+    with open(os.path.join(cache_dir, 'stats.json')) as infile:
+        assert json.load(infile) == dict(hits=1, misses=1, bytes_saved=len(DOCUMENT))
@@ -0,0 +1,45 @@
+import threading
+import time
+
+from geocode_cache import GeocodeCache, normalize_address
+
+
+def test_normalize_address():
+    assert normalize_address('c/o Jo  Smith, 8606 S. Blackstone Ave.', 'Chicago', 'il',
+                             '60619-1234') == 'C O JO SMITH 8606 S BLACKSTONE AVE|CHICAGO|IL|60619'
+
+
+def test_two_writers_share_the_cache(tmp_path):
+    # As the 990 and 990-N geocoding stages do, each with its own connection.
+    path = str(tmp_path / 'geocode_cache.db')
+    first = GeocodeCache(path)
+    first.conn.execute('BEGIN IMMEDIATE')
+    first.conn.execute("INSERT INTO geocode (address, result) VALUES ('A', 'No_Match')")
+
+    def write_second():
+        second = GeocodeCache(path)
+        second.put_many([('B', ['Match', 'Exact'])])  # waits for the first to commit
+        second.close()
+
+    writer = threading.Thread(target=write_second)
+    writer.start()
+    time.sleep(0.5)
+    first.conn.commit()
+    writer.join()
+    assert first.get('A') == ['No_Match'] and first.get('B') == ['Match', 'Exact']
+    first.close()
+
+
+def test_readers_dont_hold_up_a_writer(tmp_path):
+    path = str(tmp_path / 'geocode_cache.db')
+    reader, writer = GeocodeCache(path), GeocodeCache(path)
+    writer.put_many([('A', ['No_Match'])])
+    reader.conn.execute('BEGIN')
+    assert reader.get('A') == ['No_Match']  # a read transaction left open
+    start = time.perf_counter()
+    writer.put_many([('B', ['Match', 'Exact'])])
+    assert time.perf_counter() - start < 1
+    reader.conn.rollback()
+    assert reader.get('B') == ['Match', 'Exact']
+    reader.close()
+    writer.close()
@@ -0,0 +1,59 @@
+"""Run get_form990N_data.py on a few epostcard rows instead of the IRS download."""
+import contextlib
+import io
+import os
+import runpy
+import sys
+
+import pytest
+
+import city_matcher
+import streaming_zip
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def epostcard_row(ein, city, state):
+    row = [''] * 26
+    row[0], row[2], row[18], row[20], row[22] = ein, 'Some Nonprofit', city, state, 'US'
+    return '|'.join(row)
+
+
+@pytest.fixture
+def fetch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join('data', 'census_places_lon_lat'))
+    for state, places in [('IL', ['Chicago', 'Evanston']), ('WA', ['Seattle'])]:
+        with open(os.path.join('data', 'census_places_lon_lat', state + '.txt'), 'w') as outfile:
+            outfile.write('city\tlon\tlat\n')
+            outfile.writelines('{}\t0\t0\n'.format(place) for place in places)
+    rows = [epostcard_row('1', 'CHICGO', 'IL'), epostcard_row('2', 'SEATLE', 'WA'),
+            epostcard_row('3', 'Evanstn', 'IL')]
+    monkeypatch.setattr(streaming_zip, 'open_zipped_text',
+                        lambda url: contextlib.closing(io.StringIO('\n'.join(rows) + '\n')))
+    corrected = []
+    correct = city_matcher.CitySpeller.correct
+
+    def spy(self, city, state):
+        corrected.append(state)
+        return correct(self, city, state)
+    monkeypatch.setattr(city_matcher.CitySpeller, 'correct', spy)
+
+    def run(*args):
+        monkeypatch.setattr(sys, 'argv', ['get_form990N_data.py'] + list(args))
+        runpy.run_path(os.path.join(REPO, 'get_form990N_data.py'))
+        return corrected
+    return run
+
+
+def test_fix_cities_only_corrects_the_selected_states(fetch):
+    corrected = fetch('--states', 'IL', '--fix-cities')
+    assert corrected == ['IL', 'IL']
+    assert sorted(os.listdir(os.path.join('data', 'form990N', 'IL'))) == [
+        'Chicago.txt', 'Evanston.txt']
+    assert not os.path.exists(os.path.join('data', 'form990N', 'WA'))
+
+
+def test_cities_are_matched_after_correcting(fetch):
+    fetch('--states', 'all', '--cities', 'Seattle', '--fix-cities')
+    assert os.listdir(os.path.join('data', 'form990N')) == ['WA']
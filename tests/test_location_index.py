@@ -0,0 +1,67 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+import create_and_populate_database
+from location_index import LocationIndex, haversine_km
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PLACES = [
+    # ein as loaded, lon, lat
+    ('360000001', -87.63, 41.88),
+    ('12345', -87.64, 41.89),       # short: stored without its leading zeros
+    ('000054321', -87.62, 41.87),
+    ('360000002', -122.33, 47.61),  # Seattle
+]
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    for name in ['create_nonprofitdb_statements.sql', 'create_nonprofitdb_indexes.sql']:
+        shutil.copy(os.path.join(REPO, name), str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join('data', 'form990', 'IL'))
+    os.makedirs(os.path.join('data', 'geo990', 'IL'))
+    with open(os.path.join('data', 'form990', 'IL', 'Chicago.txt'), 'w') as outfile:
+        outfile.write('EIN\tBusinessName\tIs Terminated\tTaxYr\tState\n')
+        for ein, __, __ in PLACES:
+            outfile.write('{}\tOrg {}\tF\t2016\tIL\n'.format(ein, ein))
+    with open(os.path.join('data', 'geo990', 'IL', 'Chicago.txt'), 'w') as outfile:
+        outfile.write('"id","lon_lat"\n')
+        for ein, lon, lat in PLACES:
+            outfile.write('"{}","{},{}"\n'.format(ein, lon, lat))
+    create_and_populate_database.main('nonprofits.db')
+    index = LocationIndex('nonprofits.db')
+    yield index
+    index.close()
+
+
+CHICAGO = {'360000001', '12345', '000054321'}
+
+
+def test_bbox_finds_short_eins(index):
+    assert {place.ein for place in index.bbox(-88, 41.5, -87.5, 42)} == CHICAGO
+
+
+def test_radius_and_nearest_find_short_eins(index):
+    places = index.radius(-87.63, 41.88, 5)
+    assert {place.ein for place in places} == CHICAGO
+    assert [place.distance_km for place in places] == sorted(
+        haversine_km(-87.63, 41.88, place.lon, place.lat) for place in places)
+    assert [place.ein for place in index.nearest(-87.64, 41.89, k=2)][0] == '12345'
+    assert {place.ein for place in index.nearest(-87.63, 41.88, k=4)} == CHICAGO | {'360000002'}
+
+
+def test_an_old_location_table_is_rebuilt(index):
+    index.conn.execute('DROP TABLE location')
+    index.conn.execute('CREATE VIRTUAL TABLE location USING rtree('
+                       'id, min_lon, max_lon, min_lat, max_lat)')
+    index.conn.commit()
+    create_and_populate_database.main('nonprofits.db')
+    conn = sqlite3.connect('nonprofits.db')
+    assert sorted(ein for ein, in conn.execute('SELECT ein FROM location')) == sorted(
+        ein for ein, __, __ in PLACES)
+    conn.close()
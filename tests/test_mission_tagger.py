@@ -0,0 +1,127 @@
+"""The single-pass tagger must tag exactly as one matcher at a time does.
+
+The missions are the ones `mission_corpus` builds: name, activity,
+mission and description, with the city files' header rows skipped.
+"""
+import os
+
+import pytest
+import yaml
+
+import mission_corpus
+from mission_tagger import Tagger, naive_tags, tag_missions
+from retag_everything import changed_tags, check, tag_everything
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def all_tags():
+    with open(os.path.join(REPO, 'all_tags.yml')) as infile:
+        return yaml.safe_load(infile)
+
+
+def sample_missions(tags):
+    """A few missions per tag, some with several tags' matchers in them."""
+    missions = []
+    for tag, matchers in tags.items():
+        for matcher in matchers[:3]:
+            missions.append('We support {} in our community'.format(matcher))
+            missions.append(matcher.upper() + ' FOR ALL')
+        missions.append(' and '.join(matchers[-2:]))
+    everything = [m for matchers in tags.values() for m in matchers]
+    missions.append(' '.join(everything[::7]))
+    missions.append('x' * (Tagger.SCAN_LIMIT * 10) + everything[-1])
+    missions += ['', 'nothing to see here', 'Ω unicode ☃ text']
+    return missions
+
+
+def test_tagger_matches_naive_tags_on_all_tags(all_tags):
+    tagger = Tagger(all_tags)
+    assert tagger.scan is None  # the automaton, not the scan
+    for mission in sample_missions(all_tags):
+        assert tagger.tags(mission) == naive_tags(all_tags, mission), mission
+
+
+@pytest.mark.parametrize('extra', [0, 1])
+def test_tagger_either_side_of_scan_limit(extra):
+    count = Tagger.SCAN_LIMIT + extra
+    tags = {'tag{}'.format(i): ['word{}x'.format(i)] for i in range(count)}
+    tagger = Tagger(tags)
+    assert (tagger.scan is None) == bool(extra)
+    long_text = ' '.join('Word{}X'.format(i) for i in range(0, count, 3)) * 5
+    assert tagger.tags(long_text) == naive_tags(tags, long_text)
+
+
+def test_overlapping_matchers():
+    # Matchers inside, and overlapping, other matchers: "ushers" holds
+    # "she", "he" and "hers"; "hishe" needs a failure link to find "she".
+    tags = {'a': ['he', 'she'], 'b': ['hers'], 'c': ['his'], 'd': ['shell'], 'e': ['us']}
+    tagger = Tagger(tags)
+    tagger.scan = None  # use the automaton even for this few matchers
+    for text in ['ushers', 'hishe', 'SHEL', 'shell', 'h', '', 'ahishers']:
+        assert tagger.tags(text) == naive_tags(tags, text), text
+
+
+def test_tag_missions_in_a_pool(all_tags):
+    missions = list(enumerate(sample_missions(all_tags)))
+    expected = [(i, naive_tags(all_tags, m)) for i, m in missions]
+    assert list(tag_missions(missions, all_tags, processes=2, chunksize=7)) == expected
+
+
+def write(path, lines):
+    os.makedirs(os.path.dirname(str(path)), exist_ok=True)
+    with open(str(path), 'w') as outfile:
+        outfile.write('\n'.join('\t'.join(line) for line in lines) + '\n')
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    header = ['EIN', 'TaxYr', 'BusinessName', 'ActivityOrMissionDesc', 'MissionDesc', 'Desc']
+    write(tmp_path / 'form990' / 'IL' / 'Chicago.txt', [
+        header,
+        ['1', '2016', 'Chicago Youth Choir', 'Singing', 'Music for kids', 'Music for kids'],
+        ['2', '2016', 'Lakeside Clinic', '', 'Free health care', 'Dental too'],
+    ])
+    write(tmp_path / 'form990N' / 'IL' / 'Chicago.txt', [
+        ['EIN', 'Tax Year', 'Organization Name'],
+        ['3', '2016', 'Friends of the Library'],
+    ])
+    sources = (str(tmp_path / 'form990'), str(tmp_path / 'form990N'))
+    loaded = mission_corpus.load(str(tmp_path / 'corpus.snapshot'), sources=sources)
+    yield loaded
+    loaded.close()
+
+
+def test_corpus_missions(corpus):
+    # The activity is part of the mission, and the header row isn't a mission.
+    assert corpus.missions() == {
+        '1': 'Chicago Youth Choir  Singing  Music for kids',
+        '2': 'Lakeside Clinic  Free health care  Dental too',
+        '3': 'Friends of the Library',
+    }
+
+
+def test_tag_everything_matches_naive_tags(corpus, all_tags):
+    missions = corpus.missions()
+    tagged, unmatched, no_mission = tag_everything(missions, all_tags, processes=1)
+    assert check(missions, all_tags, tagged) == []
+    assert 'arts' in tagged['1'] and 'health' in tagged['2']
+
+
+def test_incremental_retag_matches_a_full_retag(all_tags):
+    missions = {str(i): m for i, m in enumerate(sample_missions(all_tags))}
+    previous, __, __ = tag_everything(missions, all_tags, processes=1)
+
+    edited = dict(all_tags)
+    first, second = list(edited)[:2]
+    edited[first] = edited[first][1:]                 # a matcher removed
+    edited[second] = edited[second] + ['community']   # a matcher added
+    del edited[list(edited)[-1]]                      # a tag removed
+    edited['brand new'] = ['support']                 # a tag added
+    changed = changed_tags(all_tags, edited)
+
+    full = tag_everything(missions, edited, processes=1)
+    incremental = tag_everything(missions, edited, processes=1,
+                                 previous=previous, changed=changed)
+    assert incremental == full
@@ -0,0 +1,134 @@
+import os
+
+import pytest
+
+import run_pipeline
+from run_pipeline import Stage, pipeline, plan, why_stale
+
+
+def test_geocoding_runs_after_the_census_places():
+    order = [stage.name for stage in plan(pipeline(), ['geocode990N', 'geocode990'])]
+    assert order.index('census_places') < order.index('geocode990N')
+    assert order.index('census_places') < order.index('geocode990')
+
+
+@pytest.mark.parametrize('jobs', [0, -1])
+def test_run_wants_at_least_one_job(jobs, tmp_path):
+    with pytest.raises(ValueError):
+        run_pipeline.run(pipeline(), jobs=jobs, state_path=str(tmp_path / 'state.json'))
+
+
+def test_main_rejects_no_jobs(monkeypatch):
+    monkeypatch.setattr('sys.argv', ['run_pipeline.py', '--jobs', '0'])
+    with pytest.raises(SystemExit) as exited:
+        run_pipeline.main()
+    assert exited.value.code == 2
+
+
+# ------------------------------------------------------- plan and staleness
+def test_plan_orders_each_stage_after_what_it_needs():
+    stages = pipeline()
+    order = [stage.name for stage in plan(stages, ['retag'])]
+    assert sorted(order) == ['form990', 'form990N', 'pub78', 'retag']
+    names = [stage.name for stage in plan(stages, ['database'])]
+    for stage in plan(stages, ['database']):
+        for before in stage.after:
+            assert names.index(before) < names.index(stage.name)
+    assert len(plan(stages, ['database', 'retag', 'pub78'])) == len(stages)
+
+
+def test_plan_rejects_unknown_stages_and_cycles():
+    stages = [Stage('a', ['a.py'], [], [], ['c']),
+              Stage('b', ['b.py'], [], [], ['a']),
+              Stage('c', ['c.py'], [], [], ['b'])]
+    with pytest.raises(ValueError, match='no such stage: nope'):
+        plan(pipeline(), ['nope'])
+    with pytest.raises(ValueError, match='a -> c -> b -> a'):
+        plan(stages, ['a'])
+    with pytest.raises(ValueError, match='no such stage'):
+        pipeline(stage_args={'nope': ['--x']})
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as outfile:
+        outfile.write(text)
+
+
+# A stage that copies its input, upper-cased, to its output.
+SCRIPT = """import sys
+with open(sys.argv[1]) as infile, open(sys.argv[2], 'w') as outfile:
+    outfile.write(infile.read().upper())
+"""
+
+
+@pytest.fixture
+def toy(tmp_path, monkeypatch):
+    """Two stages, 'first' (in.txt --> mid.txt) then 'second'
+    (mid.txt --> out.txt), in a scratch directory."""
+    monkeypatch.chdir(tmp_path)
+    write('copy.py', SCRIPT)
+    write('fail.py', 'raise SystemExit(3)\n')
+    write('in.txt', 'hello\n')
+    return [Stage('first', ['copy.py', 'in.txt', 'mid.txt'], ['in.txt'], ['mid.txt'], []),
+            Stage('second', ['copy.py', 'mid.txt', 'out.txt'], ['mid.txt'], ['out.txt'],
+                  ['first'])]
+
+
+def statuses(results):
+    return [(r.stage, r.status, r.reason) for r in results]
+
+
+def test_why_stale(toy):
+    first = toy[0]
+    assert why_stale(first, {}, False) == 'never run'
+    assert why_stale(first, {}, True) == 'forced'
+
+    run_pipeline.run(toy, ['second'], jobs=1, state_path='state.json', log_dir='logs')
+    state = run_pipeline.read_state('state.json')
+    assert why_stale(first, state, False) is None
+    assert why_stale(first, state, True) == 'forced'
+
+    os.remove('mid.txt')
+    assert why_stale(first, state, False) == 'outputs missing'
+    write('mid.txt', 'HELLO\n')
+    assert why_stale(first, state, False) is None
+
+    flagged = first._replace(command=first.command + ['--flag'])
+    assert why_stale(flagged, state, False) == 'inputs changed'
+    write('in.txt', 'hello again\n')
+    assert why_stale(first, state, False) == 'inputs changed'
+
+
+def test_run_dry_run_and_up_to_date(toy):
+    def run(**kwargs):
+        return statuses(run_pipeline.run(toy, ['second'], jobs=2, state_path='state.json',
+                                         log_dir='logs', **kwargs))
+
+    assert run(dry_run=True) == [('first', 'would run', 'never run'),
+                                 ('second', 'would run', 'never run')]
+    assert not os.path.exists('state.json')
+
+    assert run() == [('first', 'ran', 'never run'), ('second', 'ran', 'never run')]
+    with open('out.txt') as infile:
+        assert infile.read() == 'HELLO\n'
+    assert run() == [('first', 'up to date', ''), ('second', 'up to date', '')]
+
+    write('in.txt', 'changed\n')
+    assert run(dry_run=True) == [('first', 'would run', 'inputs changed'),
+                                 ('second', 'would run', 'runs after first')]
+    assert run(force=['all'], dry_run=True) == [('first', 'would run', 'forced'),
+                                                ('second', 'would run', 'forced')]
+    assert run() == [('first', 'ran', 'inputs changed'), ('second', 'ran', 'inputs changed')]
+    with open('out.txt') as infile:
+        assert infile.read() == 'CHANGED\n'
+
+
+def test_a_failed_stage_blocks_what_comes_after(toy):
+    failing = [toy[0]._replace(command=['fail.py']), toy[1]]
+    results = statuses(run_pipeline.run(failing, ['second'], jobs=1,
+                                        state_path='state.json', log_dir='logs'))
+    assert results[0][:2] == ('first', 'failed')
+    assert results[0][2].startswith('exit code 3')
+    assert results[1] == ('second', 'blocked', '')
+    assert run_pipeline.read_state('state.json') == {}
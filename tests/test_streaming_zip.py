@@ -0,0 +1,71 @@
+import io
+import zipfile
+
+import pytest
+
+import streaming_zip
+from streaming_zip import open_zipped_text
+
+TEXT = ''.join('{}|Organization {}|Chicago|IL\r\n'.format(i, i) for i in range(2000)) + 'é ünïcode\n'
+
+
+class Unseekable(io.RawIOBase):
+    """Where zipfile has to write a data descriptor after each member."""
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+def archive(compression, data_descriptor=False):
+    out = Unseekable() if data_descriptor else io.BytesIO()
+    with zipfile.ZipFile(out, 'w', compression) as zipped:
+        with zipped.open('data-download-epostcard.txt', 'w') as member:
+            member.write(TEXT.encode('utf-8'))
+        zipped.writestr('second.txt', 'not read')
+    return bytes(out.data) if data_descriptor else out.getvalue()
+
+
+def url_for(tmp_path, data):
+    path = tmp_path / 'download.zip'
+    path.write_bytes(data)
+    return path.as_uri()
+
+
+@pytest.mark.parametrize('compression, data_descriptor, streamed', [
+    (zipfile.ZIP_DEFLATED, False, True),
+    (zipfile.ZIP_DEFLATED, True, True),
+    (zipfile.ZIP_STORED, False, False),
+    (zipfile.ZIP_STORED, True, False),
+])
+def test_first_member(tmp_path, monkeypatch, compression, data_descriptor, streamed):
+    data = archive(compression, data_descriptor)
+    flags = int.from_bytes(data[6:8], 'little')
+    assert bool(flags & 0x8) == data_descriptor
+    spooled = []
+    real_zipfile = zipfile.ZipFile
+    monkeypatch.setattr(streaming_zip.zipfile, 'ZipFile',
+                        lambda *args: spooled.append(args) or real_zipfile(*args))
+    with open_zipped_text(url_for(tmp_path, data), chunk_size=100) as infile:
+        assert infile.read() == TEXT  # newlines untouched, for csv
+    assert bool(spooled) != streamed
+
+
+def test_small_reads_across_chunks(tmp_path):
+    url = url_for(tmp_path, archive(zipfile.ZIP_DEFLATED))
+    with open_zipped_text(url, chunk_size=7) as infile:
+        lines = list(infile)
+    assert ''.join(lines) == TEXT
+    assert len(lines) == 2001
+
+
+def test_truncated_download(tmp_path):
+    data = archive(zipfile.ZIP_DEFLATED)
+    with pytest.raises(zipfile.BadZipFile):
+        with open_zipped_text(url_for(tmp_path, data[:len(data) // 3])) as infile:
+            infile.read()